@@ -206,7 +206,58 @@ CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_TIMEZONE = "Asia/Shanghai"
+# autodiscover 只会加载 gallery.tasks，其余任务模块需显式导入
+CELERY_IMPORTS = ("gallery.tasks_ai", "gallery.tasks_pipeline")
 
 # -------- CORS --------
 CORS_ALLOWED_ORIGINS = os.getenv("CORS_ALLOWED_ORIGINS", "").split(",") if os.getenv("CORS_ALLOWED_ORIGINS") else []
-CORS_ALLOW_CREDENTIALS = True
\ No newline at end of file
+CORS_ALLOW_CREDENTIALS = True
+# -------- 向量检索 --------
+# 用户向量数达到 GALLERY_ANN_MIN_SIZE 后启用 IVF 近似检索；NPROBE 越大召回越高、延迟越高
+GALLERY_ANN_MIN_SIZE = int(os.getenv("GALLERY_ANN_MIN_SIZE", "20000"))
+GALLERY_ANN_NLIST = int(os.getenv("GALLERY_ANN_NLIST", "0"))  # 0 表示按 sqrt(N) 自动推算
+GALLERY_ANN_NPROBE = int(os.getenv("GALLERY_ANN_NPROBE", "8"))
+GALLERY_ANN_DIR = os.getenv("GALLERY_ANN_DIR", str(BASE_DIR / "var" / "ann"))
+# clip_vector 落库编码：float32 / float16 / int8 / pq（pq 需先训练码本）
+GALLERY_VECTOR_CODEC = os.getenv("GALLERY_VECTOR_CODEC", "float16")
+GALLERY_VECTOR_PQ_CODEBOOK = os.getenv("GALLERY_VECTOR_PQ_CODEBOOK", str(BASE_DIR / "var" / "pq_codebook.npy"))
+# 进程内向量索引的存储精度：float32 / float16 / int8 / pq（需 PQ 码本，直接在码上打分）
+GALLERY_VECTOR_INDEX_DTYPE = os.getenv("GALLERY_VECTOR_INDEX_DTYPE", "float16")
+
+# -------- AI 批处理 --------
+# 开启后单张上传的 CLIP 编码先进入 Redis 收集器，凑满 BATCH_SIZE 或等待 BATCH_WAIT_MS 后批量推理
+# 默认关闭（逐张任务）；开启需要 Redis，且由 task_flush_clip_batch 负责刷新未凑满的批次
+GALLERY_CLIP_BATCHING = os.getenv("GALLERY_CLIP_BATCHING", "False") == "True"
+GALLERY_CLIP_BATCH_SIZE = int(os.getenv("GALLERY_CLIP_BATCH_SIZE", "32"))
+GALLERY_CLIP_BATCH_WAIT_MS = int(os.getenv("GALLERY_CLIP_BATCH_WAIT_MS", "500"))
+GALLERY_CLIP_DECODE_WORKERS = int(os.getenv("GALLERY_CLIP_DECODE_WORKERS", "4"))
+# 上传后改为单个融合任务：读取一次原图，依次完成 EXIF/缩略图/CLIP/人脸并统一落库（不参与 CLIP 微批）
+GALLERY_FUSED_PIPELINE = os.getenv("GALLERY_FUSED_PIPELINE", "False") == "True"
+# 人脸检测解码的目标像素数（JPEG 走 DCT 缩放解码）
+GALLERY_FACE_MAX_PIXELS = int(os.getenv("GALLERY_FACE_MAX_PIXELS", "1600000"))
+# Worker 本地原图缓存目录（留空关闭），S3 模式下避免同一原图被多个任务重复下载
+GALLERY_BLOB_CACHE_DIR = os.getenv("GALLERY_BLOB_CACHE_DIR", "")
+GALLERY_BLOB_CACHE_MAX_MB = int(os.getenv("GALLERY_BLOB_CACHE_MAX_MB", "2048"))
+# 原图/渲染缓存每累计多少次查找输出一条命中率日志（0 关闭）
+GALLERY_BLOB_CACHE_STATS_EVERY = int(os.getenv("GALLERY_BLOB_CACHE_STATS_EVERY", "1000"))
+# 上传完成时在请求内按文件头（Range 读取）提取 JPEG 的 EXIF，不再排队执行 EXIF 任务
+GALLERY_INLINE_EXIF = os.getenv("GALLERY_INLINE_EXIF", "True") == "True"
+# 重复上传（同一用户、相同 SHA-256）的处理：reference 建引用行共用文件与结果 / reject 返回已有照片 / off
+GALLERY_DUPLICATE_POLICY = os.getenv("GALLERY_DUPLICATE_POLICY", "reference")
+# 近重复（连拍 / 轻微编辑）判定的 dHash 汉明距离上限，越大越宽松，索引分段数为该值 + 1
+GALLERY_NEAR_DUP_RADIUS = int(os.getenv("GALLERY_NEAR_DUP_RADIUS", "6"))
+# 表单上传的落盘目录；与 MEDIA_ROOT 同一文件系统时保存原图只需 rename
+GALLERY_UPLOAD_TEMP_DIR = os.getenv("GALLERY_UPLOAD_TEMP_DIR", str(BASE_DIR / "var" / "uploads"))
+# 直传接口共用的 S3 客户端连接池大小（应不小于 gunicorn 线程数 × 并发签名/HEAD 请求数）
+GALLERY_S3_MAX_POOL_CONNECTIONS = int(os.getenv("GALLERY_S3_MAX_POOL_CONNECTIONS", "50"))
+# 批量预签名单次请求的上限：presign_upload_batch 的文件数与 multipart_sign_parts 的分片数
+GALLERY_PRESIGN_BATCH_MAX = int(os.getenv("GALLERY_PRESIGN_BATCH_MAX", "500"))
+# 多尺寸派生图：目标长边（逗号分隔，留空不生成）与输出格式（Pillow 不支持的格式回退为 JPEG）
+GALLERY_RENDITION_SIZES = os.getenv("GALLERY_RENDITION_SIZES", "256,1024,2048")
+GALLERY_RENDITION_FORMATS = os.getenv("GALLERY_RENDITION_FORMATS", "webp,jpeg")
+# 按需渲染：允许的尺寸档位（请求值向上取整）与渲染结果的本地 LRU 缓存
+GALLERY_RENDER_SIZES = os.getenv("GALLERY_RENDER_SIZES", "128,256,512,1024,2048")
+GALLERY_RENDER_CACHE_DIR = os.getenv("GALLERY_RENDER_CACHE_DIR", str(BASE_DIR / "var" / "renders"))
+GALLERY_RENDER_CACHE_MAX_MB = int(os.getenv("GALLERY_RENDER_CACHE_MAX_MB", "1024"))
+# 标签预设文本向量的磁盘缓存目录（按模型名、预训练标识与标签集合哈希分文件）
+GALLERY_AI_CACHE_DIR = os.getenv("GALLERY_AI_CACHE_DIR", str(BASE_DIR / "var" / "clip_text"))
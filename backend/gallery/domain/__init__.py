@@ -6,6 +6,8 @@ from .albums import (
     MultipartCompleteResult,
     MultipartInitiateResult,
     MultipartSignPartResult,
+    MultipartSignPartsResult,
+    PresignUploadBatchResult,
     PresignUploadResult,
     UploadEnvelope,
 )
@@ -16,6 +18,8 @@ __all__ = [
     "MultipartCompleteResult",
     "MultipartInitiateResult",
     "MultipartSignPartResult",
+    "MultipartSignPartsResult",
+    "PresignUploadBatchResult",
     "PresignUploadResult",
     "UploadEnvelope",
 ]
@@ -2,22 +2,31 @@
 
 from __future__ import annotations
 
+import base64
 from dataclasses import asdict, dataclass, field
 from datetime import timedelta
 from typing import Any, Dict, Iterable, List, Sequence
 
+from django.conf import settings
 from django.core.exceptions import PermissionDenied, ValidationError
 from django.utils import timezone
 
 from ..models import Album, AlbumShare, Photo
+from ..services.dedup import duplicate_policy, find_originals, make_reference
 from ..services.storage import get_upload_storage_service
 from ..services.uploads import (
+    apply_header_inline,
     create_photos_from_form_upload,
     dispatch_post_upload_tasks,
+    dispatch_reference_sync,
 )
 from ..utils_uploads import build_object_key, validate_upload_meta
 
 
+# S3 分片号上限
+MAX_PART_NUMBER = 10000
+
+
 @dataclass(frozen=True)
 class UploadEnvelope:
     """统一的用例返回值封装，保证视图层输出结构稳定"""
@@ -39,6 +48,14 @@ class PresignUploadResult:
         return UploadEnvelope(payload=asdict(self))
 
 
+@dataclass(frozen=True)
+class PresignUploadBatchResult:
+    items: List[PresignUploadResult]
+
+    def as_envelope(self) -> UploadEnvelope:
+        return UploadEnvelope(payload=asdict(self))
+
+
 @dataclass(frozen=True)
 class MultipartInitiateResult:
     object_key: str
@@ -57,6 +74,16 @@ class MultipartSignPartResult:
         return UploadEnvelope(payload=asdict(self))
 
 
+@dataclass(frozen=True)
+class MultipartSignPartsResult:
+    # [{"part_number": 1, "url": "..."}]，按分片号升序
+    parts: List[Dict[str, Any]]
+    method: str = "PUT"
+
+    def as_envelope(self) -> UploadEnvelope:
+        return UploadEnvelope(payload=asdict(self))
+
+
 @dataclass(frozen=True)
 class MultipartCompleteResult:
     status: str = "completed"
@@ -96,7 +123,7 @@ class AlbumUseCase:
         serializer.save(owner=self.user)
 
     def list_album_photos(self, album: Album):
-        return album.photos.all().order_by("-uploaded_at")
+        return album.photos.for_listing().order_by("-uploaded_at")
 
     def create_share(self, album: Album, expires_in: int) -> AlbumShare:
         expires_at = timezone.now() + timedelta(seconds=expires_in)
@@ -105,42 +132,133 @@ class AlbumUseCase:
     def upload_from_form(self, album: Album, files: Iterable) -> List[Photo]:
         return create_photos_from_form_upload(self.user, album, files)
 
+    def upload_photo(self, album: Album, uploaded, title: str = "", tag_ids: Sequence[int] = ()) -> Photo:
+        """单张上传（``POST /photos/``）：与相册表单上传共用哈希去重与批量派发。"""
+
+        (photo,) = create_photos_from_form_upload(self.user, album, [uploaded], title, tag_ids)
+        return photo
+
     def _resolve_tags(self, photo: Photo, tag_ids: Sequence[int]):
         if tag_ids:
             photo.tags.set(tag_ids)
 
-    def _create_photo(self, album: Album, object_key: str, title: str, tag_ids: Sequence[int]) -> Photo:
-        photo = Photo.objects.create(owner=self.user, album=album, image=object_key, title=title)
+    def _create_photo(
+        self, album: Album, object_key: str, title: str, tag_ids: Sequence[int], content_hash: str = ""
+    ) -> Photo:
+        policy = duplicate_policy()
+        original = find_originals(self.user.id, [content_hash]).get(content_hash) if policy != "off" else None
+        if original is not None:
+            if object_key != original.image.name:
+                # 重复内容不再保留第二份对象
+                get_upload_storage_service().delete_object(object_key)
+            if policy == "reject":
+                return original
+            photo = make_reference(original, self.user, album, title)
+            photo.save()
+            self._resolve_tags(photo, tag_ids)
+            dispatch_reference_sync([photo.id])
+            return photo
+
+        photo = Photo.objects.create(
+            owner=self.user, album=album, image=object_key, title=title, content_hash=content_hash
+        )
         self._resolve_tags(photo, tag_ids)
-        dispatch_post_upload_tasks(photo.id)
+        dispatch_post_upload_tasks(photo.id, exif_done=apply_header_inline(photo))
         return photo
 
-    def presign_upload(
-        self, album_id: int, filename: str, content_type: str, size: int
-    ) -> UploadEnvelope:
-        album = self.context.require_album(album_id)
+    @staticmethod
+    def _checksum(sha256: str) -> str:
+        """校验十六进制 SHA-256 并转为 S3 使用的 base64 形式。"""
+
+        try:
+            digest = bytes.fromhex(sha256)
+        except ValueError as exc:
+            raise ValidationError("sha256 非法") from exc
+        if len(digest) != 32:
+            raise ValidationError("sha256 非法")
+        return base64.b64encode(digest).decode("ascii")
+
+    def _require_own_key(self, object_key: str) -> None:
+        if not object_key or not object_key.startswith(f"photos/{self.user.id}/"):
+            raise ValidationError("object_key 非法")
+
+    @staticmethod
+    def _batch_max() -> int:
+        return int(getattr(settings, "GALLERY_PRESIGN_BATCH_MAX", 500))
+
+    def _presign_request(self, album: Album, filename: str, content_type: str, size: int, sha256: str):
+        """校验单个文件并返回 ``(object_key, content_type, checksum)``。"""
+
         try:
             validate_upload_meta(content_type, size)
         except ValueError as exc:
             raise ValidationError(str(exc)) from exc
+        checksum = self._checksum(sha256) if sha256 else None
+        return build_object_key(self.user.id, album.id, filename), content_type, checksum
+
+    @staticmethod
+    def _presign_result(object_key: str, content_type: str, checksum, url: str) -> PresignUploadResult:
+        headers = {"Content-Type": content_type}
+        if checksum:
+            headers["x-amz-checksum-sha256"] = checksum
+        return PresignUploadResult(object_key=object_key, url=url, headers=headers)
 
+    def presign_upload(
+        self, album_id: int, filename: str, content_type: str, size: int, sha256: str = ""
+    ) -> UploadEnvelope:
+        album = self.context.require_album(album_id)
+        object_key, content_type, checksum = self._presign_request(album, filename, content_type, size, sha256)
         storage = get_upload_storage_service()
-        object_key = build_object_key(self.user.id, album.id, filename)
-        url = storage.generate_presigned_put(object_key, content_type)
-        result = PresignUploadResult(
-            object_key=object_key,
-            url=url,
-            headers={"Content-Type": content_type},
-        )
-        return result.as_envelope()
+        url = storage.generate_presigned_put(object_key, content_type, checksum_sha256=checksum)
+        return self._presign_result(object_key, content_type, checksum, url).as_envelope()
+
+    def presign_uploads(self, album_id: int, files: Sequence[Dict[str, Any]]) -> UploadEnvelope:
+        """一次为多个文件签名，``files`` 每项为 ``{filename, content_type, size, sha256?}``；任一项非法时整体拒绝。"""
+
+        if not files:
+            raise ValidationError("files 不能为空")
+        if len(files) > self._batch_max():
+            raise ValidationError(f"单次最多签名 {self._batch_max()} 个文件")
+        album = self.context.require_album(album_id)
+        requests = []
+        for index, item in enumerate(files):
+            try:
+                size = int(item.get("size", 0))
+                requests.append(
+                    self._presign_request(
+                        album,
+                        item.get("filename") or "image.jpg",
+                        item.get("content_type") or "image/jpeg",
+                        size,
+                        item.get("sha256") or "",
+                    )
+                )
+            except (AttributeError, TypeError, ValueError) as exc:
+                raise ValidationError(f"第 {index + 1} 个文件参数非法") from exc
+            except ValidationError as exc:
+                raise ValidationError(f"第 {index + 1} 个文件：{'；'.join(exc.messages)}") from exc
+
+        urls = get_upload_storage_service().generate_presigned_puts(requests)
+        items = [self._presign_result(*request, url) for request, url in zip(requests, urls)]
+        return PresignUploadBatchResult(items=items).as_envelope()
+
+    def finalize_upload(
+        self, album_id: int, object_key: str, title: str, tag_ids: Sequence[int], sha256: str = ""
+    ) -> Photo:
+        """``sha256`` 为预签名时声明的哈希，以 S3 校验过的值为准，用于去重。"""
 
-    def finalize_upload(self, album_id: int, object_key: str, title: str, tag_ids: Sequence[int]) -> Photo:
         if not object_key:
             raise ValidationError("object_key 非法")
         album = self.context.require_album(album_id)
         if not object_key.startswith(f"photos/{self.user.id}/{album.id}/"):
             raise ValidationError("object_key 非法")
-        return self._create_photo(album, object_key, title, tag_ids)
+        content_hash = ""
+        if sha256:
+            self._checksum(sha256)
+            content_hash = get_upload_storage_service().object_sha256(object_key) or ""
+            if content_hash and content_hash != sha256.lower():
+                raise ValidationError("sha256 与对象内容不一致")
+        return self._create_photo(album, object_key, title, tag_ids, content_hash)
 
     def initiate_multipart(
         self, album_id: int, filename: str, content_type: str, size: int
@@ -160,8 +278,7 @@ class AlbumUseCase:
     def sign_multipart_part(
         self, object_key: str, upload_id: str, part_number: int
     ) -> UploadEnvelope:
-        if not object_key or f"/{self.user.id}/" not in object_key:
-            raise ValidationError("object_key 非法")
+        self._require_own_key(object_key)
         if part_number <= 0:
             raise ValidationError("part_number 非法")
         storage = get_upload_storage_service()
@@ -169,6 +286,23 @@ class AlbumUseCase:
         result = MultipartSignPartResult(url=url)
         return result.as_envelope()
 
+    def sign_multipart_parts(
+        self, object_key: str, upload_id: str, part_numbers: Iterable[int]
+    ) -> UploadEnvelope:
+        """一次为多个分片签名（分片号 1~10000，去重后升序返回）。"""
+
+        self._require_own_key(object_key)
+        if not upload_id:
+            raise ValidationError("upload_id 非法")
+        numbers = sorted(set(part_numbers))
+        if not numbers or numbers[0] <= 0 or numbers[-1] > MAX_PART_NUMBER:
+            raise ValidationError("part_number 非法")
+        if len(numbers) > self._batch_max():
+            raise ValidationError(f"单次最多签名 {self._batch_max()} 个分片")
+        urls = get_upload_storage_service().generate_presigned_part_urls(object_key, upload_id, numbers)
+        parts = [{"part_number": number, "url": urls[number]} for number in numbers]
+        return MultipartSignPartsResult(parts=parts).as_envelope()
+
     def complete_multipart(
         self,
         album_id: int,
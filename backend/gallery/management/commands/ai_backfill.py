@@ -0,0 +1,195 @@
+"""为存量照片回填 CLIP 向量/标签与人脸分组，支持断点续跑。"""
+
+from __future__ import annotations
+
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from PIL import Image
+
+from gallery.models import Photo
+from gallery.services import get_clip_embedding_service
+from gallery.services.blob_cache import get_blob_cache
+from gallery.services.imaging import CLIP_SHORT_SIDE, open_reduced
+from gallery.tasks_ai import label_rows_for_vectors, store_clip_results, task_face_embeddings_and_group
+
+STAGE_FLAGS = {"clip": "vector_done", "faces": "face_done"}
+
+
+def _decode_for_clip(item: Tuple[int, str]) -> Tuple[int, Optional[Image.Image], Optional[str]]:
+    """在子进程中按 CLIP 输入尺寸降分辨率解码，返回可 pickle 的 RGB 图像。"""
+
+    photo_id, name = item
+    try:
+        cache = get_blob_cache()
+        with (cache.open(default_storage, name) if cache else default_storage.open(name, "rb")) as fh:
+            img = open_reduced(fh, short_side=CLIP_SHORT_SIDE).image.convert("RGB")
+        return photo_id, img, None
+    except Exception as exc:  # 单张失败不影响整体回填
+        return photo_id, None, str(exc)
+
+
+class Checkpoint:
+    """JSON 断点文件，原子写入。"""
+
+    def __init__(self, path: Path, stage: str) -> None:
+        self.path = path
+        self.stage = stage
+        self.state: Dict[str, object] = {"stage": stage, "last_id": 0, "processed": 0, "failed": 0}
+
+    def load(self) -> None:
+        if not self.path.exists():
+            return
+        data = json.loads(self.path.read_text(encoding="utf-8"))
+        if data.get("stage") != self.stage:
+            raise CommandError(f"断点文件 {self.path} 属于阶段 {data.get('stage')}，与 {self.stage} 不符")
+        self.state.update(data)
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.state["updated_at"] = time.time()
+        fd, tmp_name = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump(self.state, fh)
+        os.replace(tmp_name, self.path)
+
+    @property
+    def last_id(self) -> int:
+        return int(self.state["last_id"])
+
+
+class Command(BaseCommand):
+    help = "流式回填存量照片的 CLIP 向量/标签或人脸分组，按 id 键集分页并记录断点"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--stage", choices=sorted(STAGE_FLAGS), default="clip")
+        parser.add_argument("--user", type=int, help="只处理指定用户的照片")
+        parser.add_argument("--chunk-size", type=int, default=256, help="每次从数据库取出的照片数")
+        parser.add_argument("--batch-size", type=int, default=getattr(settings, "GALLERY_CLIP_BATCH_SIZE", 32))
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="解码进程数，0 表示在当前进程解码")
+        parser.add_argument("--language", default="zh")
+        parser.add_argument("--top-k", type=int, default=5)
+        parser.add_argument("--limit", type=int, help="本次最多处理的照片数")
+        parser.add_argument("--checkpoint", help="断点文件路径，默认位于 GALLERY_AI_CACHE_DIR 同级目录")
+        parser.add_argument("--reset", action="store_true", help="忽略已有断点，从头开始")
+
+    def _checkpoint_path(self, options) -> Path:
+        if options["checkpoint"]:
+            return Path(options["checkpoint"])
+        base = Path(getattr(settings, "GALLERY_AI_CACHE_DIR", settings.BASE_DIR / "var")).parent
+        suffix = f"_user{options['user']}" if options["user"] else ""
+        return base / f"ai_backfill_{options['stage']}{suffix}.json"
+
+    def _candidates(self, stage: str, user_id: Optional[int]):
+        qs = Photo.objects.filter(**{STAGE_FLAGS[stage]: False}).exclude(image="")
+        if user_id:
+            qs = qs.filter(owner_id=user_id)
+        return qs
+
+    def _report(self, checkpoint: Checkpoint, done: int, remaining: int, started: float) -> None:
+        elapsed = max(time.monotonic() - started, 1e-6)
+        rate = done / elapsed
+        eta = (remaining - done) / rate if rate > 0 else float("inf")
+        self.stdout.write(
+            f"[{checkpoint.stage}] id≤{checkpoint.last_id} 本次 {done}/{remaining} "
+            f"累计 {checkpoint.state['processed']} 失败 {checkpoint.state['failed']} "
+            f"速率 {rate:.1f} 张/秒 预计剩余 {eta / 60:.1f} 分钟"
+        )
+
+    def handle(self, *args, **options):
+        stage = options["stage"]
+        checkpoint = Checkpoint(self._checkpoint_path(options), stage)
+        if not options["reset"]:
+            checkpoint.load()
+
+        base_qs = self._candidates(stage, options["user"])
+        remaining = base_qs.filter(id__gt=checkpoint.last_id).count()
+        if options["limit"]:
+            remaining = min(remaining, options["limit"])
+        self.stdout.write(f"待处理 {remaining} 张，自 id>{checkpoint.last_id} 继续，断点文件 {checkpoint.path}")
+        if not remaining:
+            return
+
+        started = time.monotonic()
+        done = 0
+        pool = None
+        if stage == "clip":
+            clip_service = get_clip_embedding_service()
+            if options["workers"] > 0:
+                # fork 前关闭数据库连接，子进程只读存储
+                connections.close_all()
+                context = multiprocessing.get_context("fork") if os.name == "posix" else None
+                pool = ProcessPoolExecutor(max_workers=options["workers"], mp_context=context)
+
+        try:
+            while done < remaining:
+                chunk_size = min(options["chunk_size"], remaining - done)
+                rows = list(
+                    base_qs.filter(id__gt=checkpoint.last_id)
+                    .order_by("id")
+                    .values_list("id", "owner_id", "image")[:chunk_size]
+                )
+                if not rows:
+                    break
+
+                if stage == "clip":
+                    failed = self._run_clip_chunk(pool, clip_service, rows, options)
+                else:
+                    failed = self._run_face_chunk(rows)
+
+                done += len(rows)
+                checkpoint.state["last_id"] = rows[-1][0]
+                checkpoint.state["processed"] = int(checkpoint.state["processed"]) + len(rows) - failed
+                checkpoint.state["failed"] = int(checkpoint.state["failed"]) + failed
+                checkpoint.save()
+                self._report(checkpoint, done, remaining, started)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f"完成 {done} 张，用时 {elapsed:.1f} 秒"))
+
+    def _run_clip_chunk(self, pool, clip_service, rows, options) -> int:
+        owners = {photo_id: owner_id for photo_id, owner_id, _ in rows}
+        items = [(photo_id, name) for photo_id, _, name in rows]
+        decoded = pool.map(_decode_for_clip, items) if pool is not None else map(_decode_for_clip, items)
+        failed = 0
+        batch: List[Tuple[Photo, Image.Image]] = []
+        for photo_id, image, error in decoded:
+            if image is None:
+                failed += 1
+                self.stderr.write(f"解码失败 photo_id={photo_id}: {error}")
+                continue
+            batch.append((Photo(id=photo_id, owner_id=owners[photo_id]), image))
+            if len(batch) >= options["batch_size"]:
+                self._encode_batch(clip_service, batch, options)
+                batch = []
+        if batch:
+            self._encode_batch(clip_service, batch, options)
+        return failed
+
+    def _encode_batch(self, clip_service, batch, options) -> None:
+        photos = [photo for photo, _ in batch]
+        vectors = clip_service.encode_images([image for _, image in batch])
+        label_rows = label_rows_for_vectors(clip_service, vectors, options["language"], options["top_k"])
+        store_clip_results(clip_service, photos, vectors, label_rows)
+
+    def _run_face_chunk(self, rows) -> int:
+        failed = 0
+        for photo_id, _, _ in rows:
+            result = task_face_embeddings_and_group(photo_id)
+            if result.startswith("err"):
+                failed += 1
+                self.stderr.write(f"人脸处理失败 photo_id={photo_id}: {result}")
+        return failed
@@ -0,0 +1,207 @@
+"""离线重新聚类用户的全部人脸，修正增量分配的漂移并合并历史单例分组。"""
+
+from __future__ import annotations
+
+import shutil
+import tempfile
+import time
+from array import array
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Set, Tuple
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from gallery.models import FaceGroup, PhotoEmbedding, PhotoFace
+from gallery.services.faces import (
+    FACE_DIM,
+    FACE_MODEL_KEY,
+    bump_face_index_version,
+    bytes_to_encodings,
+    centroid_to_bytes,
+    chinese_whispers,
+    get_face_index_registry,
+    knn_graph,
+)
+
+WRITE_BATCH = 1000
+
+
+class Command(BaseCommand):
+    help = "加载用户全部人脸特征（memmap），在 kNN 图上做 Chinese whispers 聚类并批量重写 FaceGroup/PhotoFace"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, action="append", help="只处理指定用户，可重复")
+        parser.add_argument("--tol", type=float, default=0.48, help="近邻边的最大欧氏距离")
+        parser.add_argument("--k", type=int, default=10, help="每张人脸保留的近邻数")
+        parser.add_argument("--iterations", type=int, default=30)
+        parser.add_argument("--row-chunk", type=int, default=1024, help="kNN 计算每块的行数，决定峰值内存")
+        parser.add_argument("--workdir", help="memmap 临时文件目录，默认系统临时目录")
+        parser.add_argument("--dry-run", action="store_true", help="只聚类并输出统计，不写数据库")
+
+    @contextmanager
+    def _phase(self, timings: Dict[str, float], name: str):
+        started = time.monotonic()
+        yield
+        timings[name] = time.monotonic() - started
+
+    def handle(self, *args, **options):
+        user_ids = options["user"] or list(
+            PhotoEmbedding.objects.filter(model_name=FACE_MODEL_KEY)
+            .values_list("owner_id", flat=True)
+            .distinct()
+            .order_by("owner_id")
+        )
+        for user_id in user_ids:
+            workdir = Path(tempfile.mkdtemp(prefix=f"faces_{user_id}_", dir=options["workdir"]))
+            try:
+                self._recluster_user(user_id, workdir, options)
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    def _load(self, user_id: int, workdir: Path):
+        """把人脸特征流式写入磁盘文件再以 memmap 打开，内存只保留 id 数组。"""
+
+        vector_path = workdir / "faces.f32"
+        photo_ids = array("q")
+        face_slots = array("i")
+        qs = PhotoEmbedding.objects.filter(owner_id=user_id, model_name=FACE_MODEL_KEY).order_by("photo_id")
+        with open(vector_path, "wb") as fh:
+            for photo_id, blob in qs.values_list("photo_id", "vector").iterator(chunk_size=500):
+                encodings = bytes_to_encodings(blob)
+                fh.write(np.ascontiguousarray(encodings, dtype="float32").tobytes())
+                photo_ids.extend([photo_id] * encodings.shape[0])
+                face_slots.extend(range(encodings.shape[0]))
+        total = len(photo_ids)
+        if not total:
+            return None, None, None
+        matrix = np.memmap(vector_path, dtype="float32", mode="r", shape=(total, FACE_DIM))
+        return matrix, np.frombuffer(photo_ids, dtype="int64"), np.frombuffer(face_slots, dtype="int32")
+
+    def _recluster_user(self, user_id: int, workdir: Path, options) -> None:
+        timings: Dict[str, float] = {}
+        with self._phase(timings, "load"):
+            matrix, photo_ids, face_slots = self._load(user_id, workdir)
+        if matrix is None:
+            self.stdout.write(f"用户 {user_id}：没有人脸特征，跳过")
+            return
+
+        with self._phase(timings, "knn"):
+            neighbors, distances = knn_graph(matrix, options["k"], row_chunk=options["row_chunk"])
+        with self._phase(timings, "cluster"):
+            labels = chinese_whispers(neighbors, distances, options["tol"], iterations=options["iterations"])
+        cluster_count = int(labels.max()) + 1
+
+        written = "跳过写入"
+        if not options["dry_run"]:
+            with self._phase(timings, "write"):
+                deleted = self._write(user_id, matrix, photo_ids, face_slots, labels, cluster_count)
+            written = f"删除旧分组 {deleted}"
+
+        phases = "，".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items())
+        self.stdout.write(
+            f"用户 {user_id}：人脸 {matrix.shape[0]}，分组 {cluster_count}，{written}；{phases}"
+        )
+
+    def _write(self, user_id, matrix, photo_ids, face_slots, labels, cluster_count) -> int:
+        # 每个簇的质心与照片数
+        sums = np.zeros((cluster_count, FACE_DIM), dtype="float64")
+        for start in range(0, matrix.shape[0], 65536):
+            np.add.at(sums, labels[start : start + 65536], np.asarray(matrix[start : start + 65536]))
+        face_counts = np.bincount(labels, minlength=cluster_count)
+        centroids = (sums / face_counts[:, None]).astype("float32")
+        pairs = np.unique(labels.astype("int64") * (int(photo_ids.max()) + 1) + photo_ids)
+        photo_counts = np.bincount(pairs // (int(photo_ids.max()) + 1), minlength=cluster_count)
+
+        # 旧分组：重新聚类的人脸按 (照片, 序号) 对应旧 PhotoFace，其他照片引用的组不能删除
+        clustered_photos = set(np.unique(photo_ids).tolist())
+        old_faces: Dict[Tuple[int, int], Tuple[int, list]] = {}
+        kept_refs: Set[int] = set()
+        rows = PhotoFace.objects.filter(photo__owner_id=user_id).values_list(
+            "photo_id", "face_index", "face_group_id", "bbox"
+        )
+        for photo_id, face_index, group_id, bbox in rows.iterator(chunk_size=2000):
+            if photo_id in clustered_photos:
+                old_faces[(photo_id, face_index)] = (group_id, bbox)
+            else:
+                kept_refs.add(group_id)
+        old_groups = np.full(photo_ids.shape[0], -1, dtype="int64")
+        for pos, key in enumerate(zip(photo_ids.tolist(), face_slots.tolist())):
+            if key in old_faces:
+                old_groups[pos] = old_faces[key][0]
+
+        # 按多数票把新簇映射回旧分组，保留用户起的名字；票数多者优先认领
+        reuse: Dict[int, int] = {}
+        known = old_groups >= 0
+        if known.any():
+            keys, votes = np.unique(
+                np.stack([labels[known], old_groups[known]], axis=1), axis=0, return_counts=True
+            )
+            claimed: Set[int] = set()
+            for idx in np.argsort(-votes, kind="stable").tolist():
+                cluster, group_id = int(keys[idx, 0]), int(keys[idx, 1])
+                if cluster in reuse or group_id in claimed:
+                    continue
+                reuse[cluster] = group_id
+                claimed.add(group_id)
+
+        with transaction.atomic():
+            existing = set(FaceGroup.objects.filter(owner_id=user_id).values_list("id", flat=True))
+            reuse = {cluster: group_id for cluster, group_id in reuse.items() if group_id in existing}
+            cluster_groups = np.full(cluster_count, -1, dtype="int64")
+            updates = []
+            for cluster, group_id in reuse.items():
+                cluster_groups[cluster] = group_id
+                updates.append(
+                    FaceGroup(
+                        id=group_id,
+                        count=int(photo_counts[cluster]),
+                        centroid=centroid_to_bytes(centroids[cluster]),
+                    )
+                )
+            FaceGroup.objects.bulk_update(updates, ["count", "centroid"], batch_size=WRITE_BATCH)
+
+            fresh_clusters = [c for c in range(cluster_count) if c not in reuse]
+            fresh = [
+                FaceGroup(
+                    owner_id=user_id,
+                    name="",
+                    count=int(photo_counts[c]),
+                    centroid=centroid_to_bytes(centroids[c]),
+                )
+                for c in fresh_clusters
+            ]
+            FaceGroup.objects.bulk_create(fresh, batch_size=WRITE_BATCH)
+            cluster_groups[fresh_clusters] = [group.id for group in fresh]
+
+            # 按批替换重新聚类照片的 PhotoFace，沿用旧行的人脸框
+            face_groups = cluster_groups[labels].tolist()
+            photo_list = sorted(clustered_photos)
+            for start in range(0, len(photo_list), WRITE_BATCH):
+                PhotoFace.objects.filter(photo_id__in=photo_list[start : start + WRITE_BATCH]).delete()
+            PhotoFace.objects.bulk_create(
+                [
+                    PhotoFace(
+                        photo_id=photo_id,
+                        face_group_id=group_id,
+                        face_index=slot,
+                        bbox=old_faces.get((photo_id, slot), (None, []))[1],
+                    )
+                    for photo_id, slot, group_id in zip(photo_ids.tolist(), face_slots.tolist(), face_groups)
+                ],
+                batch_size=WRITE_BATCH,
+            )
+
+            stale = {group_id for group_id, _ in old_faces.values()} - set(reuse.values()) - kept_refs
+            stale_ids = sorted(stale)
+            for start in range(0, len(stale_ids), WRITE_BATCH):
+                FaceGroup.objects.filter(owner_id=user_id, id__in=stale_ids[start : start + WRITE_BATCH]).delete()
+
+            def _refresh_index():
+                get_face_index_registry().invalidate(user_id)
+                bump_face_index_version(user_id)
+
+            transaction.on_commit(_refresh_index)
+        return len(stale_ids)
@@ -0,0 +1,112 @@
+"""将已存储的 CLIP 照片向量（PhotoEmbedding）批量重编码为当前配置的格式。
+
+同一张表中的人脸特征（``FACE_MODEL_KEY``，每行 n×128）固定以 float32 存储，不参与重编码与 PQ 训练。
+"""
+
+from __future__ import annotations
+
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from gallery.models import PhotoEmbedding
+from gallery.services import get_clip_embedding_service
+from gallery.services.ai import _require_numpy
+from gallery.services.vector_codec import (
+    FORMAT_PQ,
+    ProductQuantizer,
+    VectorCodec,
+    detect_format,
+    get_vector_codec,
+    is_legacy_blob,
+    reset_vector_codec,
+)
+from gallery.services.vector_index import notify_vectors_changed
+
+
+class Command(BaseCommand):
+    help = "按 GALLERY_VECTOR_CODEC 重编码已有的照片向量（可选先训练 PQ 码本）"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--train-pq", action="store_true", help="先用现有向量训练 PQ 码本")
+        parser.add_argument("--pq-subspaces", type=int, default=64)
+        parser.add_argument("--pq-samples", type=int, default=20000)
+        parser.add_argument("--dry-run", action="store_true")
+
+    @staticmethod
+    def _clip_embeddings():
+        return PhotoEmbedding.objects.filter(model_name=get_clip_embedding_service().model_key)
+
+    def _all_vectors(self):
+        codec = VectorCodec()
+        qs = self._clip_embeddings().order_by("id")
+        for blob in qs.values_list("vector", flat=True).iterator(chunk_size=2000):
+            if blob and detect_format(bytes(blob)) != FORMAT_PQ:
+                yield codec.decode(bytes(blob))
+
+    def _train_pq(self, options) -> None:
+        np = _require_numpy()
+        path = getattr(settings, "GALLERY_VECTOR_PQ_CODEBOOK", None)
+        if not path:
+            raise CommandError("未配置 GALLERY_VECTOR_PQ_CODEBOOK")
+        vectors = []
+        for vec in self._all_vectors():
+            vectors.append(vec)
+            if len(vectors) >= options["pq_samples"]:
+                break
+        if not vectors:
+            raise CommandError("没有可用于训练的向量")
+        matrix = np.vstack(vectors)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-9
+        pq = ProductQuantizer.fit(matrix, m=options["pq_subspaces"])
+        pq.save(Path(path))
+        reset_vector_codec()
+        self.stdout.write(f"PQ 码本已保存：{path}（m={pq.m}, 样本 {matrix.shape[0]}）")
+
+    def handle(self, *args, **options):
+        if options["train_pq"]:
+            self._train_pq(options)
+
+        codec = get_vector_codec()
+        batch_size = options["batch_size"]
+        last_id = 0
+        converted = skipped = 0
+        while True:
+            rows = list(
+                self._clip_embeddings()
+                .filter(id__gt=last_id)
+                .order_by("id")
+                .values_list("id", "owner_id", "photo_id", "vector")[:batch_size]
+            )
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            updates = []
+            changed = defaultdict(list)
+            now = timezone.now()
+            for embedding_id, owner_id, photo_id, blob in rows:
+                blob = bytes(blob)
+                if not is_legacy_blob(blob) and detect_format(blob) == codec.format:
+                    skipped += 1
+                    continue
+                updates.append(
+                    PhotoEmbedding(id=embedding_id, vector=codec.encode(codec.decode(blob)), updated_at=now)
+                )
+                changed[owner_id].append(photo_id)
+
+            if updates and not options["dry_run"]:
+                with transaction.atomic():
+                    PhotoEmbedding.objects.bulk_update(updates, ["vector", "updated_at"])
+                # 各进程内的向量索引按变更 id 重新读取这些行
+                for owner_id, photo_ids in changed.items():
+                    notify_vectors_changed(owner_id, photo_ids)
+            converted += len(updates)
+            self.stdout.write(f"已处理至 id={last_id}，重编码 {converted}，跳过 {skipped}")
+
+        self.stdout.write(self.style.SUCCESS(f"完成：格式 {codec.format}，重编码 {converted}，跳过 {skipped}"))
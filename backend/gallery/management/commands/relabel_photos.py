@@ -0,0 +1,49 @@
+"""标签预设变化后，基于已存储的 CLIP 向量批量重新打标签。"""
+
+from __future__ import annotations
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from gallery.models import PhotoEmbedding
+from gallery.services import get_clip_embedding_service, get_embedding_index_registry
+from gallery.tasks_ai import relabel_user_photos, task_relabel_photos
+
+
+class Command(BaseCommand):
+    help = "用已存储的照片向量与当前标签预设重新计算 AI 标签，无需重新解码图片"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, action="append", help="只处理指定用户，可重复")
+        parser.add_argument("--language", default="zh")
+        parser.add_argument("--top-k", type=int, default=5)
+        parser.add_argument("--async", dest="use_async", action="store_true", help="按用户派发 Celery 任务")
+
+    def handle(self, *args, **options):
+        clip_service = get_clip_embedding_service()
+        user_ids = options["user"] or list(
+            PhotoEmbedding.objects.filter(model_name=clip_service.model_key)
+            .values_list("owner_id", flat=True)
+            .distinct()
+            .order_by("owner_id")
+        )
+
+        if options["use_async"]:
+            for user_id in user_ids:
+                task_relabel_photos.delay(user_id, options["language"], options["top_k"])
+            self.stdout.write(self.style.SUCCESS(f"已派发 {len(user_ids)} 个用户的重新打标签任务"))
+            return
+
+        registry = get_embedding_index_registry()
+        total = 0
+        started = time.monotonic()
+        for user_id in user_ids:
+            user_started = time.monotonic()
+            processed = relabel_user_photos(clip_service, user_id, options["language"], options["top_k"])
+            # 命令进程只是临时加载索引，处理完即释放内存
+            registry.invalidate(user_id)
+            total += processed
+            self.stdout.write(f"用户 {user_id}：{processed} 张，用时 {time.monotonic() - user_started:.1f} 秒")
+
+        self.stdout.write(self.style.SUCCESS(f"完成 {total} 张，用时 {time.monotonic() - started:.1f} 秒"))
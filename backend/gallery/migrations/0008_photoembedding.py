@@ -0,0 +1,62 @@
+# Generated by Django 5.2.7 on 2026-10-17 00:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# 迁移前写入的向量均由默认 CLIP 模型产出
+DEFAULT_MODEL_NAME = "ViT-B-32/openai"
+
+
+def copy_clip_vectors(apps, schema_editor):
+    Photo = apps.get_model("gallery", "Photo")
+    PhotoEmbedding = apps.get_model("gallery", "PhotoEmbedding")
+    batch = []
+    rows = Photo.objects.filter(clip_vector__isnull=False).values_list("id", "owner_id", "clip_vector")
+    for photo_id, owner_id, blob in rows.iterator(chunk_size=1000):
+        batch.append(PhotoEmbedding(photo_id=photo_id, owner_id=owner_id, model_name=DEFAULT_MODEL_NAME, vector=blob))
+        if len(batch) >= 1000:
+            PhotoEmbedding.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        PhotoEmbedding.objects.bulk_create(batch)
+
+
+def restore_clip_vectors(apps, schema_editor):
+    Photo = apps.get_model("gallery", "Photo")
+    PhotoEmbedding = apps.get_model("gallery", "PhotoEmbedding")
+    rows = PhotoEmbedding.objects.filter(model_name=DEFAULT_MODEL_NAME).values_list("photo_id", "vector")
+    for photo_id, blob in rows.iterator(chunk_size=1000):
+        Photo.objects.filter(id=photo_id).update(clip_vector=blob)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0007_ailabel_photo_ai_done_photo_clip_vector_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoEmbedding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(max_length=64)),
+                ('vector', models.BinaryField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='photo_embeddings', to=settings.AUTH_USER_MODEL)),
+                ('photo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='embeddings', to='gallery.photo')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', 'model_name', 'photo'], name='gallery_pho_owner_i_9921a7_idx')],
+                'constraints': [models.UniqueConstraint(fields=('photo', 'model_name'), name='uniq_photo_embedding_model')],
+            },
+        ),
+        migrations.RunPython(copy_clip_vectors, restore_clip_vectors),
+        migrations.RemoveField(
+            model_name='photo',
+            name='clip_vector',
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-17 00:06
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0008_photoembedding'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(condition=models.Q(('vector_done', False)), fields=['id'], name='photo_vector_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(condition=models.Q(('face_done', False)), fields=['id'], name='photo_face_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 00:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0009_photo_pending_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='facegroup',
+            name='centroid',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
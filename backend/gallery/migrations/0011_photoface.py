@@ -0,0 +1,62 @@
+# Generated by Django 5.2.7 on 2026-10-17 00:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_face_group_ids(apps, schema_editor):
+    Photo = apps.get_model("gallery", "Photo")
+    FaceGroup = apps.get_model("gallery", "FaceGroup")
+    PhotoFace = apps.get_model("gallery", "PhotoFace")
+    existing = set(FaceGroup.objects.values_list("id", flat=True))
+    batch = []
+    rows = Photo.objects.exclude(face_group_ids=[]).values_list("id", "face_group_ids")
+    for photo_id, group_ids in rows.iterator(chunk_size=1000):
+        for face_index, group_id in enumerate(group_ids or []):
+            if group_id in existing:
+                batch.append(PhotoFace(photo_id=photo_id, face_group_id=group_id, face_index=face_index))
+        if len(batch) >= 1000:
+            PhotoFace.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        PhotoFace.objects.bulk_create(batch)
+
+
+def restore_face_group_ids(apps, schema_editor):
+    Photo = apps.get_model("gallery", "Photo")
+    PhotoFace = apps.get_model("gallery", "PhotoFace")
+    grouped = {}
+    rows = PhotoFace.objects.order_by("photo_id", "face_index").values_list("photo_id", "face_group_id")
+    for photo_id, group_id in rows.iterator(chunk_size=1000):
+        grouped.setdefault(photo_id, []).append(group_id)
+    for photo_id, group_ids in grouped.items():
+        Photo.objects.filter(id=photo_id).update(face_group_ids=group_ids)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0010_facegroup_centroid'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoFace',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('face_index', models.PositiveSmallIntegerField(default=0)),
+                ('bbox', models.JSONField(blank=True, default=list)),
+                ('face_group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='photo_faces', to='gallery.facegroup')),
+                ('photo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='faces', to='gallery.photo')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['face_group', 'photo'], name='photoface_group_photo_idx')],
+                'constraints': [models.UniqueConstraint(fields=('photo', 'face_index'), name='uniq_photo_face_index')],
+            },
+        ),
+        migrations.RunPython(copy_face_group_ids, restore_face_group_ids),
+        migrations.RemoveField(
+            model_name='photo',
+            name='face_group_ids',
+        ),
+    ]
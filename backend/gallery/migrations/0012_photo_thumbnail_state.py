@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-17 00:24
+
+from django.db import migrations, models
+
+
+def mark_existing_ready(apps, schema_editor):
+    Photo = apps.get_model("gallery", "Photo")
+    Photo.objects.exclude(thumbnail__isnull=True).exclude(thumbnail="").update(thumbnail_state="ready")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0011_photoface'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='thumbnail_state',
+            field=models.CharField(choices=[('pending', '待生成'), ('preview', '内嵌预览'), ('ready', '已生成')], default='pending', max_length=8),
+        ),
+        migrations.RunPython(mark_existing_ready, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-17 00:26
+
+import django.db.models.deletion
+import gallery.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0012_photo_thumbnail_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoRendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('size', models.PositiveIntegerField()),
+                ('format', models.CharField(max_length=8)),
+                ('file', models.FileField(max_length=255, upload_to=gallery.models.rendition_upload_path)),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('bytes', models.PositiveIntegerField(default=0)),
+                ('photo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='gallery.photo')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('photo', 'size', 'format'), name='uniq_photo_rendition')],
+            },
+        ),
+    ]
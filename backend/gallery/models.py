@@ -1,6 +1,5 @@
 from django.db import models
 from django.contrib.auth.models import User
-from PIL import Image
 from pathlib import Path
 import secrets
 from datetime import timedelta
@@ -19,6 +18,7 @@ class FaceGroup(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="face_groups")
     name = models.CharField(max_length=64, blank=True, default="")  # 用户可命名
     count = models.IntegerField(default=0)  # 该组内照片计数
+    centroid = models.BinaryField(null=True, blank=True, editable=False)  # 组内人脸特征均值（128 维 float32）
     created_at = models.DateTimeField(auto_now_add=True)
 
 class Tag(models.Model):
@@ -39,6 +39,21 @@ class Album(models.Model):
     def __str__(self):
         return self.name
 
+class PhotoQuerySet(models.QuerySet):
+    # 列表序列化实际渲染的列，避免把大字段（人脸数据等）拖出磁盘
+    LISTING_FIELDS = (
+        "id", "title", "image", "thumbnail", "thumbnail_state", "uploaded_at", "owner_id", "album_id", "duplicate_of_id",
+        "near_group",
+    )
+
+    def for_listing(self):
+        renditions = models.Prefetch(
+            "renditions",
+            queryset=PhotoRendition.objects.only("id", "photo_id", "format", "file", "width"),
+        )
+        return self.only(*self.LISTING_FIELDS).prefetch_related("tags", renditions)
+
+
 def photo_upload_path(instance, filename):
     """上传路径：media/photos/<user_id>/<album_id>/<filename>"""
     return f"photos/{instance.owner.id}/{instance.album.id}/{filename}"
@@ -48,17 +63,40 @@ class Photo(models.Model):
         indexes = [
             models.Index(fields=["owner", "album", "uploaded_at"]),
             models.Index(fields=["taken_at"]),
+            # 部分索引：只覆盖待处理照片，便于回填任务按 id 键集分页
+            models.Index(fields=["id"], condition=models.Q(vector_done=False), name="photo_vector_pending_idx"),
+            models.Index(fields=["id"], condition=models.Q(face_done=False), name="photo_face_pending_idx"),
+            # 按用户查找相同内容的照片；存量照片没有哈希，不进入索引
+            models.Index(fields=["owner", "content_hash"], condition=~models.Q(content_hash=""), name="photo_owner_hash_idx"),
+            # 列出近重复分组；未入组的照片不进入索引
+            models.Index(
+                fields=["owner", "near_group"], condition=models.Q(near_group__isnull=False), name="photo_owner_near_group_idx"
+            ),
         ]
 
+    objects = PhotoQuerySet.as_manager()
+
+    class ThumbnailState(models.TextChoices):
+        PENDING = "pending", "待生成"
+        PREVIEW = "preview", "内嵌预览"  # EXIF 内嵌的低清缩略图，等待完整缩略图替换
+        READY = "ready", "已生成"
+
     # 照片信息
     title = models.CharField(max_length=100, blank=True)
     image = models.ImageField(upload_to=photo_upload_path)
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='photos')
     album = models.ForeignKey(Album, on_delete=models.CASCADE, related_name='photos')
     thumbnail = models.ImageField(upload_to=photo_upload_path, blank=True, null=True)
+    thumbnail_state = models.CharField(max_length=8, choices=ThumbnailState.choices, default=ThumbnailState.PENDING)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     tags = models.ManyToManyField(Tag, blank=True, related_name="photos")
 
+    # 去重：原图 SHA-256（十六进制）；引用行指向内容相同的原照片，共用其文件与处理结果
+    content_hash = models.CharField(max_length=64, blank=True, default="", editable=False)
+    duplicate_of = models.ForeignKey(
+        "self", null=True, blank=True, on_delete=models.SET_NULL, related_name="duplicates", editable=False
+    )
+
     # EXIF / 元数据
     taken_at = models.DateTimeField(null=True, blank=True)
     camera_make = models.CharField(max_length=64, blank=True)
@@ -72,9 +110,11 @@ class Photo(models.Model):
     width = models.IntegerField(null=True, blank=True)
     height = models.IntegerField(null=True, blank=True)
 
-    # AI相关字段
-    clip_vector = models.BinaryField(null=True, blank=True)  # 存 float32 向量的 bytes
-    face_group_ids = models.JSONField(default=list, blank=True)  # 该照片包含的人脸组 id 列表
+    # 近重复检测：64 位 dHash（按有符号 int64 存储）与所在近重复分组（组内最小的照片 id）
+    dhash = models.BigIntegerField(null=True, blank=True, editable=False)
+    near_group = models.BigIntegerField(null=True, blank=True, editable=False)
+
+    # AI相关字段（CLIP 向量见 PhotoEmbedding，人脸分组见 PhotoFace）
     ai_label_ids = models.ManyToManyField(AiLabel, blank=True, related_name="photos")
 
     # 标注状态
@@ -82,26 +122,58 @@ class Photo(models.Model):
     face_done = models.BooleanField(default=False)       # 人脸是否完成
     vector_done = models.BooleanField(default=False)     # 向量是否完成
 
-    def save(self, *args, **kwargs):
-        # 自动生成缩略图
-        super().save(*args, **kwargs)
+    def __str__(self):
+        return self.title or Path(self.image.name).name
 
-        if self.image and not self.thumbnail:
-            from io import BytesIO
-            from django.core.files.base import ContentFile
+def rendition_upload_path(instance, filename):
+    """派生图路径：media/renditions/<user_id>/<album_id>/<filename>"""
+    return f"renditions/{instance.photo.owner_id}/{instance.photo.album_id}/{filename}"
 
-            img = Image.open(self.image)
-            img.thumbnail((300, 300))
+class PhotoRendition(models.Model):
+    """照片派生图：每张照片每个尺寸、格式一行，由缩略图任务一次解码生成"""
+    photo = models.ForeignKey(Photo, on_delete=models.CASCADE, related_name="renditions")
+    size = models.PositiveIntegerField()  # 配置的目标长边
+    format = models.CharField(max_length=8)  # webp / avif / jpeg
+    file = models.FileField(upload_to=rendition_upload_path, max_length=255)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    bytes = models.PositiveIntegerField(default=0)
 
-            buffer = BytesIO()
-            img.save(buffer, format="JPEG")
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["photo", "size", "format"], name="uniq_photo_rendition"),
+        ]
 
-            thumb_name = Path(self.image.name).stem + "_thumb.jpg"
-            self.thumbnail.save(thumb_name, ContentFile(buffer.getvalue()), save=False)
-            super().save(update_fields=["thumbnail"])
+class PhotoEmbedding(models.Model):
+    """照片向量：每张照片每个模型版本一行，与热点 Photo 行分离，列表查询不会触及"""
+    photo = models.ForeignKey(Photo, on_delete=models.CASCADE, related_name="embeddings")
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="photo_embeddings")
+    model_name = models.CharField(max_length=64)  # 如 "ViT-B-32/openai"
+    vector = models.BinaryField()  # 按 GALLERY_VECTOR_CODEC 编码
+    updated_at = models.DateTimeField(auto_now=True)
 
-    def __str__(self):
-        return self.title or Path(self.image.name).name
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["photo", "model_name"], name="uniq_photo_embedding_model"),
+        ]
+        indexes = [
+            models.Index(fields=["owner", "model_name", "photo"]),
+        ]
+
+class PhotoFace(models.Model):
+    """照片中的一张人脸及其所属分组；按 (face_group, photo) 建索引，查某人的全部照片走索引范围扫描"""
+    photo = models.ForeignKey(Photo, on_delete=models.CASCADE, related_name="faces")
+    face_group = models.ForeignKey(FaceGroup, on_delete=models.CASCADE, related_name="photo_faces")
+    face_index = models.PositiveSmallIntegerField(default=0)  # 照片内人脸序号，对应人脸特征矩阵的行
+    bbox = models.JSONField(default=list, blank=True)  # [top, right, bottom, left]，像素坐标
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["photo", "face_index"], name="uniq_photo_face_index"),
+        ]
+        indexes = [
+            models.Index(fields=["face_group", "photo"], name="photoface_group_photo_idx"),
+        ]
 
 class AlbumShare(models.Model):
     album = models.ForeignKey(Album, on_delete=models.CASCADE, related_name="shares")
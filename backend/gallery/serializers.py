@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import Album, Photo, Tag
+from .services.renditions import build_srcsets
 
 class TagSerializer(serializers.ModelSerializer):
     class Meta:
@@ -18,10 +19,20 @@ class PhotoSerializer(serializers.ModelSerializer):
     tag_ids = serializers.PrimaryKeyRelatedField(
         queryset=Tag.objects.all(), many=True, write_only=True, required=False
     )
+    # 按格式给出 srcset，如 {"webp": "..._256.webp 256w, ..._1024.webp 1024w", "jpeg": "..."}
+    renditions = serializers.SerializerMethodField()
 
     class Meta:
         model = Photo
-        fields = ["id", "title", "image", "thumbnail", "uploaded_at", "tags", "tag_ids"]
+        fields = [
+            "id", "title", "image", "thumbnail", "thumbnail_state", "renditions", "uploaded_at", "tags", "tag_ids",
+            "duplicate_of", "near_group",
+        ]
+        read_only_fields = ["thumbnail_state", "duplicate_of", "near_group"]
+
+    def get_renditions(self, obj):
+        request = self.context.get("request")
+        return build_srcsets(obj.renditions.all(), request.build_absolute_uri if request else None)
 
     def create(self, validated_data):
         tag_ids = validated_data.pop("tag_ids", [])
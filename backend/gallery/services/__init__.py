@@ -10,6 +10,12 @@ from .ai import (
     get_clip_embedding_service,
     get_face_recognition_service,
 )
+from .ann import AnnConfig, IVFIndex
+from .vector_index import (
+    EmbeddingIndexRegistry,
+    UserEmbeddingIndex,
+    get_embedding_index_registry,
+)
 __all__ = [
     "get_upload_storage_service",
     "StorageBackendNotConfigured",
@@ -17,4 +23,9 @@ __all__ = [
     "FaceRecognitionService",
     "get_clip_embedding_service",
     "get_face_recognition_service",
+    "AnnConfig",
+    "IVFIndex",
+    "EmbeddingIndexRegistry",
+    "UserEmbeddingIndex",
+    "get_embedding_index_registry",
 ]
@@ -2,14 +2,26 @@
 
 from __future__ import annotations
 
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
 import threading
-from typing import Any, Dict, Optional, Sequence, Tuple, TYPE_CHECKING
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Hashable, Optional, Sequence, TYPE_CHECKING
 
+from django.conf import settings
 from PIL import Image
 
 if TYPE_CHECKING:  # pragma: no cover - 类型辅助
     import numpy as np
 
+logger = logging.getLogger(__name__)
+
 _NUMPY_IMPORT_ERROR: Optional[ModuleNotFoundError] = None
 try:  # 精简部署环境可能缺少 numpy
     import numpy as _np  # type: ignore
@@ -44,10 +56,98 @@ def _require_clip_modules():
     return torch, open_clip
 
 
+_SAFE_NAME_RE = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+class LRUCache:
+    """线程安全的有界 LRU 缓存。"""
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+class TextEmbeddingStore:
+    """固定文本集合（标签预设）的磁盘缓存：按模型名、预训练标识与文本集合哈希分文件。"""
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = Path(directory)
+
+    @staticmethod
+    def label_set_hash(texts: Sequence[str]) -> str:
+        payload = json.dumps(list(texts), ensure_ascii=False).encode("utf-8")
+        return hashlib.sha1(payload).hexdigest()[:16]
+
+    def path_for(self, service: "ClipEmbeddingService", texts: Sequence[str]) -> Path:
+        model = _SAFE_NAME_RE.sub("_", service.model_name)
+        pretrained = _SAFE_NAME_RE.sub("_", service.pretrained)
+        return self.directory / f"{model}__{pretrained}__{self.label_set_hash(texts)}.npy"
+
+    def load(self, service: "ClipEmbeddingService", texts: Sequence[str]):
+        np = _require_numpy()
+        path = self.path_for(service, texts)
+        if not path.exists():
+            return None
+        try:
+            vectors = np.load(path)
+        except (OSError, ValueError):
+            return None
+        if vectors.ndim != 2 or vectors.shape[0] != len(texts):
+            return None
+        return vectors.astype("float32", copy=False)
+
+    def save(self, service: "ClipEmbeddingService", texts: Sequence[str], vectors) -> None:
+        np = _require_numpy()
+        path = self.path_for(service, texts)
+        tmp_name = None
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            with os.fdopen(fd, "wb") as fh:
+                np.save(fh, np.asarray(vectors, dtype="float32"))
+            os.replace(tmp_name, path)
+        except Exception:
+            # 只读文件系统、磁盘写满或向量无法序列化时退化为内存缓存，不影响打标签与预热
+            logger.warning("标签向量落盘失败", extra={"path": str(path)}, exc_info=True)
+            if tmp_name is not None:
+                try:
+                    os.unlink(tmp_name)
+                except FileNotFoundError:
+                    pass
+
+
 class ClipEmbeddingService:
     """提供延迟初始化的 CLIP 图像/文本向量能力。"""
 
-    def __init__(self, model_name: str = "ViT-B-32", pretrained: str = "openai", device: Optional[str] = None):
+    TEXT_CACHE_SIZE = 64
+    QUERY_CACHE_SIZE = 1024
+    PREPROCESS_WORKERS = 4
+
+    def __init__(
+        self,
+        model_name: str = "ViT-B-32",
+        pretrained: str = "openai",
+        device: Optional[str] = None,
+        text_store: Optional["TextEmbeddingStore"] = None,
+    ):
         self.model_name = model_name
         self.pretrained = pretrained
         if device is not None:
@@ -60,7 +160,15 @@ class ClipEmbeddingService:
         self._preprocess = None
         self._tokenizer = None
         self._model_lock = threading.Lock()
-        self._text_cache: Dict[Tuple[str, ...], Any] = {}
+        self._text_cache: LRUCache = LRUCache(self.TEXT_CACHE_SIZE)
+        self._query_cache: LRUCache = LRUCache(self.QUERY_CACHE_SIZE)
+        self._text_store: Optional[TextEmbeddingStore] = text_store
+
+    @property
+    def model_key(self) -> str:
+        """模型版本标识，用于区分不同模型产出的向量。"""
+
+        return f"{self.model_name}/{self.pretrained}"
 
     def _ensure_model(self) -> None:
         if self._model is not None:
@@ -78,43 +186,111 @@ class ClipEmbeddingService:
             self._tokenizer = tokenizer
 
     def encode_image(self, image: Image.Image) -> np.ndarray:
+        return self.encode_images([image])[0]
+
+    def encode_images(self, images: Sequence[Image.Image]) -> np.ndarray:
+        """批量编码图像：预处理在线程池中并行，模型只做一次前向，返回 ``(n, dim)``。"""
+
         np = _require_numpy()
         torch_module, _ = _require_clip_modules()
         self._ensure_model()
         assert self._model is not None and self._preprocess is not None
+        if not images:
+            return np.empty((0, 0), dtype="float32")
+        if len(images) == 1:
+            tensors = [self._preprocess(images[0])]
+        else:
+            workers = min(self.PREPROCESS_WORKERS, len(images))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                tensors = list(pool.map(self._preprocess, images))
         with torch_module.no_grad():
-            tensor = self._preprocess(image).unsqueeze(0).to(self.device)
-            features = self._model.encode_image(tensor)
+            batch = torch_module.stack(tensors).to(self.device)
+            features = self._model.encode_image(batch)
             features /= features.norm(dim=-1, keepdim=True)
-        return features.cpu().numpy()[0].astype("float32")
-
-    def encode_texts(self, texts: Sequence[str]) -> np.ndarray:
-        np = _require_numpy()
-        key = tuple(texts)
-        cached = self._text_cache.get(key)
-        if cached is not None:
-            return cached
+        return features.cpu().numpy().astype("float32")
 
+    def _encode_texts_uncached(self, texts: Sequence[str]) -> np.ndarray:
         self._ensure_model()
         assert self._model is not None and self._tokenizer is not None
         torch_module, _ = _require_clip_modules()
         with torch_module.no_grad():
-            tokens = self._tokenizer(texts)
+            tokens = self._tokenizer(list(texts))
             features = self._model.encode_text(tokens.to(self.device))
             features /= features.norm(dim=-1, keepdim=True)
-        vectors = features.cpu().numpy().astype("float32")
-        self._text_cache[key] = vectors
+        return features.cpu().numpy().astype("float32")
+
+    def encode_texts(self, texts: Sequence[str], persist: bool = False) -> np.ndarray:
+        """编码一组文本。
+
+        结果进入有界 LRU；``persist=True``（标签预设等固定集合）时额外读写磁盘
+        ``.npy`` 缓存，新进程无需重新编码即可直接打标签。
+        """
+
+        key = tuple(texts)
+        cached = self._text_cache.get(key)
+        if cached is not None:
+            return cached
+
+        store = self._text_store if persist else None
+        vectors = store.load(self, key) if store is not None else None
+        if vectors is None:
+            vectors = self._encode_texts_uncached(key)
+            if store is not None:
+                store.save(self, key, vectors)
+        self._text_cache.put(key, vectors)
         return vectors
 
+    def encode_query(self, text: str) -> np.ndarray:
+        """编码单条检索语句，结果进入有界 LRU，避免任意查询撑大缓存。"""
+
+        key = " ".join(text.split()).lower()
+        cached = self._query_cache.get(key)
+        if cached is not None:
+            return cached
+        vector = self._encode_texts_uncached([key])[0]
+        self._query_cache.put(key, vector)
+        return vector
+
+    def warm_label_presets(self, encode_missing: bool = False) -> int:
+        """预加载标签预设的文本向量，返回就绪的预设数量。
+
+        默认只读磁盘缓存（不触发模型加载，适合在 worker 进程启动时调用）；
+        ``encode_missing=True`` 时对缺失的预设现场编码并落盘。
+        """
+
+        from ..ai_presets import available_languages, get_labels
+
+        ready = 0
+        for language in list(available_languages()):
+            key = tuple(get_labels(language))
+            if self._text_cache.get(key) is not None:
+                ready += 1
+                continue
+            if encode_missing:
+                self.encode_texts(key, persist=True)
+                ready += 1
+                continue
+            vectors = self._text_store.load(self, key) if self._text_store is not None else None
+            if vectors is not None:
+                self._text_cache.put(key, vectors)
+                ready += 1
+        return ready
+
     @staticmethod
     def vector_to_bytes(arr: np.ndarray) -> bytes:
-        np = _require_numpy()
-        return np.asarray(arr, dtype="float32").tobytes()
+        """按 ``GALLERY_VECTOR_CODEC`` 配置的格式编码向量。"""
+
+        from .vector_codec import get_vector_codec
+
+        return get_vector_codec().encode(arr)
 
     @staticmethod
     def bytes_to_vector(blob: bytes) -> np.ndarray:
-        np = _require_numpy()
-        return np.frombuffer(blob, dtype="float32")
+        """解码任意格式（含无头部的历史 float32）的向量 blob。"""
+
+        from .vector_codec import get_vector_codec
+
+        return get_vector_codec().decode(blob)
 
 
 class FaceRecognitionService:
@@ -134,8 +310,21 @@ class FaceRecognitionService:
                 self._module = face_recognition
 
     def load_image(self, file_obj) -> np.ndarray:
+        return self.load_image_reduced(file_obj)[0]
+
+    def load_image_reduced(self, file_obj, max_pixels: Optional[int] = None):
+        """按人脸检测所需的分辨率解码（默认约 1.6 MP），返回 ``(数组, ReducedImage)``。
+
+        检测框基于缩小后的图像，需通过 ``ReducedImage.map_box`` 映射回原图坐标。
+        """
+
+        from .imaging import open_reduced
+
         self._ensure_module()
-        return self._module.load_image_file(file_obj)
+        if max_pixels is None:
+            max_pixels = int(getattr(settings, "GALLERY_FACE_MAX_PIXELS", 1_600_000))
+        reduced = open_reduced(file_obj, max_pixels=max_pixels)
+        return _require_numpy().asarray(reduced.image.convert("RGB")), reduced
 
     def face_locations(self, image, model: str = "hog"):
         self._ensure_module()
@@ -157,7 +346,10 @@ def get_clip_embedding_service() -> ClipEmbeddingService:
     if _clip_service is None:
         with _clip_lock:
             if _clip_service is None:
-                _clip_service = ClipEmbeddingService()
+                cache_dir = getattr(settings, "GALLERY_AI_CACHE_DIR", None)
+                _clip_service = ClipEmbeddingService(
+                    text_store=TextEmbeddingStore(Path(cache_dir)) if cache_dir else None
+                )
     return _clip_service
 
 
@@ -0,0 +1,153 @@
+"""纯 NumPy 实现的 IVF 近似最近邻索引。
+
+IVF（倒排文件）把归一化向量用球面 k-means 划分为 ``nlist`` 个簇，
+查询时只扫描与查询最接近的 ``nprobe`` 个簇。``nprobe`` 越大召回越高、延迟越高，
+``nprobe == nlist`` 时退化为精确检索。
+
+本模块只负责质心训练、簇分配与探测；向量本身仍保存在宿主索引
+（:class:`~gallery.services.vector_index.UserEmbeddingIndex`）的连续矩阵中，
+宿主维护与矩阵行对齐的簇编号数组，避免重复占用内存。
+"""
+
+from __future__ import annotations
+
+import os
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+
+from django.conf import settings
+
+from .ai import _require_numpy
+
+
+@dataclass(frozen=True)
+class AnnConfig:
+    """ANN 配置：控制启用阈值与召回/延迟权衡。"""
+
+    min_size: int = 20000  # 小于该规模时使用精确检索
+    nlist: int = 0  # 簇数量，0 表示按 sqrt(N) 自动推算
+    nprobe: int = 8  # 每次查询探测的簇数量
+    train_sample: int = 64  # 每个簇用于训练的采样点数
+    train_iters: int = 10
+    retrain_growth: float = 4.0  # 规模增长到训练时的倍数后重新训练
+    directory: Optional[str] = None  # 持久化目录，为空则不落盘
+
+    def resolve_nlist(self, size: int) -> int:
+        if self.nlist > 0:
+            return min(self.nlist, size)
+        return max(1, min(size, int(size ** 0.5)))
+
+
+def load_ann_config() -> AnnConfig:
+    directory = getattr(settings, "GALLERY_ANN_DIR", None)
+    return AnnConfig(
+        min_size=int(getattr(settings, "GALLERY_ANN_MIN_SIZE", AnnConfig.min_size)),
+        nlist=int(getattr(settings, "GALLERY_ANN_NLIST", AnnConfig.nlist)),
+        nprobe=int(getattr(settings, "GALLERY_ANN_NPROBE", AnnConfig.nprobe)),
+        directory=str(directory) if directory else None,
+    )
+
+
+class IVFIndex:
+    """IVF 粗量化器：质心训练、簇分配、探测与持久化。"""
+
+    _ASSIGN_CHUNK = 16384
+
+    def __init__(self, centroids, trained_size: int = 0) -> None:
+        self._np = _require_numpy()
+        self.centroids = self._np.ascontiguousarray(centroids, dtype="float32")
+        self.trained_size = trained_size
+
+    @property
+    def nlist(self) -> int:
+        return int(self.centroids.shape[0])
+
+    @property
+    def dim(self) -> int:
+        return int(self.centroids.shape[1])
+
+    @classmethod
+    def train(cls, matrix, config: AnnConfig, seed: int = 0) -> "IVFIndex":
+        """在（已归一化的）矩阵上训练球面 k-means 质心。"""
+
+        np = _require_numpy()
+        size = matrix.shape[0]
+        nlist = config.resolve_nlist(size)
+        rng = np.random.default_rng(seed)
+        sample_size = min(size, nlist * config.train_sample)
+        sample = matrix[rng.choice(size, sample_size, replace=False)] if sample_size < size else matrix
+        sample = np.ascontiguousarray(sample, dtype="float32")
+        centroids = sample[rng.choice(sample.shape[0], nlist, replace=False)].copy()
+
+        for _ in range(config.train_iters):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=nlist)
+            empty = np.flatnonzero(counts == 0)
+            if empty.size:
+                # 空簇用随机样本重新播种
+                sums[empty] = sample[rng.choice(sample.shape[0], empty.size, replace=False)]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = sums / (norms + 1e-9)
+
+        return cls(centroids, trained_size=size)
+
+    def assign(self, vectors):
+        """返回每个向量所属的簇编号（int32）。"""
+
+        np = self._np
+        vectors = np.asarray(vectors, dtype="float32")
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        result = np.empty(vectors.shape[0], dtype="int32")
+        for start in range(0, vectors.shape[0], self._ASSIGN_CHUNK):
+            chunk = vectors[start : start + self._ASSIGN_CHUNK]
+            result[start : start + chunk.shape[0]] = np.argmax(chunk @ self.centroids.T, axis=1)
+        return result
+
+    def probe(self, query, nprobe: int):
+        """返回与查询最接近的 ``nprobe`` 个簇编号。"""
+
+        np = self._np
+        scores = self.centroids @ np.asarray(query, dtype="float32")
+        nprobe = max(1, min(nprobe, self.nlist))
+        if nprobe >= self.nlist:
+            return np.arange(self.nlist, dtype="int32")
+        return np.argpartition(-scores, nprobe - 1)[:nprobe].astype("int32")
+
+    def save(self, path: Path, ids: Sequence[int], lists) -> None:
+        """原子地保存质心与 ``id -> 簇`` 分配。"""
+
+        np = self._np
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                np.savez(
+                    fh,
+                    centroids=self.centroids,
+                    ids=np.asarray(ids, dtype="int64"),
+                    lists=np.asarray(lists, dtype="int32"),
+                    trained_size=np.asarray([self.trained_size], dtype="int64"),
+                )
+            os.replace(tmp_name, path)
+        except BaseException:
+            if os.path.exists(tmp_name):
+                os.unlink(tmp_name)
+            raise
+
+    @classmethod
+    def load(cls, path: Path) -> Optional[Tuple["IVFIndex", object, object]]:
+        """读取持久化文件，返回 ``(index, ids, lists)``；文件不存在时返回 None。"""
+
+        np = _require_numpy()
+        path = Path(path)
+        if not path.exists():
+            return None
+        with np.load(path) as data:
+            index = cls(data["centroids"], trained_size=int(data["trained_size"][0]))
+            return index, data["ids"].copy(), data["lists"].copy()
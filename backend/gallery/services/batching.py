@@ -0,0 +1,80 @@
+"""基于 Redis 列表的微批收集器：凑满 N 个或等待 T 毫秒后整体派发。"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from django.conf import settings
+
+
+def _default_connection():
+    from django_redis import get_redis_connection
+
+    return get_redis_connection("default")
+
+
+@dataclass
+class CollectResult:
+    """``add`` 的结果：需要立即处理的批次，以及是否需要安排一次延迟刷新。"""
+
+    batch: List[int]
+    schedule_flush: bool = False
+
+
+class RedisBatchCollector:
+    """跨进程收集待处理 id。
+
+    - ``add`` 把 id 推入列表；列表长度达到 ``batch_size`` 时原子地取出一批返回；
+    - 否则尝试设置 ``wait_ms`` 过期的刷新锁，设置成功的调用方负责安排一次
+      ``wait_ms`` 之后的延迟刷新，从而保证任一 id 最多等待约 T 毫秒；
+    - ``drain`` 原子地取出至多 ``batch_size`` 个 id。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        batch_size: int,
+        wait_ms: int,
+        connection_factory: Callable[[], object] = _default_connection,
+    ) -> None:
+        self.key = f"cloud_album:batch:{name}"
+        self.lock_key = f"{self.key}:flush"
+        self.batch_size = max(1, batch_size)
+        self.wait_ms = max(1, wait_ms)
+        self._connection_factory = connection_factory
+
+    def _conn(self):
+        return self._connection_factory()
+
+    def add(self, item: int) -> CollectResult:
+        conn = self._conn()
+        length = conn.rpush(self.key, int(item))
+        if length >= self.batch_size:
+            return CollectResult(batch=self.drain(conn))
+        scheduled = conn.set(self.lock_key, 1, nx=True, px=self.wait_ms)
+        return CollectResult(batch=[], schedule_flush=bool(scheduled))
+
+    def drain(self, conn: Optional[object] = None) -> List[int]:
+        conn = conn or self._conn()
+        pipe = conn.pipeline(transaction=True)
+        pipe.lrange(self.key, 0, self.batch_size - 1)
+        pipe.ltrim(self.key, self.batch_size, -1)
+        items, _ = pipe.execute()
+        return [int(item) for item in items]
+
+
+_clip_collector: Optional[RedisBatchCollector] = None
+
+
+def get_clip_batch_collector() -> RedisBatchCollector:
+    """CLIP 编码任务的收集器，批量大小与等待时间取自配置。"""
+
+    global _clip_collector
+    if _clip_collector is None:
+        _clip_collector = RedisBatchCollector(
+            "clip",
+            batch_size=int(getattr(settings, "GALLERY_CLIP_BATCH_SIZE", 32)),
+            wait_ms=int(getattr(settings, "GALLERY_CLIP_BATCH_WAIT_MS", 500)),
+        )
+    return _clip_collector
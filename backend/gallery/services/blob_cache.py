@@ -0,0 +1,293 @@
+"""Worker 本地的原图读穿缓存。
+
+S3 模式下同一张原图会被缩略图、CLIP、人脸、重试与回填反复下载。这里把原图按
+``(对象 key, ETag)`` 缓存到本地目录：
+
+- 命中时只做一次 HEAD 取 ETag（调用方已知 ETag 时可省略），原图被覆盖后 ETag 变化自然失效；
+- 下载先写入临时文件再 ``os.replace``，prefork 的多个子进程同时回源也只会看到完整文件；
+- 同一 key 的并发未命中通过 ``flock`` 合并，只有一个进程/线程回源，其余等待后直接命中；
+- 命中时刷新文件 mtime，总量超过上限时按 mtime 从旧到新淘汰（近似 LRU）。
+  命中直接打开文件、未命中在 ``os.replace`` 之前打开临时文件，拿到的文件对象在被其他进程淘汰后
+  仍可读完（POSIX unlink 语义），不存在“检查存在”与“打开”之间的竞态；
+- 每累计 ``stats_every`` 次查找输出一条命中率日志，worker 子进程退出时再输出一次。
+
+``open_or_create`` 也可用于缓存任意派生数据（如按需渲染的图片）。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Optional
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - 非 POSIX 平台不做跨进程合并
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_COPY_CHUNK = 1024 * 1024
+# 锁文件按 key 摘要前两位分片，数量固定为 256 个，不会随缓存条目增长
+_RESERVED_DIRS = {"tmp", "locks"}
+_LOOKUP_STATS = ("hits", "coalesced", "misses")
+
+
+def _version_token(storage, name: str) -> str:
+    """S3 取对象 ETag；其他存储退化为 ``大小-修改时间``。"""
+
+    bucket = getattr(storage, "bucket", None)
+    if bucket is not None:
+        normalize = getattr(storage, "_normalize_name", None)
+        key = normalize(name) if normalize else name
+        return bucket.Object(key).e_tag.strip('"')
+    size = storage.size(name)
+    try:
+        modified = storage.get_modified_time(name).timestamp()
+    except (NotImplementedError, AttributeError):
+        modified = 0
+    return f"{size}-{modified:.6f}"
+
+
+class BlobCache:
+    """按 ``(key, ETag)`` 寻址、总量受限的本地磁盘缓存。
+
+    每个进程只维护近似的总字节数：超过上限时扫描目录重新统计并淘汰到 ``low_water``，
+    因此多个进程并发写入时实际占用可能短暂超出上限。
+    """
+
+    def __init__(
+        self, root, max_bytes: int, low_water: float = 0.9, label: str = "原图缓存", stats_every: int = 0
+    ) -> None:
+        self.root = Path(root)
+        self.max_bytes = int(max_bytes)
+        self.low_water = low_water
+        self.label = label
+        self.stats_every = int(stats_every)
+        self._tmp_dir = self.root / "tmp"
+        self._tmp_dir.mkdir(parents=True, exist_ok=True)
+        self._lock_dir = self.root / "locks"
+        self._lock_dir.mkdir(exist_ok=True)
+        self._lock = threading.Lock()
+        self._stats: Dict[str, int] = {"hits": 0, "coalesced": 0, "misses": 0, "bytes_fetched": 0, "evictions": 0}
+        self._approx_bytes = self._scan()[1]
+
+    def key_path(self, key: str) -> Path:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return self.root / digest[:2] / digest
+
+    def path_for(self, name: str, etag: str) -> Path:
+        return self.key_path(f"{name}\0{etag}")
+
+    @staticmethod
+    def _open_existing(path: Path) -> Optional[BinaryIO]:
+        """先打开再刷新 mtime：打开成功后即使文件被淘汰，已打开的句柄仍可读完。"""
+
+        try:
+            fh = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return fh
+
+    @contextmanager
+    def _key_lock(self, path: Path):
+        if fcntl is None:  # pragma: no cover
+            yield
+            return
+        with open(self._lock_dir / f"{path.name[:2]}.lock", "a+b") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def open_or_create(self, key: str, produce: Callable[[BinaryIO], None]) -> BinaryIO:
+        """返回 ``key`` 对应缓存文件的只读文件对象，未命中时调用 ``produce(out)`` 写入内容。
+
+        并发未命中同一 key 时只有持锁者执行 ``produce``，其余等待后直接命中。调用方负责关闭。
+        """
+
+        path = self.key_path(key)
+        fh = self._open_existing(path)
+        if fh is not None:
+            self._count("hits")
+            return fh
+
+        with self._key_lock(path):
+            fh = self._open_existing(path)
+            if fh is not None:
+                self._count("coalesced")
+                return fh
+            self._count("misses")
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self._tmp_dir)
+            try:
+                with os.fdopen(fd, "wb") as out:
+                    produce(out)
+                    size = out.tell()
+                fh = open(tmp_path, "rb")
+                os.replace(tmp_path, path)
+            except BaseException:
+                if fh is not None:
+                    fh.close()
+                try:
+                    os.unlink(tmp_path)
+                except FileNotFoundError:
+                    pass
+                raise
+
+        self._count("bytes_fetched", size)
+        with self._lock:
+            self._approx_bytes += size
+            over = self._approx_bytes > self.max_bytes
+        if over:
+            self.evict()
+        return fh
+
+    def get_or_create(self, key: str, produce: Callable[[BinaryIO], None]) -> Path:
+        """同 ``open_or_create``，但只返回路径；路径随时可能被淘汰，需要读取内容时应使用前者。"""
+
+        with self.open_or_create(key, produce):
+            return self.key_path(key)
+
+    def _download(self, storage, name: str, etag: Optional[str]):
+        if etag is None:
+            etag = _version_token(storage, name)
+
+        def download(out: BinaryIO) -> None:
+            with storage.open(name, "rb") as src:
+                shutil.copyfileobj(src, out, _COPY_CHUNK)
+
+        return f"{name}\0{etag}", download
+
+    def fetch(self, storage, name: str, etag: Optional[str] = None) -> Path:
+        """返回原图的本地缓存路径，未命中时从 ``storage`` 下载。"""
+
+        return self.get_or_create(*self._download(storage, name, etag))
+
+    @contextmanager
+    def open(self, storage, name: str, etag: Optional[str] = None):
+        with self.open_or_create(*self._download(storage, name, etag)) as fh:
+            yield fh
+
+    def _scan(self):
+        entries = []
+        total = 0
+        for bucket in os.scandir(self.root):
+            if not bucket.is_dir() or bucket.name in _RESERVED_DIRS:
+                continue
+            for entry in os.scandir(bucket.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        return entries, total
+
+    def evict(self) -> int:
+        """按 mtime 从旧到新删除文件，直到总量不超过 ``max_bytes * low_water``。"""
+
+        entries, total = self._scan()
+        target = self.max_bytes * self.low_water
+        removed = 0
+        if total > self.max_bytes:
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    continue
+                total -= size
+                removed += 1
+        with self._lock:
+            self._approx_bytes = total
+        if removed:
+            self._count("evictions", removed)
+            logger.info("%s淘汰 %s 个文件，剩余 %.1f MB", self.label, removed, total / 1024 / 1024)
+        return removed
+
+    def _count(self, key: str, amount: int = 1) -> None:
+        with self._lock:
+            self._stats[key] += amount
+            lookups = sum(self._stats[name] for name in _LOOKUP_STATS)
+        if key in _LOOKUP_STATS and self.stats_every > 0 and lookups % self.stats_every == 0:
+            self.log_stats()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            data = dict(self._stats)
+        lookups = data["hits"] + data["coalesced"] + data["misses"]
+        data["hit_rate"] = round((data["hits"] + data["coalesced"]) / lookups, 4) if lookups else 0.0
+        data["approx_bytes"] = self._approx_bytes
+        return data
+
+    def log_stats(self) -> None:
+        data = self.stats()
+        logger.info(
+            "%s命中率 %.1f%%：命中 %s，合并 %s，未命中 %s，回源 %.1f MB，淘汰 %s，占用约 %.1f MB",
+            self.label,
+            data["hit_rate"] * 100,
+            data["hits"],
+            data["coalesced"],
+            data["misses"],
+            data["bytes_fetched"] / 1024 / 1024,
+            data["evictions"],
+            data["approx_bytes"] / 1024 / 1024,
+        )
+
+
+_cache: Optional[BlobCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_blob_cache() -> Optional[BlobCache]:
+    """未配置 ``GALLERY_BLOB_CACHE_DIR`` 时返回 ``None``（直接读存储）。"""
+
+    global _cache
+    root = getattr(settings, "GALLERY_BLOB_CACHE_DIR", "")
+    if not root:
+        return None
+    with _cache_lock:
+        if _cache is None or _cache.root != Path(root):
+            max_mb = int(getattr(settings, "GALLERY_BLOB_CACHE_MAX_MB", 2048))
+            stats_every = int(getattr(settings, "GALLERY_BLOB_CACHE_STATS_EVERY", 1000))
+            _cache = BlobCache(root, max_bytes=max_mb * 1024 * 1024, stats_every=stats_every)
+        return _cache
+
+
+def log_blob_cache_stats() -> None:
+    """输出本进程原图缓存的累计统计（未创建缓存时不输出）。"""
+
+    if _cache is not None:
+        _cache.log_stats()
+
+
+@contextmanager
+def open_original(field_file):
+    """以二进制只读方式打开照片原图，启用缓存时经由本地缓存读取。"""
+
+    if not getattr(field_file, "_committed", True):
+        # 尚未保存的上传文件仍由调用方持有，不在这里关闭
+        yield field_file
+        return
+    cache = get_blob_cache()
+    if cache is None:
+        with field_file.open("rb") as fh:
+            yield fh
+        return
+    with cache.open(field_file.storage, field_file.name) as fh:
+        yield fh
@@ -0,0 +1,219 @@
+"""按内容哈希去重：同一用户再次上传相同文件时不重复存储，也不重复执行后处理。
+
+策略由 ``GALLERY_DUPLICATE_POLICY`` 决定：
+
+- ``reference``（默认）：新建一条引用行（``duplicate_of`` 指向原照片），共用原图、缩略图与派生图文件，
+  随后复制原照片的 EXIF、向量、标签与人脸结果，不调度缩略图/EXIF/CLIP/人脸任务；
+- ``reject``：不新建照片，直接返回已有的那张；
+- ``off``：不去重。
+
+文件可能被多行共用，删除照片时只删除已无其他行引用的文件。
+
+查重是普通查询，不加锁，也没有按 ``(owner, content_hash)`` 的唯一约束：同一用户并发上传同一文件时，
+两个请求可能都查不到对方而各自成为原照片。这种情况只会多存一份、多跑一次后处理，不影响正确性；
+之后再上传同一内容会引用其中 id 较小的一张。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.fields.files import FieldFile
+
+from ..models import Photo, PhotoEmbedding, PhotoFace, PhotoRendition
+from .ai import ClipEmbeddingService, get_clip_embedding_service
+from .faces import refresh_face_group_counts
+from .upload_handlers import HashedUploadedFile
+from .vector_index import get_embedding_index_registry
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_POLICIES = ("reference", "reject", "off")
+
+# 引用行创建时直接从原照片复制的列（文件名共用，不复制文件）
+_SHARED_FIELDS = (
+    "image",
+    "thumbnail",
+    "thumbnail_state",
+    "content_hash",
+    "taken_at",
+    "camera_make",
+    "camera_model",
+    "focal_length",
+    "exposure_time",
+    "f_number",
+    "iso",
+    "gps_lat",
+    "gps_lng",
+    "width",
+    "height",
+)
+_DONE_FIELDS = ("ai_done", "face_done", "vector_done")
+
+
+def duplicate_policy() -> str:
+    policy = str(getattr(settings, "GALLERY_DUPLICATE_POLICY", "reference")).lower()
+    if policy not in DUPLICATE_POLICIES:
+        logger.warning("未知的去重策略 %s，按 off 处理", policy)
+        return "off"
+    return policy
+
+
+def content_hash_of(uploaded) -> str:
+    """上传文件的 SHA-256；经 ``GalleryUploadHandler`` 接收的文件直接使用接收时算好的值。"""
+
+    if isinstance(uploaded, HashedUploadedFile) and uploaded.sha256:
+        return uploaded.sha256
+    digest = hashlib.sha256()
+    for chunk in uploaded.chunks():
+        digest.update(chunk)
+    uploaded.seek(0)
+    return digest.hexdigest()
+
+
+def find_originals(owner_id: int, hashes: Iterable[str]) -> Dict[str, Photo]:
+    """按哈希查找用户已有的原照片（非引用行），同一哈希有多张时取最早的一张。
+
+    不加锁，并发上传同一文件时可能各自成为原照片（见模块说明）。
+    """
+
+    hashes = {value for value in hashes if value}
+    if not hashes:
+        return {}
+    originals: Dict[str, Photo] = {}
+    qs = Photo.objects.filter(owner_id=owner_id, content_hash__in=hashes, duplicate_of__isnull=True).order_by("id")
+    for photo in qs:
+        originals.setdefault(photo.content_hash, photo)
+    return originals
+
+
+def make_reference(original: Photo, owner, album, title: str = "") -> Photo:
+    """构造（不保存）指向 ``original`` 的引用行，文件与已有的元数据直接沿用。"""
+
+    reference = Photo(owner=owner, album=album, title=title, duplicate_of=original)
+    _assign_shared(reference, original, _SHARED_FIELDS)
+    return reference
+
+
+def _assign_shared(target: Photo, source: Photo, fields: Sequence[str]) -> None:
+    for field in fields:
+        value = getattr(source, field)
+        # 文件字段只复制文件名，FieldFile 对象绑定在原实例上，不能共用
+        setattr(target, field, value.name if isinstance(value, FieldFile) else value)
+
+
+def is_processed(photo: Photo) -> bool:
+    return photo.thumbnail_state == Photo.ThumbnailState.READY and photo.vector_done and photo.face_done
+
+
+def _copy_results(reference: Photo, original: Photo) -> None:
+    """把原照片当前已有的处理结果整体复制到引用行（可重复执行）。"""
+
+    old_thumbnail = reference.thumbnail.name
+    _assign_shared(reference, original, _SHARED_FIELDS + _DONE_FIELDS)
+    reference.save(update_fields=list(_SHARED_FIELDS + _DONE_FIELDS))
+
+    embeddings = [
+        PhotoEmbedding(photo_id=reference.id, owner_id=reference.owner_id, model_name=model_name, vector=vector)
+        for model_name, vector in original.embeddings.values_list("model_name", "vector")
+    ]
+    PhotoEmbedding.objects.bulk_create(
+        embeddings,
+        update_conflicts=True,
+        unique_fields=["photo", "model_name"],
+        update_fields=["vector", "updated_at"],
+    )
+
+    through = Photo.ai_label_ids.through
+    through.objects.bulk_create(
+        [through(photo_id=reference.id, ailabel_id=label_id) for label_id in original.ai_label_ids.values_list("id", flat=True)],
+        ignore_conflicts=True,
+    )
+
+    touched = set(reference.faces.values_list("face_group_id", flat=True))
+    reference.faces.all().delete()
+    faces = [
+        PhotoFace(photo_id=reference.id, face_group_id=group_id, face_index=face_index, bbox=bbox)
+        for group_id, face_index, bbox in original.faces.values_list("face_group_id", "face_index", "bbox")
+    ]
+    PhotoFace.objects.bulk_create(faces)
+    touched.update(face.face_group_id for face in faces)
+    if touched:
+        refresh_face_group_counts(sorted(touched))
+
+    reference.renditions.all().delete()
+    PhotoRendition.objects.bulk_create(
+        [
+            PhotoRendition(
+                photo_id=reference.id,
+                size=rendition.size,
+                format=rendition.format,
+                file=rendition.file.name,
+                width=rendition.width,
+                height=rendition.height,
+                bytes=rendition.bytes,
+            )
+            for rendition in original.renditions.all()
+        ]
+    )
+
+    if old_thumbnail and old_thumbnail != reference.thumbnail.name:
+        # 引用行原先沿用的内嵌预览已被原照片替换
+        transaction.on_commit(lambda: delete_unused_files(reference.owner_id, [("thumbnail", old_thumbnail)]))
+
+    if reference.vector_done:
+        clip_key = get_clip_embedding_service().model_key
+        blob = next((embedding.vector for embedding in embeddings if embedding.model_name == clip_key), None)
+        if blob:
+            vector = ClipEmbeddingService.bytes_to_vector(bytes(blob))
+            transaction.on_commit(
+                lambda: get_embedding_index_registry().upsert(reference.owner_id, reference.id, vector)
+            )
+
+
+def sync_references(photo_ids: Sequence[int]) -> Tuple[List[int], List[int]]:
+    """把原照片的处理结果复制到引用行。
+
+    返回 ``(pending, orphaned)``：前者的原照片尚未处理完，需要稍后再同步；
+    后者的原照片已被删除且自身结果不完整，需要按普通照片处理。
+    """
+
+    pending: List[int] = []
+    orphaned: List[int] = []
+    for reference in Photo.objects.filter(id__in=list(photo_ids)).select_related("duplicate_of"):
+        original = reference.duplicate_of
+        if original is None:
+            if not is_processed(reference):
+                orphaned.append(reference.id)
+            continue
+        with transaction.atomic():
+            _copy_results(reference, original)
+        if not is_processed(original):
+            pending.append(reference.id)
+    return pending, orphaned
+
+
+def delete_unused_files(owner_id: int, files: Iterable[Tuple[str, Optional[str]]]) -> None:
+    """删除 ``(字段名, 文件名)`` 中已无任何照片行引用的文件。"""
+
+    for field, name in files:
+        if not name:
+            continue
+        if field == "renditions":
+            in_use = PhotoRendition.objects.filter(photo__owner_id=owner_id, file=name).exists()
+            storage = PhotoRendition._meta.get_field("file").storage
+        else:
+            in_use = Photo.objects.filter(owner_id=owner_id, **{field: name}).exists()
+            storage = Photo._meta.get_field(field).storage
+        if not in_use:
+            storage.delete(name)
+
+
+def photo_files(photo: Photo) -> List[Tuple[str, Optional[str]]]:
+    files = [("image", photo.image.name), ("thumbnail", photo.thumbnail.name)]
+    files.extend(("renditions", name) for name in photo.renditions.values_list("file", flat=True))
+    return files
@@ -0,0 +1,354 @@
+"""人脸特征的紧凑存储与按用户的分组质心索引。"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from django.core.cache import cache
+
+from .ai import _require_numpy
+
+logger = logging.getLogger(__name__)
+
+# 人脸特征以 PhotoEmbedding 行保存：每张照片一行，内容为 n × 128 的 float32 矩阵
+FACE_MODEL_KEY = "face_recognition/dlib128"
+FACE_DIM = 128
+
+_VERSION_KEY = "face_index_version_{user_id}"
+
+
+def encodings_to_bytes(encodings) -> bytes:
+    """把一张照片的全部人脸特征编码为单个 blob。"""
+
+    from .vector_codec import FORMAT_FLOAT32, VectorCodec
+
+    np = _require_numpy()
+    matrix = np.asarray(encodings, dtype="float32").reshape(-1, FACE_DIM)
+    return VectorCodec(FORMAT_FLOAT32).encode(matrix)
+
+
+def bytes_to_encodings(blob: bytes):
+    """``encodings_to_bytes`` 的逆操作，返回 ``(n, 128)`` 矩阵。"""
+
+    from .vector_codec import VectorCodec
+
+    return VectorCodec().decode(bytes(blob)).reshape(-1, FACE_DIM)
+
+
+def centroid_to_bytes(vector) -> bytes:
+    np = _require_numpy()
+    return np.asarray(vector, dtype="float32").reshape(FACE_DIM).tobytes()
+
+
+def bytes_to_centroid(blob: bytes):
+    np = _require_numpy()
+    return np.frombuffer(bytes(blob), dtype="float32").copy()
+
+
+def pairwise_distances(a, b):
+    """欧氏距离矩阵 ``(len(a), len(b))``，用展开式避免三维临时数组。"""
+
+    np = _require_numpy()
+    a = np.asarray(a, dtype="float32")
+    b = np.asarray(b, dtype="float32")
+    sq = (a ** 2).sum(axis=1)[:, None] + (b ** 2).sum(axis=1)[None, :] - 2.0 * (a @ b.T)
+    return np.sqrt(np.maximum(sq, 0.0))
+
+
+def knn_graph(matrix, k: int, row_chunk: int = 1024, col_chunk: int = 16384):
+    """分块计算每行的 ``k`` 近邻（排除自身），``matrix`` 可以是 ``np.memmap``。
+
+    任一时刻只有 ``row_chunk × (col_chunk + k)`` 的距离块驻留内存，
+    返回 ``(neighbors, distances)``，形状均为 ``(n, k)``，按距离升序。
+    """
+
+    np = _require_numpy()
+    n = matrix.shape[0]
+    k = max(0, min(k, n - 1))
+    neighbors = np.empty((n, k), dtype="int64")
+    distances = np.empty((n, k), dtype="float32")
+    if k == 0:
+        return neighbors, distances
+
+    norms = np.empty(n, dtype="float32")
+    for start in range(0, n, col_chunk):
+        block = np.asarray(matrix[start : start + col_chunk], dtype="float32")
+        norms[start : start + block.shape[0]] = (block ** 2).sum(axis=1)
+
+    for start in range(0, n, row_chunk):
+        rows = np.asarray(matrix[start : start + row_chunk], dtype="float32")
+        count = rows.shape[0]
+        row_ids = np.arange(start, start + count)
+        best_d = np.empty((count, 0), dtype="float32")
+        best_i = np.empty((count, 0), dtype="int64")
+        for col_start in range(0, n, col_chunk):
+            cols = np.asarray(matrix[col_start : col_start + col_chunk], dtype="float32")
+            col_ids = np.arange(col_start, col_start + cols.shape[0])
+            sq = norms[row_ids][:, None] + norms[col_ids][None, :] - 2.0 * (rows @ cols.T)
+            dist = np.sqrt(np.maximum(sq, 0.0))
+            dist[row_ids[:, None] == col_ids[None, :]] = np.inf
+            cand_d = np.concatenate([best_d, dist], axis=1)
+            cand_i = np.concatenate([best_i, np.broadcast_to(col_ids, dist.shape)], axis=1)
+            if cand_d.shape[1] > k:
+                part = np.argpartition(cand_d, k - 1, axis=1)[:, :k]
+                cand_d = np.take_along_axis(cand_d, part, axis=1)
+                cand_i = np.take_along_axis(cand_i, part, axis=1)
+            best_d, best_i = cand_d, cand_i
+        order = np.argsort(best_d, axis=1, kind="stable")
+        distances[start : start + count] = np.take_along_axis(best_d, order, axis=1)
+        neighbors[start : start + count] = np.take_along_axis(best_i, order, axis=1)
+    return neighbors, distances
+
+
+def chinese_whispers(neighbors, distances, tol: float, iterations: int = 30, seed: int = 0):
+    """在近邻图上运行 Chinese whispers 聚类，返回从 0 开始连续编号的簇标签。
+
+    只保留距离不超过 ``tol`` 的边；每轮随机选一半节点，按邻居标签的边数投票
+    （平票取较小标签）向量化更新，连续两轮没有变化即提前结束。
+    """
+
+    np = _require_numpy()
+    n, k = neighbors.shape
+    labels = np.arange(n, dtype="int64")
+    valid = distances <= tol
+    src = np.repeat(np.arange(n, dtype="int64"), k)[valid.ravel()]
+    dst = neighbors[valid]
+    if src.size == 0:
+        return labels
+    rng = np.random.default_rng(seed)
+    stable = 0
+    for _ in range(iterations):
+        active = rng.random(n) < 0.5
+        mask = active[src]
+        rows, votes = src[mask], labels[dst[mask]]
+        if rows.size == 0:
+            continue
+        keys, weights = np.unique(rows * n + votes, return_counts=True)
+        key_rows, key_labels = keys // n, keys % n
+        order = np.lexsort((-weights, key_rows))
+        first = order[np.r_[True, key_rows[order][1:] != key_rows[order][:-1]]]
+        updated = labels.copy()
+        updated[key_rows[first]] = key_labels[first]
+        stable = stable + 1 if np.array_equal(updated, labels) else 0
+        labels = updated
+        if stable >= 2:
+            break
+    return np.unique(labels, return_inverse=True)[1]
+
+
+class FaceCentroidIndex:
+    """单个用户的人脸分组质心矩阵。
+
+    新人脸与所有质心一次矩阵运算求最近组，距离不超过 ``tol`` 即归入该组，
+    并以组内计数为权重增量更新质心；否则由调用方创建新组再 ``add`` 进来。
+    """
+
+    _MIN_CAPACITY = 64
+
+    def __init__(self) -> None:
+        self._np = _require_numpy()
+        self._lock = threading.RLock()
+        self._ids = self._np.empty(0, dtype="int64")
+        self._centroids = self._np.empty((0, FACE_DIM), dtype="float32")
+        self._counts = self._np.empty(0, dtype="int64")
+        self._size = 0
+        self._positions: Dict[int, int] = {}
+        self.version: Optional[int] = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def lock(self) -> threading.RLock:
+        return self._lock
+
+    def _reserve(self, capacity: int) -> None:
+        np = self._np
+        if capacity <= self._centroids.shape[0]:
+            return
+        new_capacity = max(capacity, self._MIN_CAPACITY, self._centroids.shape[0] * 2)
+        centroids = np.empty((new_capacity, FACE_DIM), dtype="float32")
+        centroids[: self._size] = self._centroids[: self._size]
+        ids = np.empty(new_capacity, dtype="int64")
+        ids[: self._size] = self._ids[: self._size]
+        counts = np.zeros(new_capacity, dtype="int64")
+        counts[: self._size] = self._counts[: self._size]
+        self._centroids, self._ids, self._counts = centroids, ids, counts
+
+    def add(self, group_id: int, centroid, count: int = 1) -> None:
+        with self._lock:
+            pos = self._positions.get(group_id)
+            if pos is None:
+                self._reserve(self._size + 1)
+                pos = self._size
+                self._size += 1
+                self._positions[group_id] = pos
+                self._ids[pos] = group_id
+            self._centroids[pos] = self._np.asarray(centroid, dtype="float32").reshape(FACE_DIM)
+            self._counts[pos] = max(int(count), 1)
+
+    def remove(self, group_id: int) -> bool:
+        with self._lock:
+            pos = self._positions.pop(group_id, None)
+            if pos is None:
+                return False
+            last = self._size - 1
+            if pos != last:
+                moved_id = int(self._ids[last])
+                self._centroids[pos] = self._centroids[last]
+                self._counts[pos] = self._counts[last]
+                self._ids[pos] = moved_id
+                self._positions[moved_id] = pos
+            self._size = last
+            return True
+
+    def centroid(self, group_id: int):
+        with self._lock:
+            pos = self._positions.get(group_id)
+            return None if pos is None else self._centroids[pos].copy()
+
+    def nearest(self, encodings) -> Tuple[List[Optional[int]], object]:
+        """返回每张人脸最近的组 id 及距离；索引为空时组 id 为 ``None``、距离为无穷大。"""
+
+        np = self._np
+        encodings = np.asarray(encodings, dtype="float32").reshape(-1, FACE_DIM)
+        with self._lock:
+            if self._size == 0:
+                return [None] * encodings.shape[0], np.full(encodings.shape[0], np.inf, dtype="float32")
+            dists = pairwise_distances(encodings, self._centroids[: self._size])
+            best = dists.argmin(axis=1)
+            return [int(self._ids[i]) for i in best], dists[np.arange(encodings.shape[0]), best]
+
+    def assign(self, encodings, tol: float) -> List[Optional[int]]:
+        """把人脸归入最近且距离不超过 ``tol`` 的组并更新质心，未匹配的位置返回 ``None``。
+
+        同一张照片里的人脸互不相同，因此每个组在一次调用中最多匹配一张人脸，
+        同时命中同一组时只保留距离最近的那张。
+        """
+
+        np = self._np
+        encodings = np.asarray(encodings, dtype="float32").reshape(-1, FACE_DIM)
+        with self._lock:
+            group_ids, distances = self.nearest(encodings)
+            result: List[Optional[int]] = [None] * len(group_ids)
+            for face_idx in np.argsort(distances, kind="stable").tolist():
+                group_id = group_ids[face_idx]
+                if group_id is None or distances[face_idx] > tol or group_id in result:
+                    continue
+                result[face_idx] = group_id
+                pos = self._positions[group_id]
+                count = self._counts[pos]
+                self._centroids[pos] = (self._centroids[pos] * count + encodings[face_idx]) / (count + 1)
+                self._counts[pos] = count + 1
+            return result
+
+
+def refresh_face_group_counts(group_ids: Sequence[int]) -> None:
+    """按 PhotoFace 重新统计分组内的照片数，计数走 (face_group, photo) 索引。"""
+
+    from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+    from django.db.models.functions import Coalesce
+
+    from ..models import FaceGroup, PhotoFace
+
+    photo_count = (
+        PhotoFace.objects.filter(face_group_id=OuterRef("pk"))
+        .order_by()
+        .values("face_group_id")
+        .annotate(total=Count("photo_id", distinct=True))
+        .values("total")
+    )
+    FaceGroup.objects.filter(id__in=list(group_ids)).update(
+        count=Coalesce(Subquery(photo_count, output_field=IntegerField()), Value(0))
+    )
+
+
+def _load_user_centroids(user_id: int) -> Sequence[Tuple[int, object, int]]:
+    from ..models import FaceGroup
+
+    rows = FaceGroup.objects.filter(owner_id=user_id, centroid__isnull=False).values_list("id", "centroid", "count")
+    return [(group_id, bytes_to_centroid(blob), count) for group_id, blob, count in rows]
+
+
+def _read_version(user_id: int) -> Optional[int]:
+    try:
+        return cache.get(_VERSION_KEY.format(user_id=user_id), 0)
+    except Exception:  # pragma: no cover - 缓存不可用时退化为进程内索引
+        logger.warning("读取人脸索引版本失败", extra={"user_id": user_id})
+        return None
+
+
+def bump_face_index_version(user_id: int) -> Optional[int]:
+    """标记用户的人脸分组已变化，其他进程下次访问时重新加载质心。"""
+
+    key = _VERSION_KEY.format(user_id=user_id)
+    try:
+        if cache.add(key, 1, timeout=None):
+            return 1
+        return cache.incr(key)
+    except Exception:  # pragma: no cover - 缓存不可用时退化为进程内索引
+        logger.warning("更新人脸索引版本失败", extra={"user_id": user_id})
+        return None
+
+
+class FaceIndexRegistry:
+    """进程内按用户缓存质心索引；分组数远小于人脸数，版本变化时整体重载即可。"""
+
+    def __init__(self, loader=_load_user_centroids) -> None:
+        self._loader = loader
+        self._indexes: Dict[int, FaceCentroidIndex] = {}
+        self._lock = threading.Lock()
+
+    def _build(self, user_id: int, version: Optional[int]) -> FaceCentroidIndex:
+        index = FaceCentroidIndex()
+        for group_id, centroid, count in self._loader(user_id):
+            index.add(group_id, centroid, count)
+        index.version = version
+        return index
+
+    def get(self, user_id: int) -> FaceCentroidIndex:
+        version = _read_version(user_id)
+        index = self._indexes.get(user_id)
+        if index is not None and version is not None and version == index.version:
+            return index
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is None or version is None or version != index.version:
+                index = self._build(user_id, version)
+                self._indexes[user_id] = index
+            return index
+
+    def mark_changed(self, user_id: int) -> None:
+        """本进程已写入变更：递增版本，若本地索引恰好是上一版本则直接跟进。"""
+
+        version = bump_face_index_version(user_id)
+        index = self._indexes.get(user_id)
+        if index is None:
+            return
+        with index.lock:
+            if None not in (version, index.version) and version == index.version + 1:
+                index.version = version
+            else:
+                self._indexes.pop(user_id, None)
+
+    def invalidate(self, user_id: Optional[int] = None) -> None:
+        with self._lock:
+            if user_id is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(user_id, None)
+
+
+_registry: Optional[FaceIndexRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_face_index_registry() -> FaceIndexRegistry:
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = FaceIndexRegistry()
+    return _registry
@@ -0,0 +1,139 @@
+"""按消费者所需的最小分辨率解码图片。
+
+JPEG 通过 ``Image.draft`` 在 DCT 阶段直接按 1/2、1/4、1/8 缩小解码，
+其他格式解码后用 ``Image.reduce`` 做整数倍降采样。返回的图像已按 EXIF 方向
+摆正，并记录相对原图的缩放比例，便于把检测框映射回原图坐标。
+"""
+
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass
+from typing import Optional, Sequence, Tuple
+
+from PIL import Image, ImageOps
+
+# CLIP 预处理把短边缩放到 224 后中心裁剪
+CLIP_SHORT_SIDE = 224
+THUMBNAIL_SIZE = 300
+
+_ORIENTATION_TAG = 0x0112
+_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+@dataclass
+class ReducedImage:
+    """降分辨率解码结果：``scale`` 为原图尺寸与当前图像尺寸之比 ``(x, y)``。"""
+
+    image: Image.Image
+    original_size: Tuple[int, int]
+    scale: Tuple[float, float]
+
+    def map_box(self, box: Sequence[int]) -> list:
+        """把 ``(top, right, bottom, left)`` 框映射回原图像素坐标。"""
+
+        top, right, bottom, left = box
+        sx, sy = self.scale
+        width, height = self.original_size
+        return [
+            max(0, int(round(top * sy))),
+            min(width, int(round(right * sx))),
+            min(height, int(round(bottom * sy))),
+            max(0, int(round(left * sx))),
+        ]
+
+    def fit_pixels(self, max_pixels: int) -> "ReducedImage":
+        """再缩小到不超过 ``max_pixels`` 像素（已满足时返回自身），``map_box`` 仍映射回原图坐标。"""
+
+        width, height = self.image.size
+        if not max_pixels or width * height <= max_pixels:
+            return self
+        ratio = math.sqrt(max_pixels / (width * height))
+        image = self.image.resize((max(1, int(width * ratio)), max(1, int(height * ratio))), Image.Resampling.BILINEAR)
+        return ReducedImage(
+            image=image,
+            original_size=self.original_size,
+            scale=(self.original_size[0] / image.width, self.original_size[1] / image.height),
+        )
+
+
+def _target_scale(
+    size: Tuple[int, int],
+    short_side: Optional[int],
+    long_side: Optional[int],
+    max_pixels: Optional[int],
+    box: Optional[Tuple[int, int]] = None,
+) -> float:
+    width, height = size
+    scale = 1.0
+    if box:
+        scale = min(scale, box[0] / width, box[1] / height)
+    if short_side:
+        scale = min(scale, short_side / min(width, height))
+    if long_side:
+        scale = min(scale, long_side / max(width, height))
+    if max_pixels and width * height > max_pixels:
+        scale = min(scale, math.sqrt(max_pixels / (width * height)))
+    return scale
+
+
+def _reducible(img: Image.Image) -> Image.Image:
+    """``Image.reduce`` 不支持调色板、1 位与 16 位整数图，先转换为等价的可降采样模式。"""
+
+    if img.mode == "P":
+        return img.convert("RGBA" if "transparency" in img.info else "RGB")
+    if img.mode == "1":
+        return img.convert("L")
+    if img.mode.startswith("I;16"):
+        return img.convert("I")
+    return img
+
+
+def open_reduced(
+    source,
+    *,
+    short_side: Optional[int] = None,
+    long_side: Optional[int] = None,
+    max_pixels: Optional[int] = None,
+    box: Optional[Tuple[int, int]] = None,
+    transpose: bool = True,
+) -> ReducedImage:
+    """以不小于目标尺寸的最低分辨率解码 ``source``（路径、文件对象或 ``FieldFile``）。
+
+    - ``short_side``：短边至少为该值（如 CLIP 输入）；
+    - ``long_side``：长边至少为该值（如缩略图边框）；
+    - ``max_pixels``：按该像素数估算所需尺寸（如人脸检测）；
+    - ``box``：摆正方向后能完整放入 ``(宽, 高)`` 边框（如按需渲染）。
+
+    多个约束同时给出时取缩放最多的那个；DCT 缩放只能取 2 的幂，
+    解码结果不小于所需尺寸，最多约为其两倍。
+    返回前已完成像素解码，调用方可以立即关闭 ``source``。
+    """
+
+    img = Image.open(source)
+    width, height = img.size
+    orientation = img.getexif().get(_ORIENTATION_TAG) if transpose else None
+    if box and orientation in _TRANSPOSED_ORIENTATIONS:
+        box = (box[1], box[0])
+    scale = _target_scale((width, height), short_side, long_side, max_pixels, box)
+
+    if scale < 1.0:
+        request = (max(1, math.ceil(width * scale)), max(1, math.ceil(height * scale)))
+        if img.format == "JPEG":
+            img.draft(img.mode if img.mode in ("L", "CMYK") else "RGB", request)
+        factor = min(img.size[0] // request[0], img.size[1] // request[1])
+        if factor >= 2:
+            img = _reducible(img).reduce(factor)
+    img.load()
+
+    original_size = (width, height)
+    if transpose:
+        img = ImageOps.exif_transpose(img)
+        if orientation in _TRANSPOSED_ORIENTATIONS:
+            original_size = (height, width)
+
+    return ReducedImage(
+        image=img,
+        original_size=original_size,
+        scale=(original_size[0] / img.width, original_size[1] / img.height),
+    )
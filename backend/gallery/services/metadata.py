@@ -2,20 +2,46 @@
 
 from __future__ import annotations
 
+import logging
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Dict, Optional
+from io import BytesIO
+from typing import Callable, Dict, Optional, Tuple
 
 from PIL import ExifTags, Image
 from django.utils import timezone
 
 from ..models import Photo
+from .blob_cache import open_original
 
+logger = logging.getLogger(__name__)
 
 EXIF_DATETIME_FORMATS = [
     "%Y:%m:%d %H:%M:%S",
     "%Y-%m-%d %H:%M:%S",
 ]
 
+# 文件头按需分段读取：首个窗口 64 KB，累计超过 1 MB 仍未到 SOF 时放弃
+HEADER_WINDOW = 64 * 1024
+HEADER_MAX_BYTES = 1024 * 1024
+
+# SOF0~SOF15，排除 DHT(C4)、JPG(C8)、DAC(CC)
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_EXIF_IFD = 0x8769
+_GPS_IFD = 0x8825
+_ORIENTATION_TAG = 0x0112
+_THUMBNAIL_OFFSET_TAG = 0x0201
+_THUMBNAIL_LENGTH_TAG = 0x0202
+_ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
 
 def _dms_to_deg(dms, ref):
     try:
@@ -44,15 +70,194 @@ def _parse_taken_at(value: str) -> Optional[datetime]:
     return None
 
 
-def extract_exif_metadata(photo: Photo) -> Dict[str, Optional[object]]:
-    """返回从 EXIF 信息中解析出的字段更新。"""
+class _RangeReader:
+    """按偏移读取对象内容，只在请求超出当前窗口时回源，并限制累计读取量。"""
+
+    def __init__(self, fetch: Callable[[int, int], bytes], window: int, limit: int) -> None:
+        self._fetch = fetch
+        self._window = window
+        self._limit = limit
+        self._start = 0
+        self._buffer = b""
+        self.fetched = 0
+
+    def read(self, offset: int, size: int) -> bytes:
+        end = offset + size
+        if not (self._start <= offset and end <= self._start + len(self._buffer)):
+            length = max(size, self._window)
+            if self.fetched + length > self._limit:
+                raise ValueError("文件头超过读取上限")
+            self._start, self._buffer = offset, self._fetch(offset, length)
+            self.fetched += length
+        data = self._buffer[offset - self._start : end - self._start]
+        if len(data) < size:
+            raise ValueError("文件在头部结束前截断")
+        return data
+
+
+def _range_fetcher(field_file) -> Callable[[int, int], bytes]:
+    """S3 使用 ``Range`` 请求，其余存储 seek 后读取，均不下载整个文件。"""
+
+    if not getattr(field_file, "_committed", True):
+        def fetch_uploaded(offset: int, size: int) -> bytes:
+            field_file.seek(offset)
+            return field_file.read(size)
+
+        return fetch_uploaded
+
+    storage, name = field_file.storage, field_file.name
+    bucket = getattr(storage, "bucket", None)
+    if bucket is not None:
+        normalize = getattr(storage, "_normalize_name", None)
+        key = normalize(name) if normalize else name
+
+        def fetch_s3(offset: int, size: int) -> bytes:
+            response = bucket.Object(key).get(Range=f"bytes={offset}-{offset + size - 1}")
+            return response["Body"].read()
+
+        return fetch_s3
+
+    def fetch_local(offset: int, size: int) -> bytes:
+        with storage.open(name, "rb") as fh:
+            fh.seek(offset)
+            return fh.read(size)
+
+    return fetch_local
+
+
+@dataclass
+class JpegHeader:
+    """JPEG 文件头解析结果：原始（未按方向摆正的）尺寸、EXIF 标签与 IFD1 内嵌缩略图。"""
+
+    size: Tuple[int, int]
+    tags: Dict[int, object]
+    thumbnail: Optional[bytes] = None
+
+    def preview_image(self) -> Optional[Image.Image]:
+        """解码内嵌缩略图并按主图的 Orientation 摆正；没有或无法解码时返回 ``None``。"""
+
+        if not self.thumbnail:
+            return None
+        try:
+            img = Image.open(BytesIO(self.thumbnail))
+            img.load()
+        except Exception:
+            return None
+        method = _ORIENTATION_TRANSPOSE.get(self.tags.get(_ORIENTATION_TAG))
+        return img.transpose(method) if method is not None else img
+
+
+def _parse_app1(payload: bytes) -> Tuple[Dict[int, object], Optional[bytes]]:
+    """把 APP1 数据解析为与 ``Image._getexif()`` 相同结构的字典，并取出 IFD1 缩略图。"""
+
+    exif = Image.Exif()
+    exif.load(payload)
+    tags: Dict[int, object] = dict(exif)
+    tags.update(exif.get_ifd(_EXIF_IFD))
+    gps = exif.get_ifd(_GPS_IFD)
+    if gps:
+        tags[_GPS_IFD] = dict(gps)
+
+    thumbnail = None
+    ifd1 = exif.get_ifd(ExifTags.IFD.IFD1)
+    offset, length = ifd1.get(_THUMBNAIL_OFFSET_TAG), ifd1.get(_THUMBNAIL_LENGTH_TAG)
+    if offset and length:
+        # IFD1 偏移相对于 TIFF 头，即 "Exif\0\0" 之后
+        data = payload[6 + offset : 6 + offset + length]
+        if len(data) == length and data.startswith(b"\xff\xd8"):
+            thumbnail = data
+    return tags, thumbnail
+
+
+def read_jpeg_header(
+    fetch: Callable[[int, int], bytes],
+    window: int = HEADER_WINDOW,
+    limit: int = HEADER_MAX_BYTES,
+) -> Optional[JpegHeader]:
+    """沿 JPEG 段结构读到 SOF 为止，返回尺寸、EXIF 标签与内嵌缩略图。
+
+    只读取各段的长度字段与 APP1(Exif) 内容，ICC、XMP 等大段直接跳过不下载。
+    不是 JPEG 或在上限内找不到 SOF 时返回 ``None``。
+    """
+
+    reader = _RangeReader(fetch, window, limit)
+    try:
+        if reader.read(0, 2) != b"\xff\xd8":
+            return None
+        pos, tags, thumbnail = 2, {}, None
+        while True:
+            marker_bytes = reader.read(pos, 2)
+            if marker_bytes[0] != 0xFF:
+                return None
+            marker = marker_bytes[1]
+            if marker == 0xFF:
+                pos += 1
+                continue
+            if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+                pos += 2
+                continue
+            if marker in (0xD9, 0xDA):
+                return None
+            length = int.from_bytes(reader.read(pos + 2, 2), "big")
+            if marker in _SOF_MARKERS:
+                segment = reader.read(pos + 4, 5)
+                height = int.from_bytes(segment[1:3], "big")
+                width = int.from_bytes(segment[3:5], "big")
+                return JpegHeader(size=(width, height), tags=tags, thumbnail=thumbnail)
+            if marker == 0xE1 and not tags and length > 8:
+                payload = reader.read(pos + 4, length - 2)
+                if payload.startswith(b"Exif\x00\x00"):
+                    tags, thumbnail = _parse_app1(payload)
+            pos += 2 + length
+    except ValueError:
+        return None
+
+
+def read_photo_header(photo: Photo) -> Optional[JpegHeader]:
+    """读取照片原图的 JPEG 文件头；同一实例上传流程中多处使用时只读取一次。"""
+
+    cached = getattr(photo, "_jpeg_header", None)
+    if cached is not None and cached[0] == photo.image.name:
+        return cached[1]
+    try:
+        header = read_jpeg_header(_range_fetcher(photo.image))
+    except Exception:  # pragma: no cover - 依赖外部存储
+        logger.warning("JPEG 文件头读取失败", extra={"photo_id": photo.id}, exc_info=True)
+        header = None
+    photo._jpeg_header = (photo.image.name, header)
+    return header
+
+
+def extract_exif_metadata(photo: Photo, header_only: bool = False) -> Optional[Dict[str, Optional[object]]]:
+    """返回从 EXIF 信息中解析出的字段更新。
+
+    JPEG 只按需读取文件头（S3 上为少量 Range 请求）；其他格式或文件头解析失败时
+    回退为完整打开图片，``header_only=True`` 时则直接返回 ``None``。
+    """
 
     if not photo.image:
         return {}
 
-    with Image.open(photo.image) as img:
-        width, height = img.size
-        exif_raw = getattr(img, "_getexif", lambda: None)() or {}
+    header = read_photo_header(photo)
+    if header is not None:
+        return exif_updates(header.size, header.tags)
+    if header_only:
+        return None
+
+    with open_original(photo.image) as fh, Image.open(fh) as img:
+        return exif_updates_from_image(img)
+
+
+def exif_updates_from_image(img) -> Dict[str, Optional[object]]:
+    """从已打开（尚未缩小解码）的图像解析字段更新，只读取文件头。"""
+
+    return exif_updates(img.size, getattr(img, "_getexif", lambda: None)() or {})
+
+
+def exif_updates(size: Tuple[int, int], exif_raw: Dict[int, object]) -> Dict[str, Optional[object]]:
+    """由原始尺寸与 ``{标签 id: 值}`` 生成 ``Photo`` 字段更新。"""
+
+    width, height = size
 
     exif_dict = {ExifTags.TAGS.get(k, k): v for (k, v) in exif_raw.items()}
 
@@ -0,0 +1,362 @@
+"""基于感知哈希（dHash）的近重复 / 连拍检测。
+
+- 缩略图任务解码后顺带计算 64 位 dHash，以有符号 int64 存入 ``Photo.dhash``；
+- 每个用户在进程内维护一份多索引哈希（multi-index hashing）：64 位切成 ``radius + 1`` 段，
+  由鸽巢原理，汉明距离不超过 ``radius`` 的两个哈希至少有一段完全相同。每段一张有序表，
+  查询只需各段二分查找取出候选，再按完整汉明距离过滤，无需与全部照片两两比较；
+  其他进程写入后按 id 差集增量同步，不整体重建；
+- 新照片入组时把命中的照片及其所在分组合并为一组，组号取组内最小的照片 id，写入
+  ``Photo.near_group``，列出近重复分组只是一次按索引的聚合查询。
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+from PIL import Image
+
+from ..models import Photo
+from .ai import _require_numpy
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+_HASH_MASK = (1 << HASH_BITS) - 1
+_VERSION_KEY = "near_dup_index_version_{user_id}"
+# 只需计算哈希时的解码长边，9×8 的哈希不需要更高分辨率
+DHASH_DECODE_SIZE = 64
+
+
+def dhash(img: Image.Image) -> int:
+    """差值哈希：缩放为 9×8 灰度图，逐行比较相邻像素，返回有符号 64 位整数（便于存入 BigInteger 列）。"""
+
+    small = img.convert("L").resize((9, 8), Image.Resampling.LANCZOS)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return to_signed(value)
+
+
+def to_signed(value: int) -> int:
+    value &= _HASH_MASK
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def to_unsigned(value: int) -> int:
+    return value & _HASH_MASK
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(to_unsigned(a) ^ to_unsigned(b)).count("1")
+
+
+def near_duplicate_radius() -> int:
+    return int(getattr(settings, "GALLERY_NEAR_DUP_RADIUS", 6))
+
+
+def _block_layout(radius: int) -> List[Tuple[int, int]]:
+    """把 64 位切成 ``radius + 1`` 段，返回每段的 ``(右移位数, 掩码)``。"""
+
+    count = max(1, min(radius + 1, HASH_BITS))
+    base, extra = divmod(HASH_BITS, count)
+    layout, shift = [], 0
+    for block in range(count):
+        width = base + (1 if block < extra else 0)
+        layout.append((shift, (1 << width) - 1))
+        shift += width
+    return layout
+
+
+class MultiIndexHash:
+    """单个用户的 dHash 多索引表。
+
+    新增的哈希先放入待合并区（查询时线性扫描），积累到一定数量后再整体重排进有序表；
+    删除只记录 id，查询时过滤，重排时清理。
+    """
+
+    _MERGE_THRESHOLD = 1024
+
+    def __init__(self, radius: int) -> None:
+        self._np = _require_numpy()
+        self._lock = threading.RLock()
+        self.radius = radius
+        self._layout = _block_layout(radius)
+        self._members: Dict[int, int] = {}
+        self._pending: Dict[int, int] = {}
+        self._removed: set = set()
+        self._ids = self._np.empty(0, dtype="int64")
+        self._hashes = self._np.empty(0, dtype="uint64")
+        self._tables: List[Tuple[object, object]] = []
+        self.version: Optional[int] = None
+        self._rebuild()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._members)
+
+    def __contains__(self, photo_id: int) -> bool:
+        with self._lock:
+            return photo_id in self._members
+
+    @property
+    def lock(self) -> threading.RLock:
+        return self._lock
+
+    def member_ids(self) -> Set[int]:
+        with self._lock:
+            return set(self._members)
+
+    def _rebuild(self) -> None:
+        np = self._np
+        self._ids = np.fromiter(self._members.keys(), dtype="int64", count=len(self._members))
+        self._hashes = np.fromiter(self._members.values(), dtype="uint64", count=len(self._members))
+        self._tables = []
+        for shift, mask in self._layout:
+            keys = (self._hashes >> np.uint64(shift)) & np.uint64(mask)
+            order = np.argsort(keys, kind="stable")
+            self._tables.append((keys[order], order))
+        self._pending.clear()
+        self._removed.clear()
+
+    def build(self, items: Iterable[Tuple[int, int]]) -> None:
+        with self._lock:
+            self._members = {int(photo_id): to_unsigned(int(value)) for photo_id, value in items}
+            self._rebuild()
+
+    def add(self, photo_id: int, value: int) -> None:
+        unsigned = to_unsigned(value)
+        with self._lock:
+            previous = self._members.get(photo_id)
+            if previous == unsigned:
+                return
+            if previous is not None and photo_id not in self._pending:
+                # 旧值仍留在有序表中
+                self._removed.add(photo_id)
+            self._members[photo_id] = unsigned
+            self._pending[photo_id] = unsigned
+            if len(self._pending) >= self._MERGE_THRESHOLD:
+                self._rebuild()
+
+    def remove(self, photo_id: int) -> bool:
+        with self._lock:
+            if self._members.pop(photo_id, None) is None:
+                return False
+            self._pending.pop(photo_id, None)
+            self._removed.add(photo_id)
+            return True
+
+    def _popcount(self, values):
+        np = self._np
+        if hasattr(np, "bitwise_count"):
+            return np.bitwise_count(values)
+        return np.unpackbits(values.view("uint8")).reshape(-1, HASH_BITS).sum(axis=1)  # pragma: no cover
+
+    def query(self, value: int, radius: Optional[int] = None, exclude: Optional[int] = None) -> List[Tuple[int, int]]:
+        """返回汉明距离不超过 ``radius`` 的 ``[(photo_id, 距离)]``，按距离升序。
+
+        ``radius`` 不能超过构建索引时的半径，否则鸽巢原理不成立，超出部分按构建半径截断。
+        """
+
+        np = self._np
+        radius = self.radius if radius is None else min(radius, self.radius)
+        target = np.uint64(to_unsigned(value))
+        with self._lock:
+            candidates = []
+            for (shift, mask), (keys, order) in zip(self._layout, self._tables):
+                key = (target >> np.uint64(shift)) & np.uint64(mask)
+                candidates.append(order[np.searchsorted(keys, key, "left") : np.searchsorted(keys, key, "right")])
+            rows = np.unique(np.concatenate(candidates))
+            ids, hashes = self._ids[rows], self._hashes[rows]
+            if self._removed:
+                keep = ~np.isin(ids, np.fromiter(self._removed, dtype="int64", count=len(self._removed)))
+                ids, hashes = ids[keep], hashes[keep]
+            if self._pending:
+                ids = np.concatenate([ids, np.fromiter(self._pending.keys(), dtype="int64", count=len(self._pending))])
+                hashes = np.concatenate(
+                    [hashes, np.fromiter(self._pending.values(), dtype="uint64", count=len(self._pending))]
+                )
+
+        distances = self._popcount(hashes ^ target)
+        matched = distances <= radius
+        if exclude is not None:
+            matched &= ids != exclude
+        pairs = sorted(zip(distances[matched].tolist(), ids[matched].tolist()))
+        return [(int(photo_id), int(distance)) for distance, photo_id in pairs]
+
+
+def _load_user_hashes(user_id: int, photo_ids: Optional[Sequence[int]] = None) -> Iterable[Tuple[int, int]]:
+    qs = Photo.objects.filter(owner_id=user_id, dhash__isnull=False)
+    if photo_ids is not None:
+        qs = qs.filter(id__in=list(photo_ids))
+    return qs.values_list("id", "dhash").iterator(chunk_size=5000)
+
+
+def _load_user_hash_ids(user_id: int) -> List[int]:
+    return list(Photo.objects.filter(owner_id=user_id, dhash__isnull=False).values_list("id", flat=True))
+
+
+def _read_version(user_id: int) -> Optional[int]:
+    try:
+        return cache.get(_VERSION_KEY.format(user_id=user_id), 0)
+    except Exception:  # pragma: no cover - 缓存不可用时退化为进程内索引
+        logger.warning("读取近重复索引版本失败", extra={"user_id": user_id})
+        return None
+
+
+def _bump_version(user_id: int) -> Optional[int]:
+    key = _VERSION_KEY.format(user_id=user_id)
+    try:
+        if cache.add(key, 1, timeout=None):
+            return 1
+        return cache.incr(key)
+    except Exception:  # pragma: no cover - 缓存不可用时退化为进程内索引
+        logger.warning("更新近重复索引版本失败", extra={"user_id": user_id})
+        return None
+
+
+class NearDuplicateIndexRegistry:
+    """进程内按用户缓存 dHash 索引。
+
+    本进程内的新增/删除直接增量更新；其他进程的变更通过缓存中的版本号感知，
+    只按 id 差集补齐缺失的哈希、剔除已删除的照片，不整体重建。
+    """
+
+    def __init__(
+        self,
+        loader: Callable[..., Iterable[Tuple[int, int]]] = _load_user_hashes,
+        id_loader: Callable[[int], Sequence[int]] = _load_user_hash_ids,
+    ) -> None:
+        self._loader = loader
+        self._id_loader = id_loader
+        self._indexes: Dict[int, MultiIndexHash] = {}
+        self._lock = threading.Lock()
+
+    def _build(self, user_id: int) -> MultiIndexHash:
+        index = MultiIndexHash(near_duplicate_radius())
+        index.version = _read_version(user_id)
+        index.build(self._loader(user_id))
+        return index
+
+    def _sync(self, user_id: int, index: MultiIndexHash, version: Optional[int]) -> None:
+        current = set(self._id_loader(user_id))
+        known = index.member_ids()
+        for photo_id in known - current:
+            index.remove(photo_id)
+        missing = sorted(current - known)
+        if missing:
+            for photo_id, value in self._loader(user_id, missing):
+                index.add(photo_id, value)
+        index.version = version
+
+    def get(self, user_id: int) -> MultiIndexHash:
+        index = self._indexes.get(user_id)
+        if index is None:
+            with self._lock:
+                index = self._indexes.get(user_id)
+                if index is None:
+                    index = self._build(user_id)
+                    self._indexes[user_id] = index
+            return index
+
+        version = _read_version(user_id)
+        if version is None or version != index.version:
+            with index.lock:
+                if version is None or version != index.version:
+                    self._sync(user_id, index, version)
+        return index
+
+    def _apply(self, user_id: int, change: Callable[[MultiIndexHash], None]) -> None:
+        version = _bump_version(user_id)
+        index = self._indexes.get(user_id)
+        if index is None:
+            return
+        with index.lock:
+            in_sync = None not in (version, index.version) and version == index.version + 1
+            change(index)
+            if in_sync:
+                index.version = version
+
+    def add(self, user_id: int, photo_id: int, value: int) -> None:
+        self._apply(user_id, lambda index: index.add(photo_id, value))
+
+    def remove(self, user_id: int, photo_id: int) -> None:
+        self._apply(user_id, lambda index: index.remove(photo_id))
+
+    def invalidate(self, user_id: Optional[int] = None) -> None:
+        with self._lock:
+            if user_id is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(user_id, None)
+
+
+_registry: Optional[NearDuplicateIndexRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_near_duplicate_registry() -> NearDuplicateIndexRegistry:
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = NearDuplicateIndexRegistry()
+    return _registry
+
+
+def assign_near_group(photo: Photo) -> Optional[int]:
+    """把照片并入近重复分组：与命中的照片及它们所在的组合并，返回组号；没有近邻时返回 ``None``。"""
+
+    if photo.dhash is None:
+        return None
+    registry = get_near_duplicate_registry()
+    matches = registry.get(photo.owner_id).query(photo.dhash, exclude=photo.id)
+    registry.add(photo.owner_id, photo.id, photo.dhash)
+    if not matches:
+        return None
+
+    ids = sorted({photo_id for photo_id, _ in matches} | {photo.id})
+    owned = Photo.objects.select_for_update().filter(owner_id=photo.owner_id).order_by("id")
+    with transaction.atomic():
+        # 先锁住命中的照片再读取其分组，再锁住这些分组的全部成员，并发上传不会把一组拆成两组
+        groups = {group for group in owned.filter(id__in=ids).values_list("near_group", flat=True) if group is not None}
+        members = list(owned.filter(Q(id__in=ids) | Q(near_group__in=groups)).values_list("id", "near_group"))
+        groups.update(group for _, group in members if group is not None)
+        target = min(groups | {member_id for member_id, _ in members})
+        Photo.objects.filter(owner_id=photo.owner_id).filter(Q(id__in=ids) | Q(near_group__in=groups)).exclude(
+            near_group=target
+        ).update(near_group=target)
+    photo.near_group = target
+    return target
+
+
+def near_duplicate_clusters(owner_id: int, limit: int = 50, min_size: int = 2) -> List[Tuple[int, int]]:
+    """按组内照片数降序返回 ``[(组号, 张数)]``，走 ``(owner, near_group)`` 索引聚合。"""
+
+    rows = (
+        Photo.objects.filter(owner_id=owner_id, near_group__isnull=False)
+        .values("near_group")
+        .annotate(size=Count("id"))
+        .filter(size__gte=max(2, min_size))
+        .order_by("-size", "near_group")[:limit]
+    )
+    return [(row["near_group"], row["size"]) for row in rows]
+
+
+def hash_and_group(photo: Photo, img: Image.Image) -> Optional[int]:
+    """计算并保存 dHash，再尝试入组；缺少 numpy 时只保存哈希。"""
+
+    photo.dhash = dhash(img)
+    Photo.objects.filter(id=photo.id).update(dhash=photo.dhash)
+    try:
+        return assign_near_group(photo)
+    except RuntimeError:  # pragma: no cover - 缺少 numpy 时索引不可用
+        return None
+
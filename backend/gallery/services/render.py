@@ -0,0 +1,123 @@
+"""按需渲染派生图：请求到来时才按尺寸生成，结果写入本地磁盘 LRU 缓存。
+
+尺寸只能取 ``GALLERY_RENDER_SIZES`` 中的档位（请求值向上取整到最近一档），
+避免任意参数组合把缓存刷爆；同一渲染结果的缓存 key 与 ETag 固定，可长期缓存。
+"""
+
+from __future__ import annotations
+
+import bisect
+import hashlib
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, List, Mapping, Optional
+
+from django.conf import settings
+from PIL import Image
+
+from ..models import Photo
+from .blob_cache import BlobCache, open_original
+from .imaging import open_reduced
+from .renditions import RENDITION_FORMATS, rendition_formats
+
+# 渲染参数（编码质量、缩放算法）变化时递增，使旧缓存与 ETag 全部失效
+RENDER_VERSION = 1
+
+
+@dataclass(frozen=True)
+class RenderSpec:
+    width: int
+    height: int
+    format: str
+
+    @property
+    def content_type(self) -> str:
+        return RENDITION_FORMATS[self.format][2]
+
+
+def allowed_sizes() -> List[int]:
+    raw = getattr(settings, "GALLERY_RENDER_SIZES", "128,256,512,1024,2048")
+    if isinstance(raw, str):
+        raw = raw.split(",")
+    return sorted({int(size) for size in raw if str(size).strip()})
+
+
+def _snap(value: Optional[str], sizes: List[int]) -> Optional[int]:
+    if value in (None, ""):
+        return None
+    number = int(value)
+    if number <= 0:
+        raise ValueError("尺寸必须为正整数")
+    index = bisect.bisect_left(sizes, number)
+    return sizes[min(index, len(sizes) - 1)]
+
+
+def _negotiate_format(accept: str) -> str:
+    formats = rendition_formats()
+    for fmt in formats:
+        if RENDITION_FORMATS[fmt][2] in accept:
+            return fmt
+    return "jpeg"
+
+
+def parse_render_spec(params: Mapping[str, str], accept: str = "") -> RenderSpec:
+    """解析 ``w`` / ``h`` / ``fmt``；宽高至少给出一个，未给 ``fmt`` 时按 Accept 头选择格式。"""
+
+    sizes = allowed_sizes()
+    try:
+        width = _snap(params.get("w"), sizes)
+        height = _snap(params.get("h"), sizes)
+    except ValueError as exc:
+        raise ValueError("w/h 必须为正整数") from exc
+    if width is None and height is None:
+        raise ValueError("w 与 h 至少需要一个")
+    largest = sizes[-1]
+
+    fmt = (params.get("fmt") or "").lower() or _negotiate_format(accept or "")
+    if fmt == "jpg":
+        fmt = "jpeg"
+    if fmt not in rendition_formats() and fmt != "jpeg":
+        raise ValueError(f"不支持的格式：{fmt}")
+    return RenderSpec(width=width or largest, height=height or largest, format=fmt)
+
+
+def render_key(photo: Photo, spec: RenderSpec) -> str:
+    return f"v{RENDER_VERSION}:{photo.image.name}:{spec.width}x{spec.height}.{spec.format}"
+
+
+def render_etag(key: str) -> str:
+    return '"' + hashlib.sha1(key.encode("utf-8")).hexdigest() + '"'
+
+
+def _encode(photo: Photo, spec: RenderSpec, out: BinaryIO) -> None:
+    with open_original(photo.image) as fh:
+        img = open_reduced(fh, box=(spec.width, spec.height)).image
+    if img.width > spec.width or img.height > spec.height:
+        img.thumbnail((spec.width, spec.height), Image.Resampling.LANCZOS)
+    pil_format, _, _, options = RENDITION_FORMATS[spec.format]
+    img.convert("RGB").save(out, format=pil_format, **options)
+
+
+def render_photo(photo: Photo, spec: RenderSpec) -> BinaryIO:
+    """返回渲染结果缓存文件的只读文件对象（调用方负责关闭），并发未命中同一结果时只解码一次。
+
+    直接返回已打开的文件而非路径，缓存条目在打开后被其他进程淘汰也能读完。
+    """
+
+    return get_render_cache().open_or_create(render_key(photo, spec), lambda out: _encode(photo, spec, out))
+
+
+_cache: Optional[BlobCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_render_cache() -> BlobCache:
+    global _cache
+    root = Path(getattr(settings, "GALLERY_RENDER_CACHE_DIR", "var/renders"))
+    with _cache_lock:
+        if _cache is None or _cache.root != root:
+            max_mb = int(getattr(settings, "GALLERY_RENDER_CACHE_MAX_MB", 1024))
+            stats_every = int(getattr(settings, "GALLERY_BLOB_CACHE_STATS_EVERY", 1000))
+            _cache = BlobCache(root, max_bytes=max_mb * 1024 * 1024, label="渲染缓存", stats_every=stats_every)
+        return _cache
@@ -0,0 +1,163 @@
+"""多尺寸派生图：一次解码生成配置中的全部尺寸与格式。
+
+列表、灯箱等场景按需选用合适尺寸，避免客户端为了清晰度直接下载原图。
+"""
+
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from io import BytesIO
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from PIL import Image, features
+
+from ..models import Photo, PhotoRendition
+from .dedup import delete_unused_files
+
+logger = logging.getLogger(__name__)
+
+# 格式 -> (Pillow 格式名, 扩展名, MIME, 编码参数)
+RENDITION_FORMATS = {
+    "webp": ("WEBP", "webp", "image/webp", {"quality": 80, "method": 4}),
+    "avif": ("AVIF", "avif", "image/avif", {"quality": 60}),
+    "jpeg": ("JPEG", "jpg", "image/jpeg", {"quality": 85, "optimize": True, "progressive": True}),
+}
+
+
+@dataclass(frozen=True)
+class RenderedRendition:
+    size: int
+    format: str
+    width: int
+    height: int
+    content: ContentFile
+
+
+def _parse_list(value) -> List[str]:
+    if isinstance(value, str):
+        value = value.split(",")
+    return [str(item).strip().lower() for item in value if str(item).strip()]
+
+
+def rendition_sizes() -> List[int]:
+    """配置的目标长边（升序），未配置时为空表示不生成派生图。"""
+
+    return sorted({int(size) for size in _parse_list(getattr(settings, "GALLERY_RENDITION_SIZES", ""))})
+
+
+def rendition_formats() -> List[str]:
+    """配置的输出格式；当前 Pillow 不支持的编码器会被跳过，始终保留 JPEG 作为兜底。"""
+
+    formats = []
+    for fmt in _parse_list(getattr(settings, "GALLERY_RENDITION_FORMATS", "webp,jpeg")):
+        if fmt not in RENDITION_FORMATS:
+            logger.warning("未知的派生图格式 %s，已忽略", fmt)
+            continue
+        if fmt != "jpeg" and not features.check(fmt):
+            logger.warning("Pillow 缺少 %s 编码器，改用 JPEG", fmt)
+            fmt = "jpeg"
+        if fmt not in formats:
+            formats.append(fmt)
+    return formats or ["jpeg"]
+
+
+def _targets(sizes: Sequence[int], long_side: int) -> List[int]:
+    """不放大：只保留不超过原图长边的尺寸；原图比最小尺寸还小时按最小尺寸保留一份原尺寸。"""
+
+    targets = [size for size in sizes if size <= long_side]
+    return targets or list(sizes[:1])
+
+
+def render_renditions(
+    img: Image.Image,
+    sizes: Optional[Sequence[int]] = None,
+    formats: Optional[Sequence[str]] = None,
+) -> List[RenderedRendition]:
+    """由已摆正方向的图像生成派生图，从大到小逐级缩放，每级只在上一级基础上缩小。"""
+
+    sizes = rendition_sizes() if sizes is None else sorted(sizes)
+    formats = rendition_formats() if formats is None else list(formats)
+    if not sizes:
+        return []
+
+    current = img.convert("RGB")
+    results: List[RenderedRendition] = []
+    for size in sorted(_targets(sizes, max(img.size)), reverse=True):
+        if max(current.size) > size:
+            current = current.copy()
+            current.thumbnail((size, size), Image.Resampling.LANCZOS)
+        for fmt in formats:
+            pil_format, _, _, options = RENDITION_FORMATS[fmt]
+            buffer = BytesIO()
+            current.save(buffer, format=pil_format, **options)
+            results.append(
+                RenderedRendition(
+                    size=size,
+                    format=fmt,
+                    width=current.width,
+                    height=current.height,
+                    content=ContentFile(buffer.getvalue()),
+                )
+            )
+    return results
+
+
+def rendition_name(photo: Photo, size: int, fmt: str) -> str:
+    return f"{Path(photo.image.name).stem}_{size}.{RENDITION_FORMATS[fmt][1]}"
+
+
+def store_renditions(photo: Photo, rendered: Iterable[RenderedRendition]) -> List[PhotoRendition]:
+    """保存派生图文件并整体替换该照片的 ``PhotoRendition`` 行，提交后删除旧文件。"""
+
+    rows = []
+    for item in rendered:
+        row = PhotoRendition(
+            photo=photo,
+            size=item.size,
+            format=item.format,
+            width=item.width,
+            height=item.height,
+            bytes=item.content.size,
+        )
+        row.file.save(rendition_name(photo, item.size, item.format), item.content, save=False)
+        rows.append(row)
+
+    new_names = {row.file.name for row in rows}
+    with transaction.atomic():
+        old_names = [
+            name
+            for name in PhotoRendition.objects.filter(photo=photo).values_list("file", flat=True)
+            if name and name not in new_names
+        ]
+        PhotoRendition.objects.filter(photo=photo).delete()
+        PhotoRendition.objects.bulk_create(rows)
+        if old_names:
+            # 引用行（见 dedup）可能仍共用旧文件，提交后只删除无人引用的
+            transaction.on_commit(
+                lambda: delete_unused_files(photo.owner_id, [("renditions", name) for name in old_names])
+            )
+    return rows
+
+
+def max_rendition_size() -> int:
+    """派生图与缩略图共用一次解码时所需的长边，未配置派生图时为 0。"""
+
+    sizes = rendition_sizes()
+    return max(sizes) if sizes else 0
+
+
+def build_srcsets(renditions: Iterable[PhotoRendition], absolute=None) -> dict:
+    """按格式输出 srcset 字符串，如 ``{"webp": "a_256.webp 256w, a_1024.webp 1024w"}``。"""
+
+    grouped: dict = {}
+    for rendition in sorted(renditions, key=lambda item: item.width):
+        url = rendition.file.url
+        if absolute is not None:
+            url = absolute(url)
+        grouped.setdefault(rendition.format, []).append(f"{url} {rendition.width}w")
+    return {fmt: ", ".join(entries) for fmt, entries in grouped.items()}
@@ -1,9 +1,16 @@
-"""存储集成相关工具。"""
+"""存储集成相关工具。
+
+boto3 客户端的构造代价较高（加载服务模型、建立连接池），且客户端本身线程安全，
+因此按配置在进程内缓存一份，所有请求与线程共用，连接池大小由 ``GALLERY_S3_MAX_POOL_CONNECTIONS`` 决定。
+"""
 
 from __future__ import annotations
 
+import base64
+import binascii
+import threading
 from dataclasses import dataclass
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 import boto3
 from botocore.client import Config
@@ -22,6 +29,41 @@ class S3Config:
     access_key: Optional[str]
     secret_key: Optional[str]
     signature_version: str
+    max_pool_connections: int = 50
+
+
+_clients: Dict[S3Config, Any] = {}
+_clients_lock = threading.Lock()
+
+
+def get_s3_client(config: S3Config):
+    """返回进程内共享的 S3 客户端；默认 Session 不是线程安全的，构造放在锁内并使用独立 Session。"""
+
+    client = _clients.get(config)
+    if client is not None:
+        return client
+    with _clients_lock:
+        client = _clients.get(config)
+        if client is None:
+            client = boto3.session.Session().client(
+                "s3",
+                endpoint_url=config.endpoint_url,
+                region_name=config.region_name,
+                aws_access_key_id=config.access_key,
+                aws_secret_access_key=config.secret_key,
+                config=Config(
+                    signature_version=config.signature_version,
+                    max_pool_connections=config.max_pool_connections,
+                    retries={"max_attempts": 3, "mode": "standard"},
+                ),
+            )
+            _clients[config] = client
+        return client
+
+
+def reset_s3_clients() -> None:
+    with _clients_lock:
+        _clients.clear()
 
 
 class S3UploadService:
@@ -29,32 +71,49 @@ class S3UploadService:
 
     def __init__(self, config: S3Config) -> None:
         self.config = config
-        self._client = None
 
     @property
     def client(self):
-        if self._client is None:
-            self._client = boto3.client(
-                "s3",
-                endpoint_url=self.config.endpoint_url,
-                region_name=self.config.region_name,
-                aws_access_key_id=self.config.access_key,
-                aws_secret_access_key=self.config.secret_key,
-                config=Config(signature_version=self.config.signature_version),
-            )
-        return self._client
-
-    def generate_presigned_put(self, object_key: str, content_type: str, expires: int = 300) -> str:
-        return self.client.generate_presigned_url(
-            ClientMethod="put_object",
-            Params={
-                "Bucket": self.config.bucket_name,
-                "Key": object_key,
-                "ContentType": content_type,
-                "ACL": "private",
-            },
-            ExpiresIn=expires,
-        )
+        return get_s3_client(self.config)
+
+    def generate_presigned_put(
+        self, object_key: str, content_type: str, expires: int = 300, checksum_sha256: Optional[str] = None
+    ) -> str:
+        params = {
+            "Bucket": self.config.bucket_name,
+            "Key": object_key,
+            "ContentType": content_type,
+            "ACL": "private",
+        }
+        if checksum_sha256:
+            # 签入 x-amz-checksum-sha256，S3 会校验上传内容与之一致
+            params["ChecksumSHA256"] = checksum_sha256
+        return self.client.generate_presigned_url(ClientMethod="put_object", Params=params, ExpiresIn=expires)
+
+    def generate_presigned_puts(
+        self, items: Iterable[Tuple[str, str, Optional[str]]], expires: int = 300
+    ) -> List[str]:
+        """批量签名 ``(object_key, content_type, checksum_sha256)``；签名在本地完成，不访问 S3。"""
+
+        return [
+            self.generate_presigned_put(object_key, content_type, expires, checksum_sha256=checksum)
+            for object_key, content_type, checksum in items
+        ]
+
+    def object_sha256(self, object_key: str) -> Optional[str]:
+        """返回 S3 已校验的对象 SHA-256（十六进制）；上传时未带校验和或为分片组合校验和时返回 ``None``。"""
+
+        head = self.client.head_object(Bucket=self.config.bucket_name, Key=object_key, ChecksumMode="ENABLED")
+        checksum = head.get("ChecksumSHA256")
+        if not checksum or "-" in checksum:
+            return None
+        try:
+            return base64.b64decode(checksum).hex()
+        except (binascii.Error, ValueError):
+            return None
+
+    def delete_object(self, object_key: str) -> None:
+        self.client.delete_object(Bucket=self.config.bucket_name, Key=object_key)
 
     def initiate_multipart(self, object_key: str, content_type: str) -> Dict[str, Any]:
         return self.client.create_multipart_upload(
@@ -76,6 +135,14 @@ class S3UploadService:
             ExpiresIn=expires,
         )
 
+    def generate_presigned_part_urls(
+        self, object_key: str, upload_id: str, part_numbers: Iterable[int], expires: int = 600
+    ) -> Dict[int, str]:
+        return {
+            part_number: self.generate_presigned_part_url(object_key, upload_id, part_number, expires)
+            for part_number in part_numbers
+        }
+
     def complete_multipart(self, object_key: str, upload_id: str, parts: list[dict[str, Any]]) -> Dict[str, Any]:
         return self.client.complete_multipart_upload(
             Bucket=self.config.bucket_name,
@@ -97,6 +164,7 @@ def _load_s3_config() -> S3Config:
         access_key=getattr(settings, "AWS_ACCESS_KEY_ID", None),
         secret_key=getattr(settings, "AWS_SECRET_ACCESS_KEY", None),
         signature_version=getattr(settings, "AWS_S3_SIGNATURE_VERSION", "s3v4"),
+        max_pool_connections=int(getattr(settings, "GALLERY_S3_MAX_POOL_CONNECTIONS", 50)),
     )
 
 
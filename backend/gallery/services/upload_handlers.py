@@ -0,0 +1,117 @@
+"""相册上传处理器：在接收分块的同时完成哈希、类型识别与文件头解析。
+
+默认的 ``MultiPartParser`` 先把文件落到内存或临时文件，之后计算哈希、读取 EXIF
+还要再读一遍。``GalleryUploadHandler`` 对每个分块只处理一次：
+
+- 增量计算 SHA-256；
+- 按文件头魔数识别真实类型，覆盖客户端声明的 ``Content-Type``；
+- JPEG 在累积到 SOF 段后立即解析尺寸、EXIF 与内嵌缩略图，之后不再缓存分块；
+- 分块直接写入 ``GALLERY_UPLOAD_TEMP_DIR``。该目录与 ``MEDIA_ROOT`` 位于同一文件系统时，
+  ``FileSystemStorage`` 保存原图只需一次 rename，不会再复制一遍数据。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+
+from .metadata import HEADER_MAX_BYTES, JpegHeader, read_jpeg_header
+
+# 识别类型所需的最少字节数（ISO BMFF 的 ftyp 品牌位于第 8~12 字节）
+_SNIFF_BYTES = 12
+_HEIF_BRANDS = {b"heic", b"heix", b"hevc", b"hevx", b"mif1", b"msf1"}
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """按魔数返回图片 MIME 类型，无法识别时返回 ``None``。"""
+
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp":
+        brand = head[8:12]
+        if brand in (b"avif", b"avis"):
+            return "image/avif"
+        if brand in _HEIF_BRANDS:
+            return "image/heic"
+    return None
+
+
+class HashedUploadedFile(TemporaryUploadedFile):
+    """写入指定临时目录的上传文件，附带接收过程中得到的 ``sha256``、``sniffed_type`` 与 ``header``。"""
+
+    def __init__(self, name, content_type, charset, content_type_extra=None, temp_dir=None):
+        file = tempfile.NamedTemporaryFile(suffix=".upload" + Path(name).suffix, dir=temp_dir)
+        UploadedFile.__init__(self, file, name, content_type, 0, charset, content_type_extra)
+        self.sha256: Optional[str] = None
+        self.sniffed_type: Optional[str] = None
+        self.header: Optional[JpegHeader] = None
+
+
+def upload_temp_dir() -> Optional[str]:
+    temp_dir = getattr(settings, "GALLERY_UPLOAD_TEMP_DIR", "")
+    if not temp_dir:
+        return settings.FILE_UPLOAD_TEMP_DIR
+    Path(temp_dir).mkdir(parents=True, exist_ok=True)
+    return str(temp_dir)
+
+
+class GalleryUploadHandler(FileUploadHandler):
+    """接收分块时增量计算哈希并解析文件头，返回 ``HashedUploadedFile``。"""
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file = HashedUploadedFile(
+            self.file_name, self.content_type, self.charset, self.content_type_extra, temp_dir=upload_temp_dir()
+        )
+        self._hash = hashlib.sha256()
+        self._head = bytearray()
+        self._head_done = False
+
+    def receive_data_chunk(self, raw_data, start):
+        self._hash.update(raw_data)
+        self.file.write(raw_data)
+        if not self._head_done:
+            self._head.extend(raw_data)
+            self._parse_head(complete=False)
+        # 返回 None：分块已消费，不再交给后续处理器
+
+    def _parse_head(self, complete: bool) -> None:
+        if len(self._head) < _SNIFF_BYTES and not complete:
+            return
+        if self.file.sniffed_type is None:
+            self.file.sniffed_type = sniff_image_type(bytes(self._head[:_SNIFF_BYTES]))
+        if self.file.sniffed_type == "image/jpeg":
+            head = self._head
+            header = read_jpeg_header(lambda offset, size: bytes(head[offset : offset + size]))
+            if header is None and not complete and len(head) < HEADER_MAX_BYTES:
+                # SOF 之前的段还没收全，等下一个分块
+                return
+            self.file.header = header
+        self._head_done = True
+        self._head = bytearray()
+
+    def file_complete(self, file_size):
+        if not self._head_done:
+            self._parse_head(complete=True)
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.sha256 = self._hash.hexdigest()
+        if self.file.sniffed_type:
+            self.file.content_type = self.file.sniffed_type
+        return self.file
+
+    def upload_interrupted(self):
+        if hasattr(self, "file"):
+            self.file.close()
@@ -2,26 +2,221 @@
 
 from __future__ import annotations
 
-from typing import Iterable, List
+import logging
+from typing import Iterable, List, Sequence, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 
 from ..models import Album, Photo
-from ..tasks import generate_thumbnail, extract_exif_task
-from ..tasks_ai import task_clip_vector_and_labels, task_face_embeddings_and_group
+from ..tasks import attach_embedded_preview, generate_thumbnail, extract_exif_task, task_sync_duplicates
+from ..tasks_ai import (
+    task_clip_vector_and_labels,
+    task_clip_vector_and_labels_batch,
+    task_face_embeddings_and_group,
+    task_flush_clip_batch,
+)
+from ..tasks_pipeline import task_dispatch_upload_batch, task_process_photo
+from .batching import get_clip_batch_collector
+from .dedup import content_hash_of, duplicate_policy, find_originals, make_reference
+from .metadata import exif_updates, extract_exif_metadata, read_photo_header
+from .upload_handlers import HashedUploadedFile
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_clip_vector(photo_id: int) -> None:
+    """调度 CLIP 编码；开启微批时先进入收集器，凑满一批或超时后统一推理。"""
+
+    if not getattr(settings, "GALLERY_CLIP_BATCHING", False):
+        task_clip_vector_and_labels.delay(photo_id)
+        return
+
+    collector = get_clip_batch_collector()
+    try:
+        result = collector.add(photo_id)
+    except Exception:  # pragma: no cover - Redis 不可用时退化为单张任务
+        logger.warning("CLIP 收集器不可用，改为单张调度", extra={"photo_id": photo_id})
+        task_clip_vector_and_labels.delay(photo_id)
+        return
+    if result.batch:
+        task_clip_vector_and_labels_batch.delay(result.batch)
+    if result.schedule_flush:
+        task_flush_clip_batch.apply_async(countdown=collector.wait_ms / 1000)
+
+
+def dispatch_clip_batches(photo_ids: Sequence[int]) -> None:
+    """已知一组照片时直接按批大小切分派发，无需经过收集器。"""
+
+    batch_size = max(1, int(getattr(settings, "GALLERY_CLIP_BATCH_SIZE", 32)))
+    for start in range(0, len(photo_ids), batch_size):
+        task_clip_vector_and_labels_batch.delay(list(photo_ids[start : start + batch_size]))
 
 
-def dispatch_post_upload_tasks(photo_id: int) -> None:
-    """为照片调度异步处理流水线。"""
+def apply_exif_inline(photo: Photo) -> bool:
+    """在请求内只读文件头提取 EXIF 并保存；无法仅靠文件头完成时返回 False，交给异步任务。"""
 
+    if not getattr(settings, "GALLERY_INLINE_EXIF", True):
+        return False
+    try:
+        updates = extract_exif_metadata(photo, header_only=True)
+    except Exception:  # pragma: no cover - 依赖外部存储
+        logger.warning("同步 EXIF 提取失败，改为异步任务", extra={"photo_id": photo.id}, exc_info=True)
+        return False
+    if updates is None:
+        return False
+    if updates:
+        Photo.objects.filter(id=photo.id).update(**updates)
+        for field, value in updates.items():
+            setattr(photo, field, value)
+    return True
+
+
+def apply_header_inline(photo: Photo) -> bool:
+    """上传请求内只读取文件头：有 EXIF 内嵌缩略图时先保存为预览，并提取 EXIF。
+
+    耗时只与文件头大小相关，不随图片尺寸增长；完整缩略图一律由异步任务生成。
+    返回 EXIF 是否已完成。
+    """
+
+    try:
+        attach_embedded_preview(photo)
+    except Exception:  # pragma: no cover - 依赖外部存储
+        logger.warning("内嵌缩略图预览失败", extra={"photo_id": photo.id}, exc_info=True)
+    return apply_exif_inline(photo)
+
+
+def dispatch_post_upload_tasks(photo_id: int, exif_done: bool = False) -> None:
+    """为照片调度异步处理流水线；``exif_done`` 表示 EXIF 已在请求内提取。"""
+
+    if getattr(settings, "GALLERY_FUSED_PIPELINE", False):
+        task_process_photo.delay(photo_id)
+        return
     generate_thumbnail.delay(photo_id)
-    extract_exif_task.delay(photo_id)
-    task_clip_vector_and_labels.delay(photo_id)
+    if not exif_done:
+        extract_exif_task.delay(photo_id)
+    enqueue_clip_vector(photo_id)
     task_face_embeddings_and_group.delay(photo_id)
 
 
-def create_photos_from_form_upload(owner, album: Album, files: Iterable) -> List[Photo]:
+def dispatch_reference_sync(photo_ids: Sequence[int]) -> None:
+    """引用行不执行后处理，只派发一条同步任务复制原照片的结果。"""
+
+    if photo_ids:
+        task_sync_duplicates.delay(list(photo_ids))
+
+
+def dispatch_post_upload_batch(photo_ids: Sequence[int], exif_done_ids: Sequence[int] = ()) -> None:
+    """整批上传只向 broker 发送一条消息，由 worker 展开为各阶段任务。"""
+
+    if photo_ids:
+        task_dispatch_upload_batch.delay(list(photo_ids), list(exif_done_ids))
+
+
+def fan_out_upload_batch(photo_ids: Sequence[int], exif_done_ids: Sequence[int] = ()) -> None:
+    """在 worker 内展开整批上传的后续任务；CLIP 已知整批照片，直接按批大小派发。"""
+
+    if getattr(settings, "GALLERY_FUSED_PIPELINE", False):
+        for photo_id in photo_ids:
+            task_process_photo.delay(photo_id)
+        return
+    exif_done = set(exif_done_ids)
+    for photo_id in photo_ids:
+        generate_thumbnail.delay(photo_id)
+        if photo_id not in exif_done:
+            extract_exif_task.delay(photo_id)
+        task_face_embeddings_and_group.delay(photo_id)
+    dispatch_clip_batches(list(photo_ids))
+
+
+def _prepare_form_photo(owner, album: Album, uploaded, title: str = "") -> Tuple[Photo, bool]:
+    """写入原图文件并在实例上填好文件头可得的字段，不访问数据库；返回照片与 EXIF 是否已完成。"""
+
+    photo = Photo(owner=owner, album=album, title=title)
+    photo.image = uploaded
+    if isinstance(uploaded, HashedUploadedFile):
+        # 上传处理器在接收分块时已解析过文件头
+        header = uploaded.header
+    else:
+        # 文件尚在内存/临时文件中，先读文件头，避免写入存储后再回读
+        header = read_photo_header(photo)
+    photo.image.save(uploaded.name, uploaded, save=False)
+    if header is None:
+        return photo, False
+
+    try:
+        attach_embedded_preview(photo, header=header, commit=False)
+    except Exception:  # pragma: no cover - 依赖外部存储
+        logger.warning("内嵌缩略图预览失败", extra={"upload": uploaded.name}, exc_info=True)
+    if getattr(settings, "GALLERY_INLINE_EXIF", True):
+        for field, value in exif_updates(header.size, header.tags).items():
+            setattr(photo, field, value)
+        return photo, True
+    return photo, False
+
+
+def _delete_files(photos: Iterable[Photo]) -> None:
+    for photo in photos:
+        for field_file in (photo.image, photo.thumbnail):
+            if field_file:
+                field_file.storage.delete(field_file.name)
+
+
+def create_photos_from_form_upload(
+    owner, album: Album, files: Iterable, title: str = "", tag_ids: Sequence[int] = ()
+) -> List[Photo]:
+    """表单批量上传：先写入全部文件，再在一个事务内 ``bulk_create``，最后只派发一条批量任务。
+
+    请求耗时主要取决于文件写入，不再随张数产生逐行 INSERT 与逐张的 broker 往返。
+    与已有照片（或同批次中更早的文件）内容相同的文件按 ``GALLERY_DUPLICATE_POLICY``
+    处理：不写入存储，也不调度后处理任务。``title`` 与 ``tag_ids`` 只作用于本次新建的行。
+    """
+
+    policy = duplicate_policy()
+    files = list(files)
+    hashes = [content_hash_of(uploaded) for uploaded in files]
+    originals = find_originals(owner.id, hashes) if policy != "off" else {}
+
+    results: List[Photo] = []
     photos: List[Photo] = []
-    for uploaded in files:
-        photo = Photo.objects.create(owner=owner, album=album, image=uploaded)
-        dispatch_post_upload_tasks(photo.id)
-        photos.append(photo)
-    return photos
+    exif_done: List[bool] = []
+    references: List[Photo] = []
+    try:
+        for uploaded, digest in zip(files, hashes):
+            original = originals.get(digest) if policy != "off" else None
+            if original is not None:
+                if policy == "reject":
+                    results.append(original)
+                else:
+                    references.append(make_reference(original, owner, album, title))
+                    results.append(references[-1])
+                continue
+            photo, done = _prepare_form_photo(owner, album, uploaded, title)
+            photo.content_hash = digest
+            originals[digest] = photo
+            photos.append(photo)
+            exif_done.append(done)
+            results.append(photo)
+        with transaction.atomic():
+            Photo.objects.bulk_create(photos)
+            # 同批次内的引用行指向刚插入的照片，需在其取得主键后再插入
+            Photo.objects.bulk_create(references)
+            if tag_ids:
+                through = Photo.tags.through
+                through.objects.bulk_create(
+                    [through(photo_id=photo.id, tag_id=tag_id) for photo in photos + references for tag_id in tag_ids],
+                    ignore_conflicts=True,
+                )
+    except Exception:
+        _delete_files(photos)
+        raise
+
+    dispatch_post_upload_batch(
+        [photo.id for photo in photos],
+        [photo.id for photo, done in zip(photos, exif_done) if done],
+    )
+    dispatch_reference_sync([reference.id for reference in references])
+    # 序列化时读取标签与派生图，预取以免逐张查询
+    prefetch_related_objects(results, "tags", "renditions")
+    return results
@@ -0,0 +1,271 @@
+"""CLIP 向量的紧凑编码：float16 / int8 标量量化 / 乘积量化（PQ）。
+
+编码后的 blob 以 4 字节头部开始：``b"CVQ" + 格式字节``。历史数据是没有头部的
+裸 float32 字节，按小端解释时头部对应的 float32 约为 1e-38 量级，
+归一化的 CLIP 分量不可能取到该值，因此可以安全地区分两类数据。
+"""
+
+from __future__ import annotations
+
+import os
+import tempfile
+import threading
+import zlib
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+
+from .ai import _require_numpy
+
+MAGIC = b"CVQ"
+HEADER_SIZE = 4
+
+FORMAT_FLOAT32 = "float32"
+FORMAT_FLOAT16 = "float16"
+FORMAT_INT8 = "int8"
+FORMAT_PQ = "pq"
+
+_FORMAT_CODES: Dict[str, int] = {
+    FORMAT_FLOAT32: 1,
+    FORMAT_FLOAT16: 2,
+    FORMAT_INT8: 3,
+    FORMAT_PQ: 4,
+}
+_CODE_FORMATS = {code: name for name, code in _FORMAT_CODES.items()}
+
+
+class VectorCodecError(ValueError):
+    """向量编码/解码失败时抛出。"""
+
+
+def _tagged_format(blob: bytes) -> Optional[str]:
+    if len(blob) >= HEADER_SIZE and blob[:3] == MAGIC:
+        return _CODE_FORMATS.get(blob[3])
+    return None
+
+
+def detect_format(blob: bytes) -> str:
+    """识别 blob 的编码格式，无头部的历史数据视为 float32。"""
+
+    return _tagged_format(blob) or FORMAT_FLOAT32
+
+
+def is_legacy_blob(blob: bytes) -> bool:
+    """是否为引入编码头之前写入的裸 float32 数据。"""
+
+    return _tagged_format(bytes(blob)) is None
+
+
+def _header(fmt: str) -> bytes:
+    return MAGIC + bytes([_FORMAT_CODES[fmt]])
+
+
+def _nearest_codeword(sub, centers, chunk: int = 8192):
+    """分块计算每行最近的码字，避免 ``n × ksub × dsub`` 的临时数组。"""
+
+    np = _require_numpy()
+    center_norms = (centers ** 2).sum(axis=1)
+    labels = np.empty(sub.shape[0], dtype="int64")
+    for start in range(0, sub.shape[0], chunk):
+        block = sub[start : start + chunk]
+        dists = center_norms[None, :] - 2.0 * (block @ centers.T)
+        labels[start : start + block.shape[0]] = dists.argmin(axis=1)
+    return labels
+
+
+class ProductQuantizer:
+    """乘积量化：把向量切成 ``m`` 段，每段用 256 个码字的码本编码成 1 字节。"""
+
+    ksub = 256
+
+    def __init__(self, codebooks) -> None:
+        np = _require_numpy()
+        self.codebooks = np.ascontiguousarray(codebooks, dtype="float32")  # (m, ksub, dsub)
+        self.checksum = zlib.crc32(self.codebooks.tobytes())
+
+    @property
+    def m(self) -> int:
+        return int(self.codebooks.shape[0])
+
+    @property
+    def dsub(self) -> int:
+        return int(self.codebooks.shape[2])
+
+    @property
+    def dim(self) -> int:
+        return self.m * self.dsub
+
+    @classmethod
+    def fit(
+        cls, matrix, m: int = 64, iters: int = 15, max_samples: int = 20000, seed: int = 0
+    ) -> "ProductQuantizer":
+        np = _require_numpy()
+        matrix = np.asarray(matrix, dtype="float32")
+        n, dim = matrix.shape
+        if dim % m:
+            raise VectorCodecError(f"维度 {dim} 不能被子空间数 {m} 整除")
+        rng = np.random.default_rng(seed)
+        if n > max_samples:
+            matrix = matrix[rng.choice(n, max_samples, replace=False)]
+            n = max_samples
+        ksub = min(cls.ksub, n)
+        dsub = dim // m
+        codebooks = np.zeros((m, cls.ksub, dsub), dtype="float32")
+        for j in range(m):
+            sub = np.ascontiguousarray(matrix[:, j * dsub : (j + 1) * dsub])
+            centers = sub[rng.choice(n, ksub, replace=False)].copy()
+            for _ in range(iters):
+                labels = _nearest_codeword(sub, centers)
+                sums = np.zeros_like(centers)
+                np.add.at(sums, labels, sub)
+                counts = np.bincount(labels, minlength=ksub)
+                filled = counts > 0
+                centers[filled] = sums[filled] / counts[filled, None]
+            codebooks[j, :ksub] = centers
+            if ksub < cls.ksub:
+                codebooks[j, ksub:] = centers[-1]
+        return cls(codebooks)
+
+    def encode(self, matrix):
+        np = _require_numpy()
+        matrix = np.asarray(matrix, dtype="float32")
+        if matrix.ndim == 1:
+            matrix = matrix[None, :]
+        codes = np.empty((matrix.shape[0], self.m), dtype="uint8")
+        for j in range(self.m):
+            sub = matrix[:, j * self.dsub : (j + 1) * self.dsub]
+            codes[:, j] = _nearest_codeword(sub, self.codebooks[j])
+        return codes
+
+    def decode(self, codes):
+        np = _require_numpy()
+        codes = np.asarray(codes, dtype="uint8")
+        if codes.ndim == 1:
+            codes = codes[None, :]
+        parts = [self.codebooks[j][codes[:, j]] for j in range(self.m)]
+        return np.concatenate(parts, axis=1)
+
+    def distance_table(self, query):
+        """非对称距离（ADC）查找表：每段每个码字与查询的内积，形状 ``(m, ksub)``。"""
+
+        np = _require_numpy()
+        query = np.asarray(query, dtype="float32").reshape(self.m, 1, self.dsub)
+        return (self.codebooks * query).sum(axis=2)
+
+    def score_codes(self, codes, table):
+        """直接在 PQ 码上计算与查询的近似内积，无需解码。"""
+
+        np = _require_numpy()
+        codes = np.asarray(codes, dtype="uint8")
+        return table[np.arange(self.m)[None, :], codes].sum(axis=1)
+
+    def save(self, path: Path) -> None:
+        np = _require_numpy()
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                np.save(fh, self.codebooks)
+            os.replace(tmp_name, path)
+        except BaseException:
+            if os.path.exists(tmp_name):
+                os.unlink(tmp_name)
+            raise
+
+    @classmethod
+    def load(cls, path: Path) -> "ProductQuantizer":
+        np = _require_numpy()
+        return cls(np.load(Path(path)))
+
+
+class VectorCodec:
+    """按配置格式编码向量；解码时根据头部自动识别任意格式。"""
+
+    def __init__(self, fmt: str = FORMAT_FLOAT32, pq: Optional[ProductQuantizer] = None) -> None:
+        if fmt not in _FORMAT_CODES:
+            raise VectorCodecError(f"未知的向量编码格式：{fmt}")
+        if fmt == FORMAT_PQ and pq is None:
+            raise VectorCodecError("PQ 编码需要配置码本 GALLERY_VECTOR_PQ_CODEBOOK")
+        self.format = fmt
+        self.pq = pq
+
+    def encode(self, vector) -> bytes:
+        np = _require_numpy()
+        vec = np.asarray(vector, dtype="float32").reshape(-1)
+        if self.format == FORMAT_FLOAT32:
+            payload = vec.tobytes()
+        elif self.format == FORMAT_FLOAT16:
+            payload = vec.astype("float16").tobytes()
+        elif self.format == FORMAT_INT8:
+            codes, scale = quantize_int8(vec)
+            payload = np.float32(scale).tobytes() + codes.tobytes()
+        else:
+            assert self.pq is not None
+            if vec.shape[0] != self.pq.dim:
+                raise VectorCodecError(f"向量维度 {vec.shape[0]} 与 PQ 码本维度 {self.pq.dim} 不一致")
+            checksum = np.uint32(self.pq.checksum).tobytes()
+            payload = checksum + self.pq.encode(vec)[0].tobytes()
+        return _header(self.format) + payload
+
+    def decode(self, blob: bytes):
+        np = _require_numpy()
+        blob = bytes(blob)
+        fmt = _tagged_format(blob)
+        if fmt is None:
+            return np.frombuffer(blob, dtype="float32")
+        payload = blob[HEADER_SIZE:]
+        if fmt == FORMAT_FLOAT32:
+            return np.frombuffer(payload, dtype="float32")
+        if fmt == FORMAT_FLOAT16:
+            return np.frombuffer(payload, dtype="float16").astype("float32")
+        if fmt == FORMAT_INT8:
+            scale = float(np.frombuffer(payload[:4], dtype="float32")[0])
+            return np.frombuffer(payload[4:], dtype="int8").astype("float32") * scale
+        pq = self.pq
+        checksum = int(np.frombuffer(payload[:4], dtype="uint32")[0])
+        if pq is None or pq.checksum != checksum:
+            raise VectorCodecError("PQ 码本缺失或与编码时不一致，无法解码")
+        return pq.decode(np.frombuffer(payload[4:], dtype="uint8"))[0]
+
+
+def quantize_int8(vector) -> Tuple[object, float]:
+    """对称标量量化：返回 ``(int8 码, scale)``，``vector ≈ codes * scale``。"""
+
+    np = _require_numpy()
+    vec = np.asarray(vector, dtype="float32")
+    peak = float(np.abs(vec).max()) if vec.size else 0.0
+    scale = peak / 127.0 if peak > 0 else 1.0
+    codes = np.clip(np.rint(vec / scale), -127, 127).astype("int8")
+    return codes, scale
+
+
+_codec: Optional[VectorCodec] = None
+_codec_lock = threading.Lock()
+
+
+def _load_codec() -> VectorCodec:
+    fmt = getattr(settings, "GALLERY_VECTOR_CODEC", FORMAT_FLOAT32)
+    codebook = getattr(settings, "GALLERY_VECTOR_PQ_CODEBOOK", None)
+    pq = None
+    if codebook and Path(codebook).exists():
+        pq = ProductQuantizer.load(Path(codebook))
+    return VectorCodec(fmt, pq=pq)
+
+
+def get_vector_codec() -> VectorCodec:
+    global _codec
+    if _codec is None:
+        with _codec_lock:
+            if _codec is None:
+                _codec = _load_codec()
+    return _codec
+
+
+def reset_vector_codec() -> None:
+    """配置变化（如重新训练 PQ 码本）后丢弃缓存的编解码器。"""
+
+    global _codec
+    with _codec_lock:
+        _codec = None
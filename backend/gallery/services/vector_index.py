@@ -0,0 +1,639 @@
+"""按用户维护的 CLIP 向量矩阵索引，供相似图检索等场景复用。"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .ai import _require_numpy
+from .ann import AnnConfig, IVFIndex, load_ann_config
+from .vector_codec import ProductQuantizer, get_vector_codec, quantize_int8
+
+logger = logging.getLogger(__name__)
+
+_VERSION_KEY = "embedding_index_version_{user_id}"
+# 每次递增版本号时一并发布本次改写了向量的照片 id，其他进程据此重新读取已在索引中的行
+_CHANGES_KEY = "embedding_index_changes_{user_id}_{version}"
+_CHANGES_TTL = 24 * 60 * 60
+# 落后版本过多（或变更记录已过期）时改为整体重读向量
+_MAX_SYNC_VERSIONS = 500
+_ANN_TRAINING_KEY = "embedding_ann_training_{user_id}"
+# 训练任务的去重锁有效期；任务异常退出时到期后可重新派发
+_ANN_TRAINING_TTL = 30 * 60
+
+
+STORAGE_DTYPES = ("float32", "float16", "int8", "pq")
+
+
+def top_k_per_row(scores, k: int):
+    """对 ``(n, m)`` 打分矩阵逐行取 Top-K 列下标（按分数降序）。"""
+
+    np = _require_numpy()
+    scores = np.atleast_2d(scores)
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype="int64")
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(part, order, axis=1)
+
+
+class UserEmbeddingIndex:
+    """单个用户的向量索引：连续矩阵 + 照片 id 数组。
+
+    行向量在写入时即归一化，检索只需一次矩阵-向量乘法与 ``argpartition``。
+    追加采用容量倍增，删除采用末行回填，均为 O(dim) 的增量操作。
+
+    ``storage`` 控制矩阵的存储精度：``float16`` 内存减半，``int8`` 为每行一个
+    scale 的对称量化（约 1/4 内存），打分直接在量化码上分块进行后再乘 scale；
+    ``pq`` 每行只存 ``m`` 字节的乘积量化码，打分用查询的 ADC 查找表直接在码上累加，不解码。
+
+    规模达到 ``ann_config.min_size`` 后会训练 IVF 粗量化器，并维护与矩阵行
+    对齐的簇编号数组，查询只扫描被探测簇内的行；小库始终走精确检索。
+    """
+
+    _MIN_CAPACITY = 64
+    _SCORE_CHUNK = 16384
+
+    def __init__(
+        self,
+        ann_config: Optional[AnnConfig] = None,
+        storage: str = "float32",
+        pq: Optional[ProductQuantizer] = None,
+    ) -> None:
+        if storage not in STORAGE_DTYPES:
+            raise ValueError(f"不支持的索引存储精度：{storage}")
+        if storage == "pq" and pq is None:
+            raise ValueError("pq 存储需要 PQ 码本")
+        self._np = _require_numpy()
+        self._lock = threading.RLock()
+        self.storage = storage
+        self.pq = pq if storage == "pq" else None
+        self._dim: Optional[int] = None
+        self._ids = self._np.empty(0, dtype="int64")
+        self._lists = self._np.empty(0, dtype="int32")
+        self._scales = self._np.empty(0, dtype="float32")
+        self._matrix = self._np.empty((0, 0), dtype=self._row_dtype)
+        self._size = 0
+        self._positions: Dict[int, int] = {}
+        self.ann_config = ann_config
+        self.ivf: Optional[IVFIndex] = None
+        self.ann_stamp: Optional[int] = None  # 已挂载的 IVF 文件的 mtime
+        self.version: Optional[int] = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, photo_id: int) -> bool:
+        return photo_id in self._positions
+
+    @property
+    def ids(self):
+        return self._ids[: self._size]
+
+    @property
+    def matrix(self):
+        return self._matrix[: self._size]
+
+    @property
+    def lists(self):
+        return self._lists[: self._size]
+
+    @property
+    def _row_dtype(self) -> str:
+        return "uint8" if self.pq is not None else self.storage
+
+    def _normalize(self, vector):
+        np = self._np
+        vec = np.asarray(vector, dtype="float32").reshape(-1)
+        norm = float(np.linalg.norm(vec))
+        return vec / (norm + 1e-9)
+
+    def _reserve(self, capacity: int, dim: int) -> None:
+        np = self._np
+        if self._dim is None:
+            if self.pq is not None and dim != self.pq.dim:
+                raise ValueError(f"向量维度 {dim} 与 PQ 码本维度 {self.pq.dim} 不一致")
+            self._dim = dim
+            self._matrix = np.empty((0, self.pq.m if self.pq is not None else dim), dtype=self._row_dtype)
+        elif dim != self._dim:
+            raise ValueError(f"向量维度不一致：期望 {self._dim}，实际 {dim}")
+        if capacity <= self._matrix.shape[0]:
+            return
+        new_capacity = max(capacity, self._MIN_CAPACITY, self._matrix.shape[0] * 2)
+        matrix = np.empty((new_capacity, self._matrix.shape[1]), dtype=self._row_dtype)
+        matrix[: self._size] = self._matrix[: self._size]
+        scales = np.ones(new_capacity, dtype="float32")
+        scales[: self._size] = self._scales[: self._size]
+        ids = np.empty(new_capacity, dtype="int64")
+        ids[: self._size] = self._ids[: self._size]
+        lists = np.full(new_capacity, -1, dtype="int32")
+        lists[: self._size] = self._lists[: self._size]
+        self._matrix, self._ids, self._lists, self._scales = matrix, ids, lists, scales
+
+    def _store_row(self, pos: int, vec) -> None:
+        if self.storage == "int8":
+            codes, scale = quantize_int8(vec)
+            self._matrix[pos] = codes
+            self._scales[pos] = scale
+        elif self.pq is not None:
+            self._matrix[pos] = self.pq.encode(vec)[0]
+        else:
+            self._matrix[pos] = vec
+
+    def _dense(self, rows):
+        """按行号取出 float32 向量（int8 会乘回 scale，pq 按码本解码）。"""
+
+        if self.pq is not None:
+            codes = self._matrix[rows]
+            block = self.pq.decode(codes)
+            return block[0] if codes.ndim == 1 else block
+        block = self._matrix[rows].astype("float32")
+        if self.storage == "int8":
+            scales = self._scales[rows]
+            block *= scales[..., None] if block.ndim == 2 else scales
+        return block
+
+    def _assign_rows(self, ivf: IVFIndex, rows):
+        np = self._np
+        result = np.empty(rows.shape[0], dtype="int32")
+        for start in range(0, rows.shape[0], self._SCORE_CHUNK):
+            chunk = rows[start : start + self._SCORE_CHUNK]
+            result[start : start + chunk.shape[0]] = ivf.assign(self._dense(chunk))
+        return result
+
+    def _score(self, vec, rows=None):
+        """计算指定行（默认全部）与查询的内积；低精度存储分块转换以限制临时内存。"""
+
+        np = self._np
+        if self.storage == "float32":
+            return (self.matrix if rows is None else self._matrix[rows]) @ vec
+        total = self._size if rows is None else rows.shape[0]
+        scores = np.empty(total, dtype="float32")
+        table = self.pq.distance_table(vec) if self.pq is not None else None
+        for start in range(0, total, self._SCORE_CHUNK):
+            stop = min(start + self._SCORE_CHUNK, total)
+            index = slice(start, stop) if rows is None else rows[start:stop]
+            if table is not None:
+                scores[start:stop] = self.pq.score_codes(self._matrix[index], table)
+                continue
+            block = self._matrix[index].astype("float32") @ vec
+            if self.storage == "int8":
+                block *= self._scales[index]
+            scores[start:stop] = block
+        return scores
+
+    def build(self, ids: Sequence[int], vectors) -> None:
+        """整体重建索引。"""
+
+        np = self._np
+        with self._lock:
+            self._dim = None
+            self._size = 0
+            self._positions = {}
+            self._ids = np.empty(0, dtype="int64")
+            self._lists = np.empty(0, dtype="int32")
+            self._scales = np.empty(0, dtype="float32")
+            self._matrix = np.empty((0, 0), dtype=self._row_dtype)
+            self.ivf = None
+            for photo_id, vector in zip(ids, vectors):
+                self.upsert(photo_id, vector)
+
+    def upsert(self, photo_id: int, vector) -> None:
+        vec = self._normalize(vector)
+        with self._lock:
+            pos = self._positions.get(photo_id)
+            if pos is None:
+                self._reserve(self._size + 1, vec.shape[0])
+                pos = self._size
+                self._size += 1
+                self._positions[photo_id] = pos
+                self._ids[pos] = photo_id
+            elif vec.shape[0] != self._dim:
+                raise ValueError(f"向量维度不一致：期望 {self._dim}，实际 {vec.shape[0]}")
+            self._store_row(pos, vec)
+            if self.ivf is not None:
+                self._lists[pos] = self.ivf.assign(vec)[0]
+
+    def remove(self, photo_id: int) -> bool:
+        with self._lock:
+            pos = self._positions.pop(photo_id, None)
+            if pos is None:
+                return False
+            last = self._size - 1
+            if pos != last:
+                moved_id = int(self._ids[last])
+                self._matrix[pos] = self._matrix[last]
+                self._scales[pos] = self._scales[last]
+                self._lists[pos] = self._lists[last]
+                self._ids[pos] = moved_id
+                self._positions[moved_id] = pos
+            self._size = last
+            return True
+
+    def get_vector(self, photo_id: int):
+        with self._lock:
+            pos = self._positions.get(photo_id)
+            if pos is None:
+                return None
+            return self._dense(pos)
+
+    def attach_ivf(self, ivf: IVFIndex, ids=None, lists=None) -> None:
+        """挂载 IVF，并按持久化的 ``id -> 簇`` 映射补齐分配，缺失部分增量计算。"""
+
+        np = self._np
+        with self._lock:
+            if self._dim is not None and ivf.dim != self._dim:
+                raise ValueError(f"IVF 维度不一致：期望 {self._dim}，实际 {ivf.dim}")
+            self.ivf = ivf
+            current = self._lists[: self._size]
+            current[:] = -1
+            if ids is not None and lists is not None:
+                known = dict(zip(np.asarray(ids).tolist(), np.asarray(lists).tolist()))
+                for pos, photo_id in enumerate(self._ids[: self._size].tolist()):
+                    current[pos] = known.get(photo_id, -1)
+            pending = np.flatnonzero(current < 0)
+            if pending.size:
+                current[pending] = self._assign_rows(ivf, pending)
+
+    def needs_ann(self) -> bool:
+        """规模达到阈值、且尚未训练或相对上次训练增长过多时返回 ``True``。"""
+
+        config = self.ann_config
+        if config is None or self._size < config.min_size:
+            return False
+        ivf = self.ivf
+        return ivf is None or self._size >= ivf.trained_size * config.retrain_growth
+
+    def ensure_ann(self) -> bool:
+        """按需训练 IVF，返回是否重新训练。
+
+        k-means 在锁外对采样副本进行，训练期间检索不受影响；只有最后的簇分配持有锁。
+        耗时较长，应在 worker 中调用（见 ``EmbeddingIndexRegistry.train_ann``），不在请求内执行。
+        """
+
+        config = self.ann_config
+        with self._lock:
+            if not self.needs_ann():
+                return False
+            size = self._size
+            nlist = config.resolve_nlist(size)
+            sample_size = min(size, nlist * config.train_sample)
+            rows = self._np.random.default_rng(0).choice(size, sample_size, replace=False)
+            sample = self._dense(self._np.sort(rows))
+        ivf = IVFIndex.train(sample, config)
+        ivf.trained_size = size
+        with self._lock:
+            self.ivf = ivf
+            self._lists[: self._size] = self._assign_rows(ivf, self._np.arange(self._size))
+        return True
+
+    def _top_k(self, scores, rows, k: int) -> List[Tuple[int, float]]:
+        np = self._np
+        top_n = min(k, scores.shape[0])
+        if top_n <= 0:
+            return []
+        if top_n < scores.shape[0]:
+            candidates = np.argpartition(-scores, top_n - 1)[:top_n]
+        else:
+            candidates = np.arange(scores.shape[0])
+        order = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(self._ids[rows[i]]), float(scores[i])) for i in order if np.isfinite(scores[i])]
+
+    def top_queries(self, queries, k: int):
+        """反向检索：为每一行选出最相似的 ``k`` 个查询向量。
+
+        ``queries`` 为 ``(m, dim)`` 矩阵（如一组标签文本向量），按行分块做一次矩阵乘法，
+        返回 ``(photo_ids, indices)``，``indices`` 形状为 ``(n, k)``，按相似度降序。
+        """
+
+        np = self._np
+        queries = np.atleast_2d(np.asarray(queries, dtype="float32"))
+        queries = queries / (np.linalg.norm(queries, axis=1, keepdims=True) + 1e-9)
+        with self._lock:
+            if self._size and queries.shape[1] != self._dim:
+                raise ValueError(f"向量维度不一致：期望 {self._dim}，实际 {queries.shape[1]}")
+            k = max(0, min(k, queries.shape[0]))
+            indices = np.empty((self._size, k), dtype="int64")
+            for start in range(0, self._size, self._SCORE_CHUNK):
+                stop = min(start + self._SCORE_CHUNK, self._size)
+                block = self._dense(slice(start, stop)) @ queries.T
+                indices[start:stop] = top_k_per_row(block, k)
+            return self.ids.copy(), indices
+
+    def search(
+        self,
+        query,
+        k: int,
+        exclude: Iterable[int] = (),
+        nprobe: Optional[int] = None,
+        exact: bool = False,
+    ) -> List[Tuple[int, float]]:
+        """返回 ``[(photo_id, score), ...]``，按余弦相似度降序。
+
+        已挂载 IVF 且规模达到阈值时仅扫描 ``nprobe`` 个簇；
+        ``exact=True`` 或候选不足 ``k`` 个时回退为全量精确检索。
+        """
+
+        np = self._np
+        if k <= 0:
+            return []
+        vec = self._normalize(query)
+        with self._lock:
+            if self._size == 0:
+                return []
+            if vec.shape[0] != self._dim:
+                raise ValueError(f"向量维度不一致：期望 {self._dim}，实际 {vec.shape[0]}")
+            excluded = {self._positions[pid] for pid in exclude if pid in self._positions}
+
+            config = self.ann_config
+            use_ann = (
+                not exact
+                and self.ivf is not None
+                and config is not None
+                and self._size >= config.min_size
+            )
+            if use_ann:
+                probe = self.ivf.probe(vec, nprobe or config.nprobe)
+                rows = np.flatnonzero(np.isin(self.lists, probe))
+                if excluded:
+                    rows = rows[~np.isin(rows, list(excluded))]
+                if rows.shape[0] >= k:
+                    return self._top_k(self._score(vec, rows), rows, k)
+
+            scores = self._score(vec)
+            if excluded:
+                scores[list(excluded)] = -np.inf
+            return self._top_k(scores, np.arange(self._size), k)
+
+
+def _load_user_vectors(user_id: int, photo_ids: Optional[Sequence[int]] = None):
+    """从数据库流式读取用户的向量。"""
+
+    from ..models import PhotoEmbedding
+    from .ai import ClipEmbeddingService, get_clip_embedding_service
+
+    qs = PhotoEmbedding.objects.filter(owner_id=user_id, model_name=get_clip_embedding_service().model_key)
+    if photo_ids is not None:
+        qs = qs.filter(photo_id__in=photo_ids)
+    for photo_id, blob in qs.values_list("photo_id", "vector").iterator(chunk_size=2000):
+        if blob:
+            yield photo_id, ClipEmbeddingService.bytes_to_vector(bytes(blob))
+
+
+def _load_user_vector_ids(user_id: int) -> List[int]:
+    from ..models import PhotoEmbedding
+    from .ai import get_clip_embedding_service
+
+    qs = PhotoEmbedding.objects.filter(owner_id=user_id, model_name=get_clip_embedding_service().model_key)
+    return list(qs.values_list("photo_id", flat=True))
+
+
+def _read_version(user_id: int) -> Optional[int]:
+    try:
+        return cache.get(_VERSION_KEY.format(user_id=user_id), 0)
+    except Exception:  # pragma: no cover - 缓存不可用时退化为进程内索引
+        logger.warning("读取向量索引版本失败", extra={"user_id": user_id})
+        return None
+
+
+def _bump_version(user_id: int, changed: Sequence[int] = ()) -> Optional[int]:
+    """递增版本号，并记录本版本改写了向量的照片 id（新增与删除由 id 差集感知）。"""
+
+    key = _VERSION_KEY.format(user_id=user_id)
+    try:
+        version = 1 if cache.add(key, 1, timeout=None) else cache.incr(key)
+        cache.set(_CHANGES_KEY.format(user_id=user_id, version=version), list(changed), timeout=_CHANGES_TTL)
+        return version
+    except Exception:  # pragma: no cover - 缓存不可用时退化为进程内索引
+        logger.warning("更新向量索引版本失败", extra={"user_id": user_id})
+        return None
+
+
+def _read_changes(user_id: int, since: Optional[int], version: Optional[int]) -> Optional[set]:
+    """汇总 ``(since, version]`` 各版本改写过的照片 id；记录不完整时返回 ``None``。"""
+
+    if since is None or version is None or not 0 < version - since <= _MAX_SYNC_VERSIONS:
+        return None
+    keys = [_CHANGES_KEY.format(user_id=user_id, version=v) for v in range(since + 1, version + 1)]
+    try:
+        found = cache.get_many(keys)
+    except Exception:  # pragma: no cover - 缓存不可用时整体重读
+        return None
+    if len(found) != len(keys):
+        return None
+    return {int(photo_id) for ids in found.values() for photo_id in ids}
+
+
+def notify_vectors_changed(user_id: int, photo_ids: Sequence[int]) -> None:
+    """绕过注册表直接改写了向量（如批量重编码）后调用，让各进程重新读取这些行。"""
+
+    if photo_ids:
+        _bump_version(user_id, photo_ids)
+
+
+class EmbeddingIndexRegistry:
+    """进程内的用户索引注册表。
+
+    - 首次访问时从数据库构建；
+    - 本进程内的写入/删除直接增量更新；
+    - 其他进程（如 Celery worker）的变更通过缓存中的版本号感知：新增与删除按 id 差集补齐，
+      已在索引中但向量被改写的行按随版本号发布的变更 id 重新读取，不做整体重建；
+    - IVF 只在 worker 中训练（``task_train_embedding_ann``）并落盘，其他进程在版本变化时挂载，
+      训练完成前一律走精确检索。
+    """
+
+    def __init__(
+        self,
+        loader: Callable[..., Iterable[Tuple[int, object]]] = _load_user_vectors,
+        id_loader: Callable[[int], Sequence[int]] = _load_user_vector_ids,
+        ann_config: Optional[AnnConfig] = None,
+        storage: Optional[str] = None,
+    ) -> None:
+        self._loader = loader
+        self._id_loader = id_loader
+        self._ann_config = ann_config
+        self._storage = storage
+        self._indexes: Dict[int, UserEmbeddingIndex] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def ann_config(self) -> AnnConfig:
+        if self._ann_config is None:
+            self._ann_config = load_ann_config()
+        return self._ann_config
+
+    def _ann_path(self, user_id: int) -> Optional[Path]:
+        directory = self.ann_config.directory
+        if not directory:
+            return None
+        return Path(directory) / f"user_{user_id}.npz"
+
+    def _load_ann(self, user_id: int, index: UserEmbeddingIndex) -> None:
+        """挂载 worker 训练并落盘的 IVF；文件未变化时跳过。"""
+
+        path = self._ann_path(user_id)
+        if path is None or len(index) < self.ann_config.min_size:
+            return
+        try:
+            stamp = path.stat().st_mtime_ns
+            if stamp == index.ann_stamp:
+                return
+            loaded = IVFIndex.load(path)
+            if loaded is not None:
+                index.attach_ivf(*loaded)
+                index.ann_stamp = stamp
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError):
+            logger.warning("加载 IVF 索引失败，将重新训练", extra={"user_id": user_id})
+
+    def _schedule_ann(self, user_id: int) -> None:
+        """派发后台训练；训练完成前继续走精确检索。同一用户同时只派发一个任务。"""
+
+        if self._ann_path(user_id) is None:
+            return
+        try:
+            if not cache.add(_ANN_TRAINING_KEY.format(user_id=user_id), 1, timeout=_ANN_TRAINING_TTL):
+                return
+        except Exception:  # pragma: no cover - 缓存不可用时不派发
+            logger.warning("IVF 训练去重锁不可用", extra={"user_id": user_id})
+            return
+        from ..tasks_ai import task_train_embedding_ann
+
+        task_train_embedding_ann.delay(user_id)
+
+    def train_ann(self, user_id: int) -> bool:
+        """（worker 内）按需训练用户的 IVF 并落盘，再递增版本号通知其他进程加载。"""
+
+        try:
+            index = self._get(user_id)
+            if not index.ensure_ann():
+                return False
+            self.save(user_id)
+            version = _bump_version(user_id)
+            with index._lock:
+                if None not in (version, index.version) and version == index.version + 1:
+                    index.version = version
+            return True
+        finally:
+            try:
+                cache.delete(_ANN_TRAINING_KEY.format(user_id=user_id))
+            except Exception:  # pragma: no cover - 锁到期后自动释放
+                pass
+
+    def _build(self, user_id: int) -> UserEmbeddingIndex:
+        storage = self._storage or getattr(settings, "GALLERY_VECTOR_INDEX_DTYPE", "float32")
+        pq = get_vector_codec().pq if storage == "pq" else None
+        if storage == "pq" and pq is None:
+            logger.warning("未找到 PQ 码本，向量索引改用 float16 存储", extra={"user_id": user_id})
+            storage = "float16"
+        index = UserEmbeddingIndex(ann_config=self.ann_config, storage=storage, pq=pq)
+        index.version = _read_version(user_id)
+        for photo_id, vector in self._loader(user_id):
+            index.upsert(photo_id, vector)
+        self._load_ann(user_id, index)
+        return index
+
+    def save(self, user_id: int) -> None:
+        """将已加载用户的 IVF 分配持久化，便于新进程直接复用。"""
+
+        index = self._indexes.get(user_id)
+        path = self._ann_path(user_id)
+        if index is None or index.ivf is None or path is None:
+            return
+        with index._lock:
+            ids, lists = index.ids.copy(), index.lists.copy()
+        try:
+            index.ivf.save(path, ids, lists)
+            index.ann_stamp = path.stat().st_mtime_ns
+        except OSError:
+            logger.warning("保存 IVF 索引失败", extra={"user_id": user_id})
+
+    def _sync(self, user_id: int, index: UserEmbeddingIndex, version: Optional[int]) -> None:
+        current = set(self._id_loader(user_id))
+        known = {int(pid) for pid in index.ids}
+        for photo_id in known - current:
+            index.remove(photo_id)
+        changed = _read_changes(user_id, index.version, version)
+        if changed is None:
+            logger.info("向量索引变更记录不完整，整体重读向量", extra={"user_id": user_id})
+            changed = current
+        missing = sorted((current - known) | (changed & current))
+        if missing:
+            for photo_id, vector in self._loader(user_id, missing):
+                index.upsert(photo_id, vector)
+        index.version = version
+
+    def get(self, user_id: int) -> UserEmbeddingIndex:
+        """取用户索引；需要（重新）训练 IVF 时只派发后台任务，本次请求不等待训练。"""
+
+        index = self._get(user_id)
+        if index.needs_ann():
+            self._schedule_ann(user_id)
+        return index
+
+    def _get(self, user_id: int) -> UserEmbeddingIndex:
+        index = self._indexes.get(user_id)
+        if index is None:
+            with self._lock:
+                index = self._indexes.get(user_id)
+                if index is None:
+                    index = self._build(user_id)
+                    self._indexes[user_id] = index
+            return index
+
+        version = _read_version(user_id)
+        if version != index.version:
+            with index._lock:
+                if version != index.version:
+                    self._sync(user_id, index, version)
+            self._load_ann(user_id, index)
+        return index
+
+    def upsert(self, user_id: int, photo_id: int, vector) -> None:
+        version = _bump_version(user_id, [photo_id])
+        index = self._indexes.get(user_id)
+        if index is None:
+            return
+        with index._lock:
+            in_sync = None not in (version, index.version) and version == index.version + 1
+            index.upsert(photo_id, vector)
+            if in_sync:
+                index.version = version
+
+    def remove(self, user_id: int, photo_id: int) -> None:
+        version = _bump_version(user_id)
+        index = self._indexes.get(user_id)
+        if index is None:
+            return
+        with index._lock:
+            in_sync = None not in (version, index.version) and version == index.version + 1
+            index.remove(photo_id)
+            if in_sync:
+                index.version = version
+
+    def invalidate(self, user_id: Optional[int] = None) -> None:
+        with self._lock:
+            if user_id is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(user_id, None)
+
+
+_registry: Optional[EmbeddingIndexRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_embedding_index_registry() -> EmbeddingIndexRegistry:
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = EmbeddingIndexRegistry()
+    return _registry
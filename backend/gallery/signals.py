@@ -0,0 +1,44 @@
+"""图库模型的信号处理器。"""
+
+from __future__ import annotations
+
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import receiver
+
+from .models import Photo
+from .services.faces import refresh_face_group_counts
+from .services.near_duplicates import get_near_duplicate_registry
+from .services.vector_index import get_embedding_index_registry
+
+
+@receiver(post_delete, sender=Photo)
+def drop_photo_from_embedding_index(sender, instance: Photo, **kwargs) -> None:
+    """照片删除后从向量索引中移除，避免相似图结果指向已删除照片。"""
+
+    if not instance.vector_done:
+        return
+    try:
+        get_embedding_index_registry().remove(instance.owner_id, instance.id)
+    except RuntimeError:  # pragma: no cover - 缺少 numpy 时索引不可用
+        pass
+
+
+@receiver(post_delete, sender=Photo)
+def drop_photo_from_near_duplicate_index(sender, instance: Photo, **kwargs) -> None:
+    if instance.dhash is not None:
+        get_near_duplicate_registry().remove(instance.owner_id, instance.id)
+
+
+@receiver(pre_delete, sender=Photo)
+def remember_photo_face_groups(sender, instance: Photo, **kwargs) -> None:
+    """PhotoFace 会随照片级联删除，先记下涉及的分组以便删除后重算计数。"""
+
+    if instance.face_done:
+        instance._face_group_ids = list(instance.faces.values_list("face_group_id", flat=True).distinct())
+
+
+@receiver(post_delete, sender=Photo)
+def refresh_face_group_counts_after_delete(sender, instance: Photo, **kwargs) -> None:
+    group_ids = getattr(instance, "_face_group_ids", None)
+    if group_ids:
+        refresh_face_group_counts(group_ids)
@@ -6,17 +6,34 @@ import logging
 from dataclasses import dataclass
 from io import BytesIO
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
 from celery import shared_task
-from PIL import Image, ImageOps
+from celery.exceptions import MaxRetriesExceededError
+from celery.signals import worker_process_shutdown
 from django.core.files.base import ContentFile
 
 from .models import Photo
-from .services.metadata import extract_exif_metadata
+from .services.blob_cache import log_blob_cache_stats, open_original
+from .services.dedup import delete_unused_files, sync_references
+from .services.imaging import THUMBNAIL_SIZE, open_reduced
+from .services.near_duplicates import DHASH_DECODE_SIZE, hash_and_group
+from .services.metadata import JpegHeader, extract_exif_metadata, read_photo_header
+from .services.renditions import max_rendition_size, render_renditions, rendition_sizes, store_renditions
 
 logger = logging.getLogger(__name__)
 
+@worker_process_shutdown.connect
+def _log_blob_cache_stats(**kwargs) -> None:
+    """worker 子进程退出时输出原图缓存的累计命中率。"""
+
+    log_blob_cache_stats()
+
+
+# 引用行等待原照片处理完成：每 30 秒同步一次，最多约 20 分钟
+DUPLICATE_SYNC_DELAY = 30
+DUPLICATE_SYNC_RETRIES = 40
+
 
 @dataclass(frozen=True)
 class TaskResult:
@@ -47,24 +64,61 @@ class TaskResult:
         return cls(status="err", detail=message)
 
 
-def _generate_thumbnail_file(photo: Photo) -> ContentFile:
-    """生成缩略图文件对象，并自动处理方向。"""
+def render_thumbnail(img) -> ContentFile:
+    """把已摆正方向的图像渲染为 JPEG 缩略图，不修改传入的图像。"""
 
-    with Image.open(photo.image) as raw_img:
-        img = ImageOps.exif_transpose(raw_img)
-        img.thumbnail((300, 300))
-        buffer = BytesIO()
-        img.save(buffer, format="JPEG")
+    thumb = img.copy()
+    thumb.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+    buffer = BytesIO()
+    thumb.convert("RGB").save(buffer, format="JPEG")
     return ContentFile(buffer.getvalue())
 
 
+def thumbnail_name(photo: Photo) -> str:
+    return Path(photo.image.name).stem + "_thumb.jpg"
+
+
+def store_thumbnail(photo: Photo, content: ContentFile) -> Optional[str]:
+    """写入完整缩略图文件并把状态置为 ready（不写库），返回被替换、待删除的旧文件名。"""
+
+    old_name = photo.thumbnail.name or None
+    photo.thumbnail.save(thumbnail_name(photo), content, save=False)
+    photo.thumbnail_state = Photo.ThumbnailState.READY
+    return old_name if old_name != photo.thumbnail.name else None
+
+
+def attach_embedded_preview(photo: Photo, header: Optional[JpegHeader] = None, commit: bool = True) -> bool:
+    """把 EXIF 内嵌缩略图保存为即时预览（``thumbnail_state=preview``），没有时返回 False。
+
+    只需读取 JPEG 文件头，不解码原图；``commit=False`` 时只写文件和实例字段，由调用方入库。
+    """
+
+    if header is None:
+        header = read_photo_header(photo)
+    img = header.preview_image() if header is not None else None
+    if img is None:
+        return False
+    photo.thumbnail.save(Path(photo.image.name).stem + "_preview.jpg", render_thumbnail(img), save=False)
+    photo.thumbnail_state = Photo.ThumbnailState.PREVIEW
+    if commit:
+        Photo.objects.filter(id=photo.id).update(thumbnail=photo.thumbnail.name, thumbnail_state=photo.thumbnail_state)
+    return True
+
+
+def _decode_for_derivatives(photo: Photo, long_side: int):
+    """按派生图所需的最大长边解码一次原图，并自动处理方向。"""
+
+    with open_original(photo.image) as fh:
+        return open_reduced(fh, long_side=long_side).image
+
+
 def _get_photo(photo_id: int) -> Optional[Photo]:
     return Photo.objects.filter(id=photo_id).first()
 
 
 @shared_task
 def generate_thumbnail(photo_id: int) -> str:
-    """异步生成缩略图。"""
+    """异步生成缩略图与多尺寸派生图，二者共用一次解码。"""
 
     photo = _get_photo(photo_id)
     if photo is None:
@@ -72,13 +126,31 @@ def generate_thumbnail(photo_id: int) -> str:
 
     if not photo.image:
         return TaskResult.skip("no_image").render()
-    if photo.thumbnail:
+    need_thumbnail = not (photo.thumbnail and photo.thumbnail_state == Photo.ThumbnailState.READY)
+    need_renditions = bool(rendition_sizes()) and not photo.renditions.exists()
+    need_hash = photo.dhash is None
+    if not need_thumbnail and not need_renditions and not need_hash:
         return TaskResult.skip("has_thumbnail").render()
 
     try:
-        thumb_content = _generate_thumbnail_file(photo)
-        thumb_name = Path(photo.image.name).stem + "_thumb.jpg"
-        photo.thumbnail.save(thumb_name, thumb_content, save=True)
+        img = _decode_for_derivatives(
+            photo,
+            max(
+                THUMBNAIL_SIZE if need_thumbnail else 0,
+                max_rendition_size() if need_renditions else 0,
+                DHASH_DECODE_SIZE if need_hash else 0,
+            ),
+        )
+        if need_thumbnail:
+            old_name = store_thumbnail(photo, render_thumbnail(img))
+            photo.save(update_fields=["thumbnail", "thumbnail_state"])
+            if old_name:
+                # 替换内嵌预览后删除旧文件（引用行仍在使用时保留）
+                delete_unused_files(photo.owner_id, [("thumbnail", old_name)])
+        if need_renditions:
+            store_renditions(photo, render_renditions(img))
+        if need_hash:
+            hash_and_group(photo, img)
     except Exception as exc:  # pragma: no cover - 依赖外部文件系统
         logger.exception("生成缩略图失败", extra={"photo_id": photo_id})
         return TaskResult.error(str(exc)).render()
@@ -108,3 +180,24 @@ def extract_exif_task(photo_id: int) -> str:
 
     photo.save(update_fields=list(updates.keys()))
     return TaskResult.ok().render()
+
+
+@shared_task(bind=True, max_retries=DUPLICATE_SYNC_RETRIES)
+def task_sync_duplicates(self, photo_ids: List[int]) -> str:
+    """把原照片的处理结果复制到引用行；原照片尚未处理完时稍后重试。
+
+    原照片已被删除且引用行结果不完整时，引用行改为按普通照片调度后处理任务。
+    """
+
+    from .services.uploads import fan_out_upload_batch  # 避免与 services.uploads 循环导入
+
+    pending, orphaned = sync_references(photo_ids)
+    if orphaned:
+        fan_out_upload_batch(orphaned)
+    if pending:
+        try:
+            raise self.retry(args=(pending,), countdown=DUPLICATE_SYNC_DELAY)
+        except MaxRetriesExceededError:
+            # 原照片某些阶段一直未完成（如未安装人脸依赖），引用行保留已复制的结果
+            logger.warning("原照片长时间未处理完成，停止同步引用行", extra={"photo_ids": pending})
+    return TaskResult(status="ok", detail=f"synced={len(photo_ids) - len(orphaned)}").render()
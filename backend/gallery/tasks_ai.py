@@ -3,20 +3,50 @@
 from __future__ import annotations
 
 import logging
-from typing import Iterable, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Sequence
 
 from celery import shared_task
-from django.db import models, transaction
+from celery.signals import worker_process_init
+from django.conf import settings
+from django.db import transaction
 from PIL import Image
 
 from .ai_presets import get_labels
-from .models import AiLabel, FaceGroup, Photo
-from .services import get_clip_embedding_service, get_face_recognition_service
+from .models import AiLabel, FaceGroup, Photo, PhotoEmbedding, PhotoFace
+from .services import (
+    get_clip_embedding_service,
+    get_embedding_index_registry,
+    get_face_recognition_service,
+)
+from .services.batching import get_clip_batch_collector
+from .services.ai import _require_numpy
+from .services.blob_cache import open_original
+from .services.faces import (
+    FACE_DIM,
+    FACE_MODEL_KEY,
+    centroid_to_bytes,
+    encodings_to_bytes,
+    get_face_index_registry,
+    refresh_face_group_counts,
+)
+from .services.imaging import CLIP_SHORT_SIDE, open_reduced
+from .services.vector_index import top_k_per_row
 from .tasks import TaskResult
 
 logger = logging.getLogger(__name__)
 
 
+@worker_process_init.connect
+def _warm_label_presets(**kwargs) -> None:
+    """worker 子进程启动时从磁盘载入标签向量，首个任务即可直接打标签。"""
+
+    try:
+        get_clip_embedding_service().warm_label_presets()
+    except Exception:  # pragma: no cover - 缺少 numpy 或缓存目录不可读
+        logger.warning("预加载标签向量失败")
+
+
 def _get_photo(photo_id: int) -> Photo | None:
     return Photo.objects.filter(id=photo_id).first()
 
@@ -34,10 +64,155 @@ def _ensure_labels(language: str) -> List[AiLabel]:
     return [existing[text] for text in labels]
 
 
-def _select_top_labels(similarities, labels: Iterable[AiLabel], top_k: int) -> List[AiLabel]:
-    indexed = list(zip(similarities, labels))
-    indexed.sort(key=lambda item: item[0], reverse=True)
-    return [label for _, label in indexed[:top_k]]
+def _open_clip_input(photo: Photo) -> Image.Image:
+    with open_original(photo.image) as fh:
+        return open_reduced(fh, short_side=CLIP_SHORT_SIDE).image.convert("RGB")
+
+
+def store_clip_results(clip_service, photos: Sequence[Photo], vectors, label_rows: Sequence[List[AiLabel]]) -> None:
+    """批量落库：向量 upsert、完成标记与标签关联各一条语句。"""
+
+    through = Photo.ai_label_ids.through
+    embeddings = [
+        PhotoEmbedding(
+            photo_id=photo.id,
+            owner_id=photo.owner_id,
+            model_name=clip_service.model_key,
+            vector=clip_service.vector_to_bytes(vector),
+        )
+        for photo, vector in zip(photos, vectors)
+    ]
+    links = [
+        through(photo_id=photo.id, ailabel_id=label.id)
+        for photo, labels in zip(photos, label_rows)
+        for label in labels
+    ]
+    labeled_ids = [photo.id for photo, labels in zip(photos, label_rows) if labels]
+
+    with transaction.atomic():
+        PhotoEmbedding.objects.bulk_create(
+            embeddings,
+            update_conflicts=True,
+            unique_fields=["photo", "model_name"],
+            update_fields=["vector", "updated_at"],
+        )
+        Photo.objects.filter(id__in=[photo.id for photo in photos]).update(vector_done=True)
+        if links:
+            through.objects.bulk_create(links, ignore_conflicts=True)
+            Photo.objects.filter(id__in=labeled_ids).update(ai_done=True)
+
+        def _update_index():
+            registry = get_embedding_index_registry()
+            for photo, vector in zip(photos, vectors):
+                registry.upsert(photo.owner_id, photo.id, vector)
+
+        transaction.on_commit(_update_index)
+
+
+def label_rows_for_vectors(clip_service, vectors, language: str, top_k: int) -> List[List[AiLabel]]:
+    """按预设标签为每个向量选出 Top-K 标签。"""
+
+    label_objs = _ensure_labels(language)
+    text_vectors = clip_service.encode_texts([lbl.name for lbl in label_objs], persist=True)
+    similarities = vectors @ text_vectors.T
+    return [[label_objs[i] for i in row] for row in top_k_per_row(similarities, top_k)]
+
+
+def relabel_user_photos(clip_service, user_id: int, language: str = "zh", top_k: int = 5, chunk_size: int = 5000) -> int:
+    """用已存储的向量重新打标签，不重新解码图片。
+
+    用户向量矩阵与标签文本矩阵做一次（分块）矩阵乘法取 Top-K，
+    再按块整体替换该语言下的标签关联，返回处理的照片数。
+    """
+
+    np = _require_numpy()
+    label_objs = _ensure_labels(language)
+    text_vectors = clip_service.encode_texts([lbl.name for lbl in label_objs], persist=True)
+    photo_ids, indices = get_embedding_index_registry().get(user_id).top_queries(text_vectors, top_k)
+    label_ids = np.array([lbl.id for lbl in label_objs], dtype="int64")
+
+    through = Photo.ai_label_ids.through
+    processed = 0
+    for start in range(0, photo_ids.shape[0], chunk_size):
+        chunk_ids = photo_ids[start : start + chunk_size].tolist()
+        chunk_labels = label_ids[indices[start : start + chunk_size]].tolist()
+        with transaction.atomic():
+            existing = set(Photo.objects.filter(id__in=chunk_ids).values_list("id", flat=True))
+            links = [
+                through(photo_id=photo_id, ailabel_id=label_id)
+                for photo_id, row in zip(chunk_ids, chunk_labels)
+                if photo_id in existing
+                for label_id in row
+            ]
+            through.objects.filter(photo_id__in=existing, ailabel__lang=language).delete()
+            through.objects.bulk_create(links, ignore_conflicts=True)
+            Photo.objects.filter(id__in=existing).update(ai_done=True)
+        processed += len(existing)
+    return processed
+
+
+def store_face_results(photo: Photo, encodings, boxes: Sequence[Sequence[int]], tol: float) -> None:
+    """按质心索引归组并落库：特征、分组、PhotoFace 与完成标记；``boxes`` 为原图坐标。"""
+
+    np = _require_numpy()
+    if not len(encodings):
+        with transaction.atomic():
+            stale_groups = list(photo.faces.values_list("face_group_id", flat=True))
+            photo.faces.all().delete()
+            refresh_face_group_counts(stale_groups)
+            Photo.objects.filter(id=photo.id).update(face_done=True)
+        photo.face_done = True
+        return
+
+    encodings = np.asarray(encodings, dtype="float32").reshape(-1, FACE_DIM)
+    registry = get_face_index_registry()
+    index = registry.get(photo.owner_id)
+    # 进程内串行化同一用户的分配，避免并发时同一个人被拆成多个新组
+    with index.lock:
+        assigned = index.assign(encodings, tol)
+        try:
+            with transaction.atomic():
+                matched = sorted({group_id for group_id in assigned if group_id is not None})
+                unmatched = [i for i, group_id in enumerate(assigned) if group_id is None]
+                new_groups = [
+                    FaceGroup(owner_id=photo.owner_id, name="", centroid=centroid_to_bytes(encodings[i]))
+                    for i in unmatched
+                ]
+                FaceGroup.objects.bulk_create(new_groups)
+                for i, group in zip(unmatched, new_groups):
+                    assigned[i] = group.id
+
+                if matched:
+                    FaceGroup.objects.bulk_update(
+                        [FaceGroup(id=group_id, centroid=centroid_to_bytes(index.centroid(group_id))) for group_id in matched],
+                        ["centroid"],
+                    )
+
+                PhotoEmbedding.objects.update_or_create(
+                    photo=photo,
+                    model_name=FACE_MODEL_KEY,
+                    defaults={"owner_id": photo.owner_id, "vector": encodings_to_bytes(encodings)},
+                )
+                # 重复执行时先清掉旧关联，计数统一按 PhotoFace 重算
+                touched = set(photo.faces.values_list("face_group_id", flat=True))
+                photo.faces.all().delete()
+                PhotoFace.objects.bulk_create(
+                    [
+                        PhotoFace(photo=photo, face_group_id=group_id, face_index=i, bbox=list(boxes[i]))
+                        for i, group_id in enumerate(assigned)
+                    ]
+                )
+                refresh_face_group_counts(touched | set(assigned))
+                Photo.objects.filter(id=photo.id).update(face_done=True)
+        except Exception:
+            # 质心已在内存中更新，落库失败时丢弃本地索引，下次从数据库重建
+            registry.invalidate(photo.owner_id)
+            raise
+        for i, group in zip(unmatched, new_groups):
+            if group.id is not None:
+                index.add(group.id, encodings[i], 1)
+    photo.face_done = True
+    transaction.on_commit(lambda: registry.mark_changed(photo.owner_id))
 
 
 @shared_task
@@ -57,37 +232,112 @@ def task_clip_vector_and_labels(photo_id: int, language: str = "zh", top_k: int
         return TaskResult.error(f"deps:{exc}").render()
 
     try:
-        with Image.open(photo.image) as raw_img:
-            rgb_img = raw_img.convert("RGB")
-            vector = clip_service.encode_image(rgb_img)
+        vectors = clip_service.encode_images([_open_clip_input(photo)])
     except Exception as exc:  # pragma: no cover - 依赖外部文件
         logger.exception("CLIP 图像编码失败", extra={"photo_id": photo_id})
         return TaskResult.error(str(exc)).render()
 
     try:
-        label_objs = _ensure_labels(language)
-        text_vectors = clip_service.encode_texts([lbl.name for lbl in label_objs])
-        similarities = (vector[None, :] @ text_vectors.T)[0]
-        top_labels = _select_top_labels(similarities, label_objs, top_k)
+        label_rows = label_rows_for_vectors(clip_service, vectors, language, top_k)
     except Exception as exc:  # pragma: no cover - numpy/CLIP 初始化失败时触发
         logger.exception("CLIP 文本标签计算失败", extra={"photo_id": photo_id})
         return TaskResult.error(str(exc)).render()
 
-    with transaction.atomic():
-        photo.clip_vector = clip_service.vector_to_bytes(vector)
-        photo.vector_done = True
-        photo.save(update_fields=["clip_vector", "vector_done"])
-        if top_labels:
-            photo.ai_label_ids.add(*[label.id for label in top_labels])
-            photo.ai_done = True
-            photo.save(update_fields=["ai_done"])
+    store_clip_results(clip_service, [photo], vectors, label_rows)
+    return TaskResult.ok().render()
+
+
+@shared_task
+def task_clip_vector_and_labels_batch(photo_ids: List[int], language: str = "zh", top_k: int = 5) -> str:
+    """微批版本：并行解码、单次前向推理、批量落库。"""
+
+    photos = [p for p in Photo.objects.filter(id__in=photo_ids).only("id", "owner_id", "image") if p.image]
+    if not photos:
+        return TaskResult.skip("no_image").render()
+
+    try:
+        clip_service = get_clip_embedding_service()
+    except RuntimeError as exc:  # pragma: no cover - 依赖可选库
+        logger.exception("CLIP 服务初始化失败", extra={"photo_ids": photo_ids})
+        return TaskResult.error(f"deps:{exc}").render()
+
+    def _safe_open(photo: Photo):
+        try:
+            return _open_clip_input(photo)
+        except Exception:  # pragma: no cover - 依赖外部文件
+            logger.exception("CLIP 输入解码失败", extra={"photo_id": photo.id})
+            return None
+
+    workers = min(len(photos), int(getattr(settings, "GALLERY_CLIP_DECODE_WORKERS", 4)))
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        images = list(pool.map(_safe_open, photos))
+    decoded = [(photo, image) for photo, image in zip(photos, images) if image is not None]
+    if not decoded:
+        return TaskResult.error("decode").render()
+    photos = [photo for photo, _ in decoded]
+
+    try:
+        vectors = clip_service.encode_images([image for _, image in decoded])
+        label_rows = label_rows_for_vectors(clip_service, vectors, language, top_k)
+    except Exception as exc:  # pragma: no cover - 依赖外部库
+        logger.exception("CLIP 批量编码失败", extra={"photo_ids": photo_ids})
+        return TaskResult.error(str(exc)).render()
+
+    store_clip_results(clip_service, photos, vectors, label_rows)
+    if len(photos) < len(photo_ids):
+        return TaskResult(status="ok", detail=f"{len(photos)}/{len(photo_ids)}").render()
+    return TaskResult.ok().render()
+
+
+@shared_task
+def task_flush_clip_batch(language: str = "zh", top_k: int = 5) -> str:
+    """收集器的延迟刷新：取出等待中的 id 并按批处理。"""
+
+    collector = get_clip_batch_collector()
+    processed = 0
+    while True:
+        photo_ids = collector.drain()
+        if not photo_ids:
+            break
+        task_clip_vector_and_labels_batch(photo_ids, language, top_k)
+        processed += len(photo_ids)
+    if not processed:
+        return TaskResult.skip("empty").render()
+    return TaskResult.ok().render()
+
 
+@shared_task
+def task_relabel_photos(user_id: int, language: str = "zh", top_k: int = 5) -> str:
+    """标签预设变化后，基于已存储向量为用户的全部照片重新打标签。"""
+
+    try:
+        clip_service = get_clip_embedding_service()
+        processed = relabel_user_photos(clip_service, user_id, language, top_k)
+    except RuntimeError as exc:  # pragma: no cover - 依赖可选库
+        logger.exception("重新打标签失败", extra={"user_id": user_id})
+        return TaskResult.error(f"deps:{exc}").render()
+    if not processed:
+        return TaskResult.skip("no_vector").render()
+    return TaskResult(status="ok", detail=str(processed)).render()
+
+
+@shared_task
+def task_train_embedding_ann(user_id: int) -> str:
+    """训练用户向量索引的 IVF 并落盘；由检索请求在规模达到阈值时派发，请求本身不等待。"""
+
+    try:
+        trained = get_embedding_index_registry().train_ann(user_id)
+    except RuntimeError as exc:  # pragma: no cover - 依赖可选库
+        logger.exception("训练 IVF 失败", extra={"user_id": user_id})
+        return TaskResult.error(f"deps:{exc}").render()
+    if not trained:
+        return TaskResult.skip("not_needed").render()
     return TaskResult.ok().render()
 
 
 @shared_task
 def task_face_embeddings_and_group(photo_id: int, tol: float = 0.48) -> str:
-    """提取人脸特征并创建分组。"""
+    """提取人脸特征，按最近质心归入已有分组，无匹配时创建新组。"""
 
     photo = _get_photo(photo_id)
     if photo is None:
@@ -102,16 +352,15 @@ def task_face_embeddings_and_group(photo_id: int, tol: float = 0.48) -> str:
         return TaskResult.error(f"deps:{exc}").render()
 
     try:
-        image_array = face_service.load_image(photo.image)
+        with open_original(photo.image) as fh:
+            image_array, reduced = face_service.load_image_reduced(fh)
         locations = face_service.face_locations(image_array, model="hog")
     except Exception as exc:  # pragma: no cover - face_recognition 内部异常
         logger.exception("人脸检测失败", extra={"photo_id": photo_id})
         return TaskResult.error(str(exc)).render()
 
     if not locations:
-        photo.face_group_ids = []
-        photo.face_done = True
-        photo.save(update_fields=["face_group_ids", "face_done"])
+        store_face_results(photo, [], [], tol)
         return TaskResult.skip("no_face").render()
 
     try:
@@ -120,17 +369,5 @@ def task_face_embeddings_and_group(photo_id: int, tol: float = 0.48) -> str:
         logger.exception("人脸向量提取失败", extra={"photo_id": photo_id})
         return TaskResult.error(str(exc)).render()
 
-    # 当前策略：每张人脸单独创建分组，后续可接入向量检索做合并
-    with transaction.atomic():
-        new_groups = [FaceGroup(owner=photo.owner, name="") for _ in encodings]
-        FaceGroup.objects.bulk_create(new_groups)
-        group_ids = [group.id for group in new_groups if group.id is not None]
-        if group_ids:
-            FaceGroup.objects.filter(id__in=group_ids).update(count=models.F("count") + 1)
-            photo.face_group_ids = group_ids
-        else:
-            photo.face_group_ids = []
-        photo.face_done = True
-        photo.save(update_fields=["face_group_ids", "face_done"])
-
+    store_face_results(photo, encodings, [reduced.map_box(box) for box in locations], tol)
     return TaskResult.ok().render()
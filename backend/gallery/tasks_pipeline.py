@@ -0,0 +1,175 @@
+"""融合的上传后处理流水线：读取一次原图、解码一次，依次执行各阶段后统一落库。"""
+
+from __future__ import annotations
+
+import logging
+from typing import Dict, Iterable, List, Optional
+
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from PIL import Image
+
+from .models import Photo
+from .services import get_clip_embedding_service, get_face_recognition_service
+from .services.ai import _require_numpy
+from .services.blob_cache import open_original
+from .services.dedup import delete_unused_files
+from .services.imaging import CLIP_SHORT_SIDE, THUMBNAIL_SIZE, open_reduced
+from .services.metadata import exif_updates_from_image
+from .services.near_duplicates import hash_and_group
+from .services.renditions import max_rendition_size, render_renditions, store_renditions
+from .tasks import TaskResult, render_thumbnail, store_thumbnail
+from .tasks_ai import label_rows_for_vectors, store_clip_results, store_face_results
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("exif", "thumbnail", "clip", "faces")
+
+
+def _decode_target(stages: Iterable[str]) -> Dict[str, int]:
+    """共享解码图需满足所有像素阶段中要求最高的那个。"""
+
+    stages = set(stages)
+    if "thumbnail" in stages and max_rendition_size() > THUMBNAIL_SIZE:
+        # 派生图的最大长边（默认 2048）已覆盖 CLIP 与人脸检测所需的分辨率，人脸阶段再单独缩小到预算内
+        return {"long_side": max_rendition_size()}
+    if "faces" in stages:
+        return {"max_pixels": int(getattr(settings, "GALLERY_FACE_MAX_PIXELS", 1_600_000))}
+    if "thumbnail" in stages and "clip" in stages:
+        # 短边不小于缩略图边长时，缩略图与 CLIP 的要求都满足
+        return {"short_side": THUMBNAIL_SIZE}
+    if "thumbnail" in stages:
+        return {"long_side": THUMBNAIL_SIZE}
+    return {"short_side": CLIP_SHORT_SIDE}
+
+
+def process_photo(
+    photo: Photo,
+    stages: Optional[Iterable[str]] = None,
+    language: str = "zh",
+    top_k: int = 5,
+    tol: float = 0.48,
+) -> Dict[str, str]:
+    """对单张照片执行指定阶段（默认全部），返回每个阶段的结果。
+
+    原图只从存储读取一次；EXIF 只解析文件头，其余阶段共用一次降分辨率解码的图像。
+    各阶段的计算结果先留在内存，最后在同一个事务中写入。
+    """
+
+    selected = [stage for stage in STAGES if stages is None or stage in stages]
+    results: Dict[str, str] = {}
+    updates: Dict[str, object] = {}
+    pixel_stages = [stage for stage in selected if stage != "exif"]
+    reduced = rgb = None
+    # 同一个文件句柄先只读文件头取 EXIF，再回到开头做降分辨率解码，不把原图整体读入内存
+    with open_original(photo.image) as fh:
+        if "exif" in selected:
+            try:
+                with Image.open(fh) as header:
+                    updates.update(exif_updates_from_image(header))
+                results["exif"] = "ok"
+            except Exception as exc:  # pragma: no cover - 依赖 PIL/Exif 外部实现
+                logger.exception("EXIF 提取失败", extra={"photo_id": photo.id})
+                results["exif"] = f"err:{exc}"
+
+        if pixel_stages:
+            try:
+                fh.seek(0)
+                reduced = open_reduced(fh, **_decode_target(pixel_stages))
+                rgb = reduced.image.convert("RGB")
+            except Exception as exc:  # pragma: no cover - 损坏的图片
+                logger.exception("图片解码失败", extra={"photo_id": photo.id})
+                results.update({stage: f"err:{exc}" for stage in pixel_stages})
+                pixel_stages = []
+
+    replaced_thumbnail = None
+    renditions = []
+    if "thumbnail" in pixel_stages:
+        if photo.thumbnail_state == Photo.ThumbnailState.READY and stages is None:
+            results["thumbnail"] = "skip"
+        else:
+            replaced_thumbnail = store_thumbnail(photo, render_thumbnail(reduced.image))
+            renditions = render_renditions(reduced.image)
+            updates["thumbnail"] = photo.thumbnail.name
+            updates["thumbnail_state"] = photo.thumbnail_state
+            results["thumbnail"] = "ok"
+
+    clip_output = None
+    if "clip" in pixel_stages:
+        try:
+            clip_service = get_clip_embedding_service()
+            vectors = clip_service.encode_images([rgb])
+            clip_output = (clip_service, vectors, label_rows_for_vectors(clip_service, vectors, language, top_k))
+            results["clip"] = "ok"
+        except Exception as exc:  # pragma: no cover - 依赖可选库
+            logger.exception("CLIP 阶段失败", extra={"photo_id": photo.id})
+            results["clip"] = f"err:{exc}"
+
+    face_output = None
+    if "faces" in pixel_stages:
+        try:
+            np = _require_numpy()
+            face_service = get_face_recognition_service()
+            # 共享解码图可能按派生图尺寸解码（约 3 MP），人脸检测仍按 GALLERY_FACE_MAX_PIXELS 的预算进行
+            face_input = reduced.fit_pixels(int(getattr(settings, "GALLERY_FACE_MAX_PIXELS", 1_600_000)))
+            array = np.asarray(rgb if face_input is reduced else face_input.image.convert("RGB"))
+            locations = face_service.face_locations(array, model="hog")
+            encodings = face_service.face_encodings(array, locations) if locations else []
+            face_output = (encodings, [face_input.map_box(box) for box in locations])
+            results["faces"] = "ok" if locations else "skip"
+        except Exception as exc:  # pragma: no cover - 依赖可选库
+            logger.exception("人脸阶段失败", extra={"photo_id": photo.id})
+            results["faces"] = f"err:{exc}"
+
+    with transaction.atomic():
+        if updates:
+            Photo.objects.filter(id=photo.id).update(**updates)
+        if clip_output is not None:
+            clip_service, vectors, label_rows = clip_output
+            store_clip_results(clip_service, [photo], vectors, label_rows)
+        if face_output is not None:
+            store_face_results(photo, face_output[0], face_output[1], tol)
+        if renditions:
+            store_renditions(photo, renditions)
+        if replaced_thumbnail:
+            transaction.on_commit(lambda: delete_unused_files(photo.owner_id, [("thumbnail", replaced_thumbnail)]))
+    if "thumbnail" in pixel_stages and (photo.dhash is None or stages is not None):
+        hash_and_group(photo, reduced.image)
+    return results
+
+
+@shared_task
+def task_process_photo(
+    photo_id: int,
+    stages: Optional[Iterable[str]] = None,
+    language: str = "zh",
+    top_k: int = 5,
+) -> str:
+    """融合流水线任务；``stages`` 可只重跑部分阶段，如 ``["clip"]``。"""
+
+    photo = Photo.objects.filter(id=photo_id).first()
+    if photo is None:
+        return TaskResult.missing("photo").render()
+    if not photo.image:
+        return TaskResult.skip("no_image").render()
+
+    try:
+        results = process_photo(photo, stages, language=language, top_k=top_k)
+    except Exception as exc:  # pragma: no cover - 依赖外部存储
+        logger.exception("照片流水线失败", extra={"photo_id": photo_id})
+        return TaskResult.error(str(exc)).render()
+
+    detail = ",".join(f"{stage}={result.split(':', 1)[0]}" for stage, result in results.items())
+    status = "err" if any(result.startswith("err") for result in results.values()) else "ok"
+    return TaskResult(status=status, detail=detail).render()
+
+
+@shared_task
+def task_dispatch_upload_batch(photo_ids: List[int], exif_done_ids: Optional[List[int]] = None) -> str:
+    """批量上传的派发任务：请求内只发送这一条消息，逐张任务在 worker 内展开。"""
+
+    from .services.uploads import fan_out_upload_batch  # 避免与 services.uploads 循环导入
+
+    fan_out_upload_batch(photo_ids, exif_done_ids or ())
+    return TaskResult(status="ok", detail=f"photos={len(photo_ids)}").render()
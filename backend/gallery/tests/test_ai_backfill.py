@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import json
+import shutil
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from ..models import Album, Photo, PhotoEmbedding
+from .test_clip_batching import _FakeClip, _jpeg_bytes
+
+
+class AiBackfillCommandTests(TestCase):
+    def setUp(self) -> None:
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.checkpoint = Path(self.media_root) / "checkpoint.json"
+
+        user = User.objects.create_user(username="backfill", password="pass")
+        album = Album.objects.create(name="Old", description="", owner=user)
+        self.photos = [
+            Photo.objects.create(
+                owner=user,
+                album=album,
+                image=SimpleUploadedFile(f"{i}.jpg", _jpeg_bytes(size=(640, 480)), content_type="image/jpeg"),
+            )
+            for i in range(3)
+        ]
+        self.clip = _FakeClip(np.eye(30, dtype="float32"), image_rows=[1, 2, 3])
+
+    def _run(self, **options):
+        with patch(
+            "gallery.management.commands.ai_backfill.get_clip_embedding_service", return_value=self.clip
+        ), patch("gallery.tasks_ai.get_embedding_index_registry", return_value=MagicMock()):
+            call_command(
+                "ai_backfill",
+                workers=0,
+                batch_size=2,
+                top_k=1,
+                checkpoint=str(self.checkpoint),
+                stdout=StringIO(),
+                **options,
+            )
+
+    def test_resumes_from_checkpoint(self):
+        self._run(limit=2)
+        state = json.loads(self.checkpoint.read_text())
+        self.assertEqual(state["last_id"], self.photos[1].id)
+        self.assertEqual(state["processed"], 2)
+        self.assertEqual(Photo.objects.filter(vector_done=True).count(), 2)
+
+        self._run()
+        self.assertEqual(json.loads(self.checkpoint.read_text())["processed"], 3)
+        self.assertEqual(PhotoEmbedding.objects.count(), 3)
+        self.assertEqual(Photo.objects.filter(vector_done=True, ai_done=True).count(), 3)
+        # 第二次只处理剩余的一张
+        self.assertEqual(self.clip.batch_sizes, [2, 1])
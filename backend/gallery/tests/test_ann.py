@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import shutil
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from ..services.ann import AnnConfig, IVFIndex
+from ..services.vector_index import EmbeddingIndexRegistry, UserEmbeddingIndex
+from .test_vector_index import LOCMEM_CACHE
+
+
+def _clustered_vectors(n_clusters=20, per_cluster=50, dim=32, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim))
+    points = np.repeat(centers, per_cluster, axis=0) + 0.05 * rng.normal(size=(n_clusters * per_cluster, dim))
+    return points.astype("float32")
+
+
+class IVFSearchTests(SimpleTestCase):
+    def setUp(self) -> None:
+        self.vectors = _clustered_vectors()
+        self.ids = list(range(1, len(self.vectors) + 1))
+        self.config = AnnConfig(min_size=100, nlist=20, nprobe=3)
+        self.index = UserEmbeddingIndex(ann_config=self.config)
+        self.index.build(self.ids, self.vectors)
+
+    def _exact(self, query, k):
+        return [pid for pid, _ in self.index.search(query, k, exact=True)]
+
+    def test_small_library_uses_exact_search(self):
+        index = UserEmbeddingIndex(ann_config=AnnConfig(min_size=10_000))
+        index.build(self.ids, self.vectors)
+        self.assertFalse(index.ensure_ann())
+        self.assertIsNone(index.ivf)
+
+    def test_ann_recall_on_clustered_data(self):
+        self.assertTrue(self.index.ensure_ann())
+        hits = 0
+        for row in range(0, len(self.vectors), 97):
+            query = self.vectors[row]
+            approx = {pid for pid, _ in self.index.search(query, 10)}
+            hits += len(approx & set(self._exact(query, 10)))
+        total = 10 * len(range(0, len(self.vectors), 97))
+        self.assertGreaterEqual(hits / total, 0.9)
+
+    def test_full_probe_equals_exact(self):
+        self.index.ensure_ann()
+        query = self.vectors[123]
+        approx = [pid for pid, _ in self.index.search(query, 10, nprobe=self.config.nlist)]
+        self.assertEqual(approx, self._exact(query, 10))
+
+    def test_incremental_insert_is_assigned(self):
+        self.index.ensure_ann()
+        self.index.upsert(9999, self.vectors[0])
+        hits = [pid for pid, _ in self.index.search(self.vectors[0], 5)]
+        self.assertIn(9999, hits)
+
+    def test_persistence_round_trip(self):
+        self.index.ensure_ann()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "user_1.npz"
+            self.index.ivf.save(path, self.index.ids, self.index.lists)
+            ivf, ids, lists = IVFIndex.load(path)
+
+        restored = UserEmbeddingIndex(ann_config=self.config)
+        restored.build(self.ids + [5000], np.vstack([self.vectors, self.vectors[:1]]))
+        restored.attach_ivf(ivf, ids, lists)
+        np.testing.assert_array_equal(restored.lists[:-1], self.index.lists)
+        self.assertGreaterEqual(int(restored.lists[-1]), 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class BackgroundTrainingTests(SimpleTestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        vectors = _clustered_vectors()
+        self.rows = dict(zip(range(1, len(vectors) + 1), vectors))
+        self.config = AnnConfig(min_size=100, nlist=20, nprobe=3, directory=self.tmp)
+
+    def _registry(self):
+        def loader(user_id, photo_ids=None):
+            ids = self.rows if photo_ids is None else photo_ids
+            return [(pid, self.rows[pid]) for pid in ids]
+
+        return EmbeddingIndexRegistry(
+            loader=loader, id_loader=lambda user_id: list(self.rows), ann_config=self.config, storage="float32"
+        )
+
+    def test_request_schedules_training_and_serves_exact_until_ready(self):
+        web = self._registry()
+        with patch("gallery.tasks_ai.task_train_embedding_ann") as task, \
+                patch.object(UserEmbeddingIndex, "ensure_ann", side_effect=AssertionError("请求内不应训练")):
+            index = web.get(7)
+            web.get(7)
+        self.assertIsNone(index.ivf)
+        task.delay.assert_called_once_with(7)
+        self.assertEqual(index.search(self.rows[5], 3)[0][0], 5)
+
+        self.assertTrue(self._registry().train_ann(7))
+        self.assertTrue((Path(self.tmp) / "user_7.npz").exists())
+        with patch("gallery.tasks_ai.task_train_embedding_ann") as task:
+            index = web.get(7)
+        self.assertIsNotNone(index.ivf)
+        self.assertGreaterEqual(int(index.lists.min()), 0)
+        task.delay.assert_not_called()
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.test import SimpleTestCase, override_settings
+
+from ..services.blob_cache import BlobCache, open_original
+
+
+class _CountingStorage(FileSystemStorage):
+    """以本地目录模拟 S3，记录回源次数。"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.opened = []
+
+    def _open(self, name, mode="rb"):
+        self.opened.append(name)
+        return super()._open(name, mode)
+
+
+class BlobCacheTests(SimpleTestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        self.storage = _CountingStorage(location=os.path.join(self.tmp, "bucket"))
+        self.cache_dir = os.path.join(self.tmp, "cache")
+
+    def _put(self, name, payload):
+        if self.storage.exists(name):
+            self.storage.delete(name)
+        self.storage.save(name, ContentFile(payload))
+
+    def test_hit_after_miss_and_invalidated_by_new_version(self):
+        cache = BlobCache(self.cache_dir, max_bytes=1024 * 1024)
+        self._put("a.jpg", b"first")
+        with cache.open(self.storage, "a.jpg") as fh:
+            self.assertEqual(fh.read(), b"first")
+        with cache.open(self.storage, "a.jpg") as fh:
+            self.assertEqual(fh.read(), b"first")
+        self.assertEqual(self.storage.opened, ["a.jpg"])
+
+        self._put("a.jpg", b"second version")
+        with cache.open(self.storage, "a.jpg") as fh:
+            self.assertEqual(fh.read(), b"second version")
+
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+        self.assertEqual(stats["bytes_fetched"], len(b"first") + len(b"second version"))
+        self.assertEqual(os.listdir(os.path.join(self.cache_dir, "tmp")), [])
+
+    def test_evicts_least_recently_used(self):
+        cache = BlobCache(self.cache_dir, max_bytes=250, low_water=0.9)
+        paths = {}
+        for i, name in enumerate(["a", "b"]):
+            self._put(name, bytes(100))
+            paths[name] = cache.fetch(self.storage, name, etag="v1")
+            os.utime(paths[name], (1000 + i, 1000 + i))
+        # 命中刷新 a 的 mtime，b 成为最久未使用
+        cache.fetch(self.storage, "a", etag="v1")
+        self._put("c", bytes(100))
+        cache.fetch(self.storage, "c", etag="v1")
+
+        self.assertTrue(paths["a"].exists())
+        self.assertFalse(paths["b"].exists())
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertEqual(cache.stats()["approx_bytes"], 200)
+
+    def test_open_original_uses_configured_cache(self):
+        self._put("p.jpg", b"payload")
+        field_file = SimpleNamespace(storage=self.storage, name="p.jpg", _committed=True)
+        with override_settings(GALLERY_BLOB_CACHE_DIR=self.cache_dir):
+            for _ in range(2):
+                with open_original(field_file) as fh:
+                    self.assertEqual(fh.read(), b"payload")
+        self.assertEqual(self.storage.opened, ["p.jpg"])
+
+    def test_open_survives_concurrent_eviction(self):
+        cache = BlobCache(self.cache_dir, max_bytes=1024 * 1024)
+        self._put("a.jpg", b"cached")
+        path = cache.fetch(self.storage, "a.jpg", etag="v1")
+        real_utime = os.utime
+
+        def evict_then_touch(target, *args, **kwargs):
+            # 另一个进程恰好在打开之后、刷新 mtime 之前淘汰了这个文件
+            if os.path.exists(target):
+                os.unlink(target)
+            return real_utime(target, *args, **kwargs)
+
+        with patch("gallery.services.blob_cache.os.utime", side_effect=evict_then_touch):
+            with cache.open(self.storage, "a.jpg", etag="v1") as fh:
+                self.assertEqual(fh.read(), b"cached")
+        self.assertFalse(path.exists())
+        self.assertEqual(self.storage.opened, ["a.jpg"])
+
+    def test_logs_hit_rate_every_n_lookups(self):
+        cache = BlobCache(self.cache_dir, max_bytes=1024 * 1024, stats_every=2)
+        self._put("a.jpg", b"x")
+        with self.assertLogs("gallery.services.blob_cache", level="INFO") as logs:
+            for _ in range(4):
+                cache.fetch(self.storage, "a.jpg", etag="v1")
+        self.assertEqual(len(logs.output), 2)
+        self.assertIn("原图缓存命中率 75.0%", logs.output[-1])
@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import shutil
+import tempfile
+from io import BytesIO
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from PIL import Image
+
+from ..models import Album, Photo, PhotoEmbedding
+from ..services.ai import ClipEmbeddingService
+from ..services.batching import RedisBatchCollector
+from ..tasks_ai import task_clip_vector_and_labels_batch
+
+
+def _jpeg_bytes(color=(200, 30, 30), size=(64, 48)) -> bytes:
+    buffer = BytesIO()
+    Image.new("RGB", size, color).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+class _FakeClip:
+    model_key = "fake/test"
+    vector_to_bytes = staticmethod(ClipEmbeddingService.vector_to_bytes)
+
+    def __init__(self, text_vectors, image_rows):
+        self.text_vectors = text_vectors
+        self.image_rows = image_rows
+        self.batch_sizes = []
+
+    def encode_images(self, images):
+        self.batch_sizes.append(len(images))
+        return self.text_vectors[self.image_rows[: len(images)]]
+
+    def encode_texts(self, texts, persist=False):
+        return self.text_vectors[: len(texts)]
+
+
+class ClipBatchTaskTests(TestCase):
+    def setUp(self) -> None:
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = User.objects.create_user(username="batcher", password="pass")
+        self.album = Album.objects.create(name="Bulk", description="", owner=self.user)
+        self.photos = [
+            Photo.objects.create(
+                owner=self.user,
+                album=self.album,
+                image=SimpleUploadedFile(f"{i}.jpg", _jpeg_bytes(), content_type="image/jpeg"),
+            )
+            for i in range(3)
+        ]
+
+    def test_batch_encodes_once_and_bulk_writes(self):
+        text_vectors = np.eye(30, dtype="float32")
+        clip = _FakeClip(text_vectors, image_rows=[3, 7, 11])
+        registry = MagicMock()
+        with patch("gallery.tasks_ai.get_clip_embedding_service", return_value=clip), \
+                patch("gallery.tasks_ai.get_embedding_index_registry", return_value=registry), \
+                self.captureOnCommitCallbacks(execute=True):
+            result = task_clip_vector_and_labels_batch([p.id for p in self.photos], top_k=1)
+
+        self.assertEqual(result, "ok")
+        self.assertEqual(clip.batch_sizes, [3])
+        self.assertEqual(PhotoEmbedding.objects.filter(model_name="fake/test").count(), 3)
+        self.assertEqual(registry.upsert.call_count, 3)
+        labels = {p.id: list(p.ai_label_ids.values_list("id", flat=True)) for p in Photo.objects.all()}
+        self.assertTrue(all(len(ids) == 1 for ids in labels.values()))
+        self.assertEqual(Photo.objects.filter(vector_done=True, ai_done=True).count(), 3)
+
+        # 重复执行走 upsert，不产生重复行
+        with patch("gallery.tasks_ai.get_clip_embedding_service", return_value=clip), \
+                patch("gallery.tasks_ai.get_embedding_index_registry", return_value=registry):
+            task_clip_vector_and_labels_batch([p.id for p in self.photos], top_k=1)
+        self.assertEqual(PhotoEmbedding.objects.count(), 3)
+
+
+class _FakeRedis:
+    def __init__(self):
+        self.lists = {}
+        self.keys = {}
+
+    def rpush(self, key, value):
+        self.lists.setdefault(key, []).append(str(value).encode())
+        return len(self.lists[key])
+
+    def set(self, key, value, nx=False, px=None):
+        if nx and key in self.keys:
+            return None
+        self.keys[key] = value
+        return True
+
+    def pipeline(self, transaction=True):
+        redis, ops = self, []
+
+        class _Pipe:
+            def lrange(self, key, start, stop):
+                ops.append(lambda: list(redis.lists.get(key, [])[start : stop + 1]))
+
+            def ltrim(self, key, start, stop):
+                def _trim():
+                    redis.lists[key] = redis.lists.get(key, [])[start:]
+                    return True
+
+                ops.append(_trim)
+
+            def execute(self):
+                return [op() for op in ops]
+
+        return _Pipe()
+
+
+class RedisBatchCollectorTests(SimpleTestCase):
+    def test_flush_scheduled_once_and_full_batch_returned(self):
+        redis = _FakeRedis()
+        collector = RedisBatchCollector("t", batch_size=3, wait_ms=100, connection_factory=lambda: redis)
+        first = collector.add(1)
+        second = collector.add(2)
+        self.assertEqual((first.batch, first.schedule_flush), ([], True))
+        self.assertEqual((second.batch, second.schedule_flush), ([], False))
+        self.assertEqual(collector.add(3).batch, [1, 2, 3])
+        collector.add(4)
+        self.assertEqual(collector.drain(), [4])
+        self.assertEqual(collector.drain(), [])
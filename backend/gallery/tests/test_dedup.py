@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import hashlib
+import shutil
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from ..domain import AlbumUseCase
+from ..models import AiLabel, Album, FaceGroup, Photo, PhotoEmbedding, PhotoFace, PhotoRendition, Tag
+from ..services.ai import ClipEmbeddingService
+from ..services.dedup import content_hash_of, sync_references
+from ..services.upload_handlers import HashedUploadedFile
+from ..services.uploads import create_photos_from_form_upload
+from .test_clip_batching import _jpeg_bytes
+from .test_vector_index import LOCMEM_CACHE
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class DuplicateUploadTests(TestCase):
+    def setUp(self) -> None:
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_user(username="dedup", password="pass")
+        self.album = Album.objects.create(name="A", description="", owner=self.user)
+        self.other_album = Album.objects.create(name="B", description="", owner=self.user)
+        self.data = _jpeg_bytes(size=(64, 48))
+
+    def _upload(self, album, *contents):
+        files = [SimpleUploadedFile(f"{i}.jpg", data, content_type="image/jpeg") for i, data in enumerate(contents)]
+        with patch("gallery.services.uploads.task_dispatch_upload_batch") as batch_task, \
+                patch("gallery.services.uploads.task_sync_duplicates") as sync_task:
+            photos = create_photos_from_form_upload(self.user, album, files)
+        return photos, batch_task, sync_task
+
+    def _stored_files(self):
+        return sorted(path.name for path in Path(self.media_root).rglob("*") if path.is_file())
+
+    def test_reupload_creates_reference_without_storage_or_tasks(self):
+        (original,), _, _ = self._upload(self.album, self.data)
+        files_before = self._stored_files()
+
+        (reference,), batch_task, sync_task = self._upload(self.other_album, self.data)
+
+        self.assertEqual(original.content_hash, hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(reference.duplicate_of_id, original.id)
+        self.assertEqual(reference.album_id, self.other_album.id)
+        self.assertEqual(reference.image.name, original.image.name)
+        self.assertEqual(reference.width, 64)
+        self.assertEqual(self._stored_files(), files_before)
+        batch_task.delay.assert_not_called()
+        sync_task.delay.assert_called_once_with([reference.id])
+
+    def test_duplicates_within_one_batch(self):
+        photos, batch_task, sync_task = self._upload(self.album, self.data, _jpeg_bytes((9, 9, 9)), self.data)
+
+        self.assertEqual(photos[2].duplicate_of_id, photos[0].id)
+        batch_task.delay.assert_called_once_with([photos[0].id, photos[1].id], [photos[0].id, photos[1].id])
+        sync_task.delay.assert_called_once_with([photos[2].id])
+
+    @override_settings(GALLERY_DUPLICATE_POLICY="reject")
+    def test_reject_policy_returns_existing_photo(self):
+        (original,), _, _ = self._upload(self.album, self.data)
+        (again,), batch_task, sync_task = self._upload(self.other_album, self.data)
+
+        self.assertEqual(again.id, original.id)
+        self.assertEqual(Photo.objects.count(), 1)
+        batch_task.delay.assert_not_called()
+        sync_task.delay.assert_not_called()
+
+    def test_rest_create_deduplicates_through_upload_handler(self):
+        (original,), _, _ = self._upload(self.album, self.data)
+        tag = Tag.objects.create(name="trip", owner=self.user)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        upload = SimpleUploadedFile("again.jpg", self.data, content_type="image/jpeg")
+        received = []
+
+        def hash_of(uploaded):
+            received.append(uploaded)
+            return content_hash_of(uploaded)
+
+        with patch("gallery.services.uploads.task_dispatch_upload_batch") as batch_task, \
+                patch("gallery.services.uploads.task_sync_duplicates") as sync_task, \
+                patch("gallery.services.uploads.content_hash_of", side_effect=hash_of):
+            response = client.post(
+                "/api/gallery/photos/",
+                {"image": upload, "album": self.other_album.id, "title": "again", "tag_ids": [tag.id]},
+            )
+
+        self.assertEqual(response.status_code, 201)
+        # 哈希在接收分块时已由 GalleryUploadHandler 算好
+        self.assertIsInstance(received[0], HashedUploadedFile)
+        reference = Photo.objects.get(id=response.data["id"])
+        self.assertEqual((reference.duplicate_of_id, reference.title), (original.id, "again"))
+        self.assertEqual(list(reference.tags.values_list("id", flat=True)), [tag.id])
+        batch_task.delay.assert_not_called()
+        sync_task.delay.assert_called_once_with([reference.id])
+
+    def test_sync_copies_results_once_original_is_processed(self):
+        (original,), _, _ = self._upload(self.album, self.data)
+        (reference,), _, _ = self._upload(self.other_album, self.data)
+        self.assertEqual(sync_references([reference.id]), ([reference.id], []))
+
+        vector = np.eye(4, dtype="float32")[1]
+        PhotoEmbedding.objects.create(
+            photo=original, owner=self.user, model_name="fake/test", vector=ClipEmbeddingService.vector_to_bytes(vector)
+        )
+        original.ai_label_ids.add(AiLabel.objects.create(name="猫"))
+        group = FaceGroup.objects.create(owner=self.user, count=1)
+        PhotoFace.objects.create(photo=original, face_group=group, bbox=[0, 1, 1, 0])
+        PhotoRendition.objects.create(photo=original, size=256, format="webp", file="r/a_256.webp", width=64, height=48)
+        Photo.objects.filter(id=original.id).update(
+            thumbnail="t/a_thumb.jpg", thumbnail_state=Photo.ThumbnailState.READY, vector_done=True, face_done=True
+        )
+
+        registry = MagicMock()
+        with patch("gallery.services.dedup.get_clip_embedding_service", return_value=SimpleNamespace(model_key="fake/test")), \
+                patch("gallery.services.dedup.get_embedding_index_registry", return_value=registry), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(sync_references([reference.id]), ([], []))
+
+        reference.refresh_from_db()
+        self.assertEqual(reference.thumbnail.name, "t/a_thumb.jpg")
+        self.assertTrue(reference.vector_done and reference.face_done)
+        self.assertEqual(list(reference.ai_label_ids.values_list("name", flat=True)), ["猫"])
+        self.assertEqual(reference.renditions.get().file.name, "r/a_256.webp")
+        self.assertEqual(PhotoFace.objects.filter(photo=reference).count(), 1)
+        self.assertEqual(FaceGroup.objects.get(id=group.id).count, 2)
+        registry.upsert.assert_called_once()
+        self.assertEqual(registry.upsert.call_args.args[:2], (self.user.id, reference.id))
+
+    def test_delete_keeps_files_still_referenced(self):
+        (original,), _, _ = self._upload(self.album, self.data)
+        (reference,), _, _ = self._upload(self.other_album, self.data)
+        storage = original.image.storage
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        self.assertEqual(client.delete(f"/api/gallery/photos/{original.id}/").status_code, 204)
+        self.assertTrue(storage.exists(original.image.name))
+        self.assertIsNone(Photo.objects.get(id=reference.id).duplicate_of_id)
+
+        self.assertEqual(client.delete(f"/api/gallery/photos/{reference.id}/").status_code, 204)
+        self.assertFalse(storage.exists(original.image.name))
+
+    def test_finalize_duplicate_drops_uploaded_object(self):
+        (original,), _, _ = self._upload(self.album, self.data)
+        digest = original.content_hash
+        storage = MagicMock()
+        storage.object_sha256.return_value = digest
+        key = f"photos/{self.user.id}/{self.other_album.id}/x.jpg"
+
+        with patch("gallery.domain.albums.get_upload_storage_service", return_value=storage), \
+                patch("gallery.services.uploads.task_sync_duplicates") as sync_task:
+            photo = AlbumUseCase(self.user).finalize_upload(self.other_album.id, key, "again", [], sha256=digest)
+
+        self.assertEqual(photo.duplicate_of_id, original.id)
+        self.assertEqual(photo.title, "again")
+        storage.delete_object.assert_called_once_with(key)
+        sync_task.delay.assert_called_once_with([photo.id])
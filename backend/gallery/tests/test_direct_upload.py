@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+import unittest
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlsplit
+
+import boto3
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from ..models import Album
+from ..services.storage import get_upload_storage_service, reset_s3_clients
+
+try:
+    from moto import mock_aws
+except ImportError:  # pragma: no cover - moto 为可选的测试依赖
+    mock_aws = None
+
+S3_SETTINGS = dict(
+    STORAGE_BACKEND="s3",
+    AWS_STORAGE_BUCKET_NAME="gallery-test",
+    AWS_S3_ENDPOINT_URL=None,
+    AWS_S3_REGION_NAME="us-east-1",
+    AWS_ACCESS_KEY_ID="testing",
+    AWS_SECRET_ACCESS_KEY="testing",
+    AWS_S3_SIGNATURE_VERSION="s3v4",
+)
+
+
+@override_settings(**S3_SETTINGS)
+class DirectUploadBatchTests(TestCase):
+    def setUp(self) -> None:
+        reset_s3_clients()
+        self.addCleanup(reset_s3_clients)
+        self.user = User.objects.create_user(username="direct", password="pass")
+        self.album = Album.objects.create(name="D", description="", owner=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_client_is_shared_across_calls_and_threads(self):
+        sessions = []
+        real_session = boto3.session.Session
+
+        def counting_session(*args, **kwargs):
+            sessions.append(1)
+            return real_session(*args, **kwargs)
+
+        clients = []
+        with patch("gallery.services.storage.boto3.session.Session", side_effect=counting_session):
+            threads = [
+                threading.Thread(target=lambda: clients.append(get_upload_storage_service().client)) for _ in range(8)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(sessions), 1)
+        self.assertEqual(len({id(client) for client in clients}), 1)
+        self.assertEqual(clients[0].meta.config.max_pool_connections, 50)
+        with override_settings(GALLERY_S3_MAX_POOL_CONNECTIONS=8):
+            self.assertEqual(get_upload_storage_service().client.meta.config.max_pool_connections, 8)
+
+    def test_presign_batch(self):
+        digest = hashlib.sha256(b"photo").hexdigest()
+        files = [
+            {"filename": "a.jpg", "content_type": "image/jpeg", "size": 10, "sha256": digest},
+            {"filename": "b.png", "content_type": "image/png", "size": 20},
+        ]
+        response = self.client.post(
+            "/api/gallery/albums/presign_upload_batch/", {"album_id": self.album.id, "files": files}, format="json"
+        )
+
+        self.assertEqual(response.status_code, 200)
+        items = response.data["data"]["items"]
+        self.assertEqual(len(items), 2)
+        for item in items:
+            self.assertTrue(item["object_key"].startswith(f"photos/{self.user.id}/{self.album.id}/"))
+            self.assertIn(item["object_key"], item["url"])
+        self.assertIn("x-amz-checksum-sha256", items[0]["headers"])
+        self.assertEqual(items[1]["headers"], {"Content-Type": "image/png"})
+
+        files.append({"filename": "c.exe", "content_type": "application/x-msdownload", "size": 1})
+        response = self.client.post(
+            "/api/gallery/albums/presign_upload_batch/", {"album_id": self.album.id, "files": files}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("第 3 个文件", response.data[0])
+
+    @override_settings(GALLERY_PRESIGN_BATCH_MAX=3)
+    def test_sign_part_range(self):
+        object_key = f"photos/{self.user.id}/{self.album.id}/big.jpg"
+        response = self.client.post(
+            "/api/gallery/albums/multipart_sign_parts/",
+            {"object_key": object_key, "upload_id": "u-1", "start": 2, "end": 4},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        parts = response.data["data"]["parts"]
+        self.assertEqual([part["part_number"] for part in parts], [2, 3, 4])
+        for part in parts:
+            query = parse_qs(urlsplit(part["url"]).query)
+            self.assertEqual((query["partNumber"], query["uploadId"]), ([str(part["part_number"])], ["u-1"]))
+
+        too_many = self.client.post(
+            "/api/gallery/albums/multipart_sign_parts/",
+            {"object_key": object_key, "upload_id": "u-1", "part_numbers": [1, 2, 3, 4]},
+            format="json",
+        )
+        self.assertEqual(too_many.status_code, 400)
+        foreign = self.client.post(
+            "/api/gallery/albums/multipart_sign_parts/",
+            {"object_key": "photos/999/1/x.jpg", "upload_id": "u-1", "start": 1, "end": 2},
+            format="json",
+        )
+        self.assertEqual(foreign.status_code, 400)
+
+    @unittest.skipIf(mock_aws is None, "需要 moto")
+    def test_batch_signed_parts_upload_to_s3(self):
+        with mock_aws():
+            reset_s3_clients()
+            service = get_upload_storage_service()
+            service.client.create_bucket(Bucket="gallery-test")
+            object_key = f"photos/{self.user.id}/{self.album.id}/big.jpg"
+            upload_id = service.initiate_multipart(object_key, "image/jpeg")["UploadId"]
+
+            response = self.client.post(
+                "/api/gallery/albums/multipart_sign_parts/",
+                {"object_key": object_key, "upload_id": upload_id, "start": 1, "end": 2},
+                format="json",
+            )
+            self.assertEqual(response.status_code, 200)
+            chunks = [b"a" * 5 * 1024 * 1024, b"b" * 1024]
+            parts = []
+            for part, chunk in zip(response.data["data"]["parts"], chunks):
+                # 与客户端按 URL 直传等价：UploadPart 的请求参数与签名 URL 中一致
+                query = parse_qs(urlsplit(part["url"]).query)
+                result = service.client.upload_part(
+                    Bucket="gallery-test",
+                    Key=object_key,
+                    UploadId=query["uploadId"][0],
+                    PartNumber=int(query["partNumber"][0]),
+                    Body=chunk,
+                )
+                parts.append({"ETag": result["ETag"], "PartNumber": part["part_number"]})
+            service.complete_multipart(object_key, upload_id, parts)
+
+            head = service.client.head_object(Bucket="gallery-test", Key=object_key)
+            self.assertEqual(head["ContentLength"], sum(len(chunk) for chunk in chunks))
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import shutil
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from ..models import Album, FaceGroup, Photo, PhotoEmbedding, PhotoFace
+from ..services.imaging import ReducedImage
+from ..services.faces import (
+    FACE_MODEL_KEY,
+    FaceCentroidIndex,
+    FaceIndexRegistry,
+    bytes_to_encodings,
+    chinese_whispers,
+    encodings_to_bytes,
+    knn_graph,
+)
+from ..tasks_ai import task_face_embeddings_and_group
+from .test_clip_batching import _jpeg_bytes
+from .test_vector_index import LOCMEM_CACHE
+
+
+def _face(seed: int, noise: float = 0.0, base_seed: int | None = None):
+    rng = np.random.default_rng(seed)
+    base = np.random.default_rng(base_seed if base_seed is not None else seed).normal(size=128) * 0.1
+    return (base + rng.normal(size=128) * noise).astype("float32")
+
+
+class FaceCentroidIndexTests(SimpleTestCase):
+    def test_assign_matches_within_tol_and_updates_centroid(self):
+        index = FaceCentroidIndex()
+        index.add(1, _face(1), count=1)
+        index.add(2, _face(2), count=1)
+        near = _face(99, noise=0.01, base_seed=1)
+        result = index.assign(np.vstack([near, _face(3)]), tol=0.3)
+        self.assertEqual(result, [1, None])
+        np.testing.assert_allclose(index.centroid(1), (_face(1) + near) / 2, rtol=1e-5)
+
+    def test_one_group_per_photo(self):
+        index = FaceCentroidIndex()
+        index.add(1, _face(1), count=1)
+        faces = np.vstack([_face(7, noise=0.02, base_seed=1), _face(8, noise=0.01, base_seed=1)])
+        self.assertEqual(index.assign(faces, tol=0.5), [None, 1])
+
+
+class _FakeFaceService:
+    def __init__(self, faces):
+        self.faces = faces
+
+    def load_image_reduced(self, file_obj):
+        # 模拟 2 倍缩小解码：检测框需映射回原图坐标
+        return None, ReducedImage(image=None, original_size=(128, 96), scale=(2.0, 2.0))
+
+    def face_locations(self, image, model="hog"):
+        return [(0, 10, 10, 0)] * len(self.faces[0])
+
+    def face_encodings(self, image, known_face_locations):
+        return list(self.faces.pop(0))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class FaceGroupingTaskTests(TestCase):
+    def setUp(self) -> None:
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = User.objects.create_user(username="faces", password="pass")
+        album = Album.objects.create(name="Faces", description="", owner=self.user)
+        self.photos = [
+            Photo.objects.create(
+                owner=self.user,
+                album=album,
+                image=SimpleUploadedFile(f"{i}.jpg", _jpeg_bytes(), content_type="image/jpeg"),
+            )
+            for i in range(3)
+        ]
+        self.registry = FaceIndexRegistry()
+
+    def _run(self, photo, faces):
+        service = _FakeFaceService([faces])
+        with patch("gallery.tasks_ai.get_face_recognition_service", return_value=service), \
+                patch("gallery.tasks_ai.get_face_index_registry", return_value=self.registry), \
+                self.captureOnCommitCallbacks(execute=True):
+            return task_face_embeddings_and_group(photo.id, tol=0.3)
+
+    def test_same_person_joins_existing_group(self):
+        alice, bob = _face(1), _face(2)
+        self.assertEqual(self._run(self.photos[0], [alice, bob]), "ok")
+        self.assertEqual(self._run(self.photos[1], [_face(50, noise=0.01, base_seed=1)]), "ok")
+        # 新进程从数据库重建质心后依然能匹配
+        self.registry.invalidate()
+        self.assertEqual(self._run(self.photos[2], [_face(51, noise=0.01, base_seed=2)]), "ok")
+
+        self.assertEqual(FaceGroup.objects.count(), 2)
+        groups = {
+            p.id: list(PhotoFace.objects.filter(photo=p).order_by("face_index").values_list("face_group_id", flat=True))
+            for p in self.photos
+        }
+        alice_group, bob_group = groups[self.photos[0].id]
+        self.assertEqual(groups[self.photos[1].id], [alice_group])
+        self.assertEqual(groups[self.photos[2].id], [bob_group])
+        self.assertEqual(FaceGroup.objects.get(id=alice_group).count, 2)
+        self.assertEqual(PhotoFace.objects.filter(photo=self.photos[0]).first().bbox, [0, 20, 20, 0])
+
+        stored = PhotoEmbedding.objects.get(photo=self.photos[0], model_name=FACE_MODEL_KEY)
+        np.testing.assert_allclose(bytes_to_encodings(stored.vector), np.vstack([alice, bob]))
+
+
+class FaceClusteringTests(SimpleTestCase):
+    def test_knn_graph_matches_brute_force(self):
+        matrix = np.random.default_rng(0).normal(size=(300, 128)).astype("float32")
+        neighbors, distances = knn_graph(matrix, 5, row_chunk=64, col_chunk=100)
+        full = np.linalg.norm(matrix[:, None, :] - matrix[None, :, :], axis=2)
+        np.fill_diagonal(full, np.inf)
+        expected = np.argsort(full, axis=1)[:, :5]
+        np.testing.assert_array_equal(neighbors, expected)
+        np.testing.assert_allclose(distances, np.take_along_axis(full, expected, axis=1), rtol=1e-3)
+
+    def test_chinese_whispers_separates_people(self):
+        people = [_face(seed) for seed in range(3)]
+        matrix = np.vstack([_face(100 + i, noise=0.01, base_seed=i % 3) for i in range(30)])
+        neighbors, distances = knn_graph(matrix, 4)
+        labels = chinese_whispers(neighbors, distances, tol=0.5)
+        self.assertEqual(int(labels.max()) + 1, len(people))
+        for person in range(3):
+            self.assertEqual(len(set(labels[person::3].tolist())), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ReclusterFacesCommandTests(TestCase):
+    def setUp(self) -> None:
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = User.objects.create_user(username="recluster", password="pass")
+        album = Album.objects.create(name="Faces", description="", owner=self.user)
+        # 历史数据：每张人脸一个单例分组，两个人各 4 张照片
+        self.photos = []
+        for i in range(8):
+            group = FaceGroup.objects.create(owner=self.user, name="小明" if i == 0 else "", count=1)
+            photo = Photo.objects.create(
+                owner=self.user,
+                album=album,
+                image=SimpleUploadedFile(f"{i}.jpg", _jpeg_bytes(), content_type="image/jpeg"),
+            )
+            PhotoFace.objects.create(photo=photo, face_group=group, bbox=[1, 9, 9, 1])
+            photo.face_done = True
+            photo.save(update_fields=["face_done"])
+            PhotoEmbedding.objects.create(
+                photo=photo,
+                owner=self.user,
+                model_name=FACE_MODEL_KEY,
+                vector=encodings_to_bytes(_face(200 + i, noise=0.01, base_seed=i % 2)),
+            )
+            self.photos.append(photo)
+
+    def test_merges_singletons_and_keeps_names(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("recluster_faces", user=[self.user.id], k=3, stdout=StringIO())
+
+        self.assertEqual(FaceGroup.objects.filter(owner=self.user).count(), 2)
+        groups = [PhotoFace.objects.get(photo=p).face_group_id for p in self.photos]
+        self.assertEqual(len(set(groups[0::2])), 1)
+        self.assertEqual(len(set(groups[1::2])), 1)
+        named = FaceGroup.objects.get(id=groups[0])
+        self.assertEqual((named.name, named.count), ("小明", 4))
+        self.assertEqual(PhotoFace.objects.get(photo=self.photos[0]).bbox, [1, 9, 9, 1])
+
+    def test_auto_by_face_reads_join_table(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("recluster_faces", user=[self.user.id], k=3, stdout=StringIO())
+        group_id = PhotoFace.objects.get(photo=self.photos[1]).face_group_id
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get("/api/gallery/auto_albums/by_face/", {"face": group_id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(item["id"] for item in response.data), sorted(p.id for p in self.photos[1::2]))
+        self.assertEqual(client.get("/api/gallery/auto_albums/by_face/", {"face": "x"}).status_code, 400)
+
+        self.photos[1].delete()
+        self.assertEqual(FaceGroup.objects.get(id=group_id).count, 3)
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+from io import BytesIO
+
+from django.test import SimpleTestCase
+from PIL import Image
+
+from ..services.imaging import open_reduced
+
+
+def _jpeg(size, orientation=None) -> BytesIO:
+    buffer = BytesIO()
+    img = Image.new("RGB", size, (40, 90, 160))
+    exif = img.getexif()
+    if orientation:
+        exif[0x0112] = orientation
+    img.save(buffer, format="JPEG", exif=exif.tobytes())
+    buffer.seek(0)
+    return buffer
+
+
+class OpenReducedTests(SimpleTestCase):
+    def test_jpeg_uses_dct_scaling_and_keeps_minimum_size(self):
+        reduced = open_reduced(_jpeg((4000, 3000)), short_side=224)
+        self.assertEqual(reduced.image.size, (500, 375))
+        self.assertEqual(reduced.scale, (8.0, 8.0))
+        self.assertGreaterEqual(min(reduced.image.size), 224)
+
+    def test_small_image_is_not_upscaled(self):
+        reduced = open_reduced(_jpeg((200, 100)), long_side=300)
+        self.assertEqual(reduced.image.size, (200, 100))
+        self.assertEqual(reduced.scale, (1.0, 1.0))
+
+    def test_palette_and_bilevel_images_are_reduced(self):
+        for fmt, mode in (("GIF", "P"), ("PNG", "P"), ("PNG", "1")):
+            buffer = BytesIO()
+            Image.new("RGB", (1200, 800), (200, 40, 40)).convert(mode).save(buffer, format=fmt)
+            buffer.seek(0)
+            reduced = open_reduced(buffer, long_side=300)
+            self.assertEqual(reduced.image.size, (300, 200), (fmt, mode))
+            self.assertIn(reduced.image.mode, ("RGB", "L"))
+
+        buffer = BytesIO()
+        img = Image.new("P", (1200, 800))
+        img.save(buffer, format="PNG", transparency=0)
+        buffer.seek(0)
+        self.assertEqual(open_reduced(buffer, long_side=300).image.mode, "RGBA")
+
+    def test_png_falls_back_to_integer_reduce(self):
+        buffer = BytesIO()
+        Image.new("RGB", (2000, 1000)).save(buffer, format="PNG")
+        buffer.seek(0)
+        reduced = open_reduced(buffer, short_side=224)
+        self.assertEqual(reduced.image.size, (500, 250))
+
+    def test_boxes_map_to_upright_original(self):
+        # 方向 6：原图 4000×3000 摆正后为 3000×4000
+        reduced = open_reduced(_jpeg((4000, 3000), orientation=6), max_pixels=1_000_000)
+        self.assertEqual(reduced.original_size, (3000, 4000))
+        self.assertEqual(reduced.image.size, (1500, 2000))
+        self.assertEqual(reduced.map_box((10, 20, 30, 5)), [20, 40, 60, 10])
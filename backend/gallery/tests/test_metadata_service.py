@@ -1,14 +1,20 @@
 from __future__ import annotations
 
+import shutil
+import tempfile
+from io import BytesIO
 from unittest.mock import MagicMock, patch
 
+import numpy as np
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase, override_settings
 from django.utils import timezone
+from PIL import Image
 
 from ..models import Album, Photo
-from ..services.metadata import extract_exif_metadata
+from ..services.metadata import exif_updates, extract_exif_metadata, read_jpeg_header
+from ..services.uploads import create_photos_from_form_upload
 
 
 class ExtractExifMetadataTests(TestCase):
@@ -63,3 +69,64 @@ class ExtractExifMetadataTests(TestCase):
         self.assertNotIn("gps_lat", updates)
         self.assertNotIn("gps_lng", updates)
         self.assertEqual((updates["width"], updates["height"]), (200, 100))
+
+
+def _jpeg_with_exif(size=(800, 600), icc_bytes=0) -> bytes:
+    exif = Image.Exif()
+    exif[0x010F] = "TestCam"  # Make
+    exif.get_ifd(0x8769)[36867] = "2023:10:01 12:34:56"  # DateTimeOriginal
+    noise = np.random.default_rng(0).integers(0, 255, size=(size[1], size[0], 3), dtype="uint8")
+    buffer = BytesIO()
+    kwargs = {"icc_profile": bytes(icc_bytes)} if icc_bytes else {}
+    Image.fromarray(noise).save(buffer, format="JPEG", quality=95, exif=exif.tobytes(), **kwargs)
+    return buffer.getvalue()
+
+
+class JpegHeaderTests(SimpleTestCase):
+    def _fetcher(self, data):
+        calls = []
+
+        def fetch(offset, size):
+            calls.append((offset, size))
+            return data[offset : offset + size]
+
+        return fetch, calls
+
+    def test_reads_size_and_exif_from_header_only(self):
+        data = _jpeg_with_exif(icc_bytes=200_000)
+        fetch, calls = self._fetcher(data)
+
+        header = read_jpeg_header(fetch, window=16 * 1024)
+        updates = exif_updates(header.size, header.tags)
+
+        self.assertEqual((updates["width"], updates["height"]), (800, 600))
+        self.assertEqual(updates["camera_make"], "TestCam")
+        self.assertEqual(updates["taken_at"].year, 2023)
+        # 跳过 ICC 段内容，只读取了文件的一小部分
+        self.assertLess(sum(size for _, size in calls), len(data) // 2)
+
+    def test_non_jpeg_and_truncated_return_none(self):
+        buffer = BytesIO()
+        Image.new("RGB", (8, 8)).save(buffer, format="PNG")
+        self.assertIsNone(read_jpeg_header(self._fetcher(buffer.getvalue())[0]))
+        self.assertIsNone(read_jpeg_header(self._fetcher(_jpeg_with_exif()[:20])[0]))
+
+
+class InlineExifTests(TestCase):
+    def setUp(self) -> None:
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_user(username="inline", password="pass")
+        self.album = Album.objects.create(name="Inline", description="", owner=self.user)
+
+    def test_form_upload_extracts_exif_without_queueing(self):
+        upload = SimpleUploadedFile("exif.jpg", _jpeg_with_exif(size=(64, 48)), content_type="image/jpeg")
+        with patch("gallery.services.uploads.task_dispatch_upload_batch") as batch_task:
+            (photo,) = create_photos_from_form_upload(self.user, self.album, [upload])
+
+        batch_task.delay.assert_called_once_with([photo.id], [photo.id])
+        stored = Photo.objects.get(id=photo.id)
+        self.assertEqual((stored.width, stored.height, stored.camera_make), (64, 48, "TestCam"))
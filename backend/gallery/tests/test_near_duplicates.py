@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import random
+import shutil
+import tempfile
+from io import BytesIO
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from PIL import Image, ImageDraw
+from rest_framework.test import APIClient
+
+from ..models import Album, Photo
+from ..services import near_duplicates
+from ..services.near_duplicates import (
+    MultiIndexHash,
+    NearDuplicateIndexRegistry,
+    _load_user_hashes,
+    assign_near_group,
+    dhash,
+    hamming,
+    to_signed,
+    to_unsigned,
+)
+from ..tasks import generate_thumbnail
+from .test_clip_batching import _jpeg_bytes
+from .test_vector_index import LOCMEM_CACHE
+
+
+def _gradient(size=(120, 90)):
+    img = Image.new("L", size)
+    draw = ImageDraw.Draw(img)
+    for x in range(size[0]):
+        draw.line([(x, 0), (x, size[1])], fill=x * 7 % 256)
+    draw.ellipse([20, 20, 60, 60], fill=255)
+    return img.convert("RGB")
+
+
+def _jpeg(img, quality=90):
+    buf = BytesIO()
+    img.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+class DhashTests(SimpleTestCase):
+    def test_signed_round_trip_and_similarity(self):
+        self.assertEqual(to_signed(2**64 - 1), -1)
+        self.assertEqual(to_unsigned(-1), 2**64 - 1)
+        self.assertEqual(hamming(-1, 0), 64)
+
+        base = _gradient()
+        resized = base.resize((80, 60))
+        other = base.rotate(90, expand=True)
+        value = dhash(base)
+        self.assertTrue(-(2**63) <= value < 2**63)
+        self.assertLessEqual(hamming(value, dhash(resized)), 6)
+        self.assertGreater(hamming(value, dhash(other)), 6)
+
+    def test_multi_index_query_matches_brute_force(self):
+        rng = random.Random(7)
+        items = [(photo_id, to_signed(rng.getrandbits(64))) for photo_id in range(1, 400)]
+        # 在若干哈希附近造出近邻
+        for photo_id in range(400, 460):
+            source = items[rng.randrange(len(items))][1]
+            flips = sum(1 << bit for bit in rng.sample(range(64), rng.randint(0, 8)))
+            items.append((photo_id, to_signed(to_unsigned(source) ^ flips)))
+
+        index = MultiIndexHash(radius=6)
+        index.build(items[:300])
+        for photo_id, value in items[300:]:
+            index.add(photo_id, value)
+        index.remove(5)
+        expected_items = [item for item in items if item[0] != 5]
+
+        for photo_id, value in items[::7]:
+            expected = sorted(
+                (hamming(value, other), other_id)
+                for other_id, other in expected_items
+                if other_id != photo_id and hamming(value, other) <= 6
+            )
+            self.assertEqual(
+                index.query(value, exclude=photo_id), [(other_id, distance) for distance, other_id in expected]
+            )
+
+
+@override_settings(CACHES=LOCMEM_CACHE, GALLERY_RENDITION_SIZES="")
+class NearDuplicateGroupTests(TestCase):
+    def setUp(self) -> None:
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        near_duplicates.get_near_duplicate_registry().invalidate()
+        self.addCleanup(near_duplicates.get_near_duplicate_registry().invalidate)
+        self.user = User.objects.create_user(username="burst", password="pass")
+        self.album = Album.objects.create(name="Burst", description="", owner=self.user)
+
+    def _photo(self, data, **fields):
+        return Photo.objects.create(
+            owner=self.user,
+            album=self.album,
+            image=SimpleUploadedFile("p.jpg", data, content_type="image/jpeg"),
+            **fields,
+        )
+
+    def test_groups_merge_into_smallest_id(self):
+        # a 与 b、c 都不够近，d 同时靠近 a 与 c，把两组并成一组
+        a = self._photo(b"a", dhash=to_signed(0xFFFF_FFFF_0000_07FF))
+        b = self._photo(b"b", dhash=to_signed(0xFFFF_FFFF_0000_0000))
+        self.assertIsNone(assign_near_group(a))
+        self.assertIsNone(assign_near_group(b))
+        c = self._photo(b"c", dhash=to_signed(0xFFFF_FFFF_0000_0700))
+        self.assertEqual(assign_near_group(c), b.id)
+        d = self._photo(b"d", dhash=to_signed(0xFFFF_FFFF_0000_070F))
+        self.assertEqual(assign_near_group(d), a.id)
+
+        self.assertEqual(
+            sorted(Photo.objects.filter(near_group=a.id).values_list("id", flat=True)), [a.id, b.id, c.id, d.id]
+        )
+
+    def test_other_process_changes_are_synced_incrementally(self):
+        a = self._photo(b"a", dhash=0)
+        b = self._photo(b"b", dhash=to_signed(0xFF))
+        loads = []
+
+        def loader(user_id, photo_ids=None):
+            loads.append(photo_ids)
+            return _load_user_hashes(user_id, photo_ids)
+
+        web, worker = NearDuplicateIndexRegistry(loader=loader), NearDuplicateIndexRegistry(loader=loader)
+        self.assertEqual(web.get(self.user.id).member_ids(), {a.id, b.id})
+        worker.get(self.user.id)
+
+        c = self._photo(b"c", dhash=to_signed(0x3))
+        worker.add(self.user.id, c.id, c.dhash)
+        Photo.objects.filter(id=b.id).delete()
+        worker.remove(self.user.id, b.id)
+        loads.clear()
+
+        index = web.get(self.user.id)
+        self.assertEqual(loads, [[c.id]])
+        self.assertEqual(index.query(0), [(a.id, 0), (c.id, 2)])
+
+    def test_thumbnail_task_hashes_and_endpoint_lists_groups(self):
+        base = _gradient()
+        burst = [self._photo(_jpeg(base, quality=q)) for q in (95, 80, 60)]
+        lone = self._photo(_jpeg_bytes(size=(64, 48)))
+        for photo in burst + [lone]:
+            self.assertEqual(generate_thumbnail(photo.id), "ok")
+
+        groups = Photo.objects.filter(id__in=[p.id for p in burst]).values_list("near_group", flat=True)
+        self.assertEqual(set(groups), {burst[0].id})
+        self.assertIsNone(Photo.objects.get(id=lone.id).near_group)
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get("/api/gallery/photos/near_duplicates/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual((response.data[0]["group"], response.data[0]["count"]), (burst[0].id, 3))
+        self.assertEqual([item["id"] for item in response.data[0]["photos"]], [p.id for p in burst])
+
+        client.delete(f"/api/gallery/photos/{burst[1].id}/")
+        self.assertNotIn(burst[1].id, near_duplicates.get_near_duplicate_registry().get(self.user.id))
+        self.assertEqual(client.get("/api/gallery/photos/near_duplicates/?min_size=3").data, [])
@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import shutil
+import tempfile
+from contextlib import contextmanager
+from io import BytesIO
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+
+from ..models import Album, FaceGroup, Photo, PhotoEmbedding, PhotoFace
+from ..services.faces import FACE_MODEL_KEY, FaceIndexRegistry
+from ..services.uploads import dispatch_post_upload_tasks
+from ..tasks_pipeline import _decode_target, task_process_photo
+from .test_clip_batching import _FakeClip, _jpeg_bytes
+from .test_vector_index import LOCMEM_CACHE
+
+
+class _FakeFaceService:
+    def __init__(self):
+        self.shapes = []
+
+    def face_locations(self, image, model="hog"):
+        self.shapes.append(image.shape)
+        return [(0, 10, 10, 0)]
+
+    def face_encodings(self, image, known_face_locations):
+        return [np.full(128, 0.01, dtype="float32")]
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class FusedPipelineTests(TestCase):
+    def setUp(self) -> None:
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = User.objects.create_user(username="pipeline", password="pass")
+        album = Album.objects.create(name="Pipe", description="", owner=self.user)
+        self.photo = Photo.objects.create(
+            owner=self.user,
+            album=album,
+            image=SimpleUploadedFile("p.jpg", _jpeg_bytes(), content_type="image/jpeg"),
+        )
+        self.clip = _FakeClip(np.eye(30, dtype="float32"), image_rows=[3])
+        self.faces = _FakeFaceService()
+
+    def _run(self, stages=None):
+        with patch("gallery.tasks_pipeline.get_clip_embedding_service", return_value=self.clip), \
+                patch("gallery.tasks_pipeline.get_face_recognition_service", return_value=self.faces), \
+                patch("gallery.tasks_ai.get_embedding_index_registry", return_value=MagicMock()), \
+                patch("gallery.tasks_ai.get_face_index_registry", return_value=FaceIndexRegistry()), \
+                self.captureOnCommitCallbacks(execute=True):
+            return task_process_photo(self.photo.id, stages)
+
+    def test_all_stages_write_once(self):
+        self.assertEqual(self._run(), "ok:exif=ok,thumbnail=ok,clip=ok,faces=ok")
+
+        photo = Photo.objects.get(id=self.photo.id)
+        self.assertEqual(photo.thumbnail_state, Photo.ThumbnailState.READY)
+        self.assertEqual((photo.width, photo.height), (64, 48))
+        self.assertTrue(photo.vector_done and photo.ai_done and photo.face_done)
+        self.assertEqual(self.clip.batch_sizes, [1])
+        self.assertEqual(self.faces.shapes, [(48, 64, 3)])
+        self.assertTrue(PhotoEmbedding.objects.filter(photo=photo, model_name="fake/test").exists())
+        self.assertTrue(PhotoEmbedding.objects.filter(photo=photo, model_name=FACE_MODEL_KEY).exists())
+        self.assertEqual(FaceGroup.objects.get().count, 1)
+        self.assertEqual(PhotoFace.objects.get(photo=photo).bbox, [0, 10, 10, 0])
+
+    def test_selected_stages_only(self):
+        old_thumbnail = Photo.objects.get(id=self.photo.id).thumbnail.name
+        self.assertEqual(self._run(["clip", "thumbnail"]), "ok:thumbnail=ok,clip=ok")
+
+        photo = Photo.objects.get(id=self.photo.id)
+        self.assertNotEqual(photo.thumbnail.name, old_thumbnail)
+        self.assertIsNone(photo.width)
+        self.assertFalse(photo.face_done)
+        self.assertEqual(self.faces.shapes, [])
+
+    @override_settings(GALLERY_RENDITION_SIZES="")
+    def test_decode_target_covers_largest_stage(self):
+        self.assertIn("max_pixels", _decode_target(["thumbnail", "clip", "faces"]))
+        self.assertEqual(_decode_target(["thumbnail", "clip"]), {"short_side": 300})
+        self.assertEqual(_decode_target(["thumbnail"]), {"long_side": 300})
+        self.assertEqual(_decode_target(["clip"]), {"short_side": 224})
+        with override_settings(GALLERY_RENDITION_SIZES="256,2048"):
+            self.assertEqual(_decode_target(["thumbnail", "faces"]), {"long_side": 2048})
+
+    @override_settings(GALLERY_FUSED_PIPELINE=True)
+    def test_dispatch_uses_single_task(self):
+        with patch("gallery.services.uploads.task_process_photo") as fused, \
+                patch("gallery.services.uploads.generate_thumbnail") as thumb:
+            dispatch_post_upload_tasks(self.photo.id)
+        fused.delay.assert_called_once_with(self.photo.id)
+        thumb.delay.assert_not_called()
+
+    @override_settings(GALLERY_RENDITION_SIZES="256,2048", GALLERY_FACE_MAX_PIXELS=200_000)
+    def test_faces_use_pixel_budget_and_original_is_streamed(self):
+        self.photo.image.save("big.jpg", SimpleUploadedFile("big.jpg", _jpeg_bytes(size=(1600, 1200))), save=True)
+        real_open = self.photo.image.storage.open
+
+        class _NoReadAll(BytesIO):
+            def read(self, size=-1):
+                if size is None or size < 0:
+                    raise AssertionError("不应一次读入整个原图")
+                return super().read(size)
+
+        @contextmanager
+        def streamed(field_file):
+            with real_open(field_file.name, "rb") as src:
+                yield _NoReadAll(src.read())
+
+        with patch("gallery.tasks_pipeline.open_original", side_effect=streamed):
+            self.assertEqual(self._run(["exif", "thumbnail", "faces"]), "ok:exif=ok,thumbnail=ok,faces=ok")
+
+        (shape,) = self.faces.shapes
+        self.assertLessEqual(shape[0] * shape[1], 200_000)
+        self.assertEqual(Photo.objects.get(id=self.photo.id).width, 1600)
+        # 检测框按人脸输入的缩放比例映射回原图坐标
+        top, right, bottom, left = PhotoFace.objects.get(photo=self.photo).bbox
+        self.assertEqual((top, left), (0, 0))
+        self.assertAlmostEqual(right, 10 * 1600 / shape[1], delta=1)
+        self.assertAlmostEqual(bottom, 10 * 1200 / shape[0], delta=1)
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+from unittest.mock import patch
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from ..models import AiLabel, Album, Photo
+from ..services.ann import AnnConfig
+from ..services.vector_index import EmbeddingIndexRegistry
+from ..tasks_ai import relabel_user_photos
+from .test_clip_batching import _FakeClip
+from .test_vector_index import LOCMEM_CACHE
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class RelabelFromVectorsTests(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="relabel", password="pass")
+        album = Album.objects.create(name="Lib", description="", owner=self.user)
+        self.photos = [Photo.objects.create(owner=self.user, album=album) for _ in range(4)]
+        self.text_vectors = np.eye(30, dtype="float32")
+        # 第 i 张照片的向量与第 i*2 个标签一致
+        self.vectors = {photo.id: self.text_vectors[i * 2] for i, photo in enumerate(self.photos)}
+
+        def loader(user_id, photo_ids=None):
+            for photo_id, vector in self.vectors.items():
+                if photo_ids is None or photo_id in photo_ids:
+                    yield photo_id, vector
+
+        self.registry = EmbeddingIndexRegistry(
+            loader=loader, id_loader=lambda user_id: list(self.vectors), ann_config=AnnConfig(directory=None)
+        )
+
+    def test_replaces_labels_of_language_only(self):
+        stale = AiLabel.objects.create(name="旧标签", lang="zh")
+        other = AiLabel.objects.create(name="beach", lang="en")
+        self.photos[0].ai_label_ids.add(stale, other)
+
+        clip = _FakeClip(self.text_vectors, image_rows=[])
+        with patch("gallery.tasks_ai.get_embedding_index_registry", return_value=self.registry):
+            processed = relabel_user_photos(clip, self.user.id, language="zh", top_k=1)
+
+        self.assertEqual(processed, 4)
+        labels = AiLabel.objects.filter(lang="zh").exclude(id=stale.id).order_by("id")
+        for i, photo in enumerate(self.photos):
+            names = set(photo.ai_label_ids.values_list("name", flat=True))
+            expected = {labels[i * 2].name} | ({"beach"} if i == 0 else set())
+            self.assertEqual(names, expected)
+        self.assertEqual(Photo.objects.filter(ai_done=True).count(), 4)
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import threading
+from io import BytesIO
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from ..models import Album, Photo
+from ..services import render as render_service
+from ..services.blob_cache import BlobCache
+from ..services.render import parse_render_spec
+from .test_clip_batching import _jpeg_bytes
+
+
+@override_settings(GALLERY_RENDER_SIZES="128,512,1024", GALLERY_RENDITION_FORMATS="webp,jpeg")
+class RenderSpecTests(SimpleTestCase):
+    def test_snaps_up_to_allowed_sizes(self):
+        spec = parse_render_spec({"w": "300"}, accept="image/avif,image/webp,*/*")
+        self.assertEqual((spec.width, spec.height, spec.format), (512, 1024, "webp"))
+        self.assertEqual(parse_render_spec({"w": "5000", "h": "90", "fmt": "jpg"}).width, 1024)
+        self.assertEqual(parse_render_spec({"h": "90"}).format, "jpeg")
+
+    def test_rejects_invalid_params(self):
+        for params in ({}, {"w": "abc"}, {"w": "-1"}, {"w": "100", "fmt": "gif"}):
+            with self.subTest(params=params), self.assertRaises(ValueError):
+                parse_render_spec(params)
+
+
+class CoalescingTests(SimpleTestCase):
+    def test_concurrent_misses_produce_once(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        cache = BlobCache(root, max_bytes=1024 * 1024)
+        calls = []
+        gate = threading.Event()
+
+        def produce(out):
+            calls.append(1)
+            gate.wait(1)
+            out.write(b"rendered")
+
+        threads = [threading.Thread(target=cache.get_or_create, args=("k", produce)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        gate.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.key_path("k").read_bytes(), b"rendered")
+        self.assertEqual(cache.stats()["misses"], 1)
+
+
+@override_settings(GALLERY_RENDER_SIZES="128,512", GALLERY_RENDITION_FORMATS="webp,jpeg")
+class RenderEndpointTests(TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.tmp + "/media", GALLERY_RENDER_CACHE_DIR=self.tmp + "/renders")
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = User.objects.create_user(username="render", password="pass")
+        album = Album.objects.create(name="R", description="", owner=self.user)
+        self.photo = Photo.objects.create(
+            owner=self.user,
+            album=album,
+            image=SimpleUploadedFile("r.jpg", _jpeg_bytes(size=(1600, 1200)), content_type="image/jpeg"),
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f"/api/gallery/photos/{self.photo.id}/render/"
+
+    def test_renders_once_and_revalidates(self):
+        with patch("gallery.services.render.open_reduced", wraps=render_service.open_reduced) as decode:
+            first = self.client.get(self.url, {"w": "100"}, HTTP_ACCEPT="image/webp,*/*")
+            second = self.client.get(self.url, {"w": "100"}, HTTP_ACCEPT="image/webp,*/*")
+        self.assertEqual(decode.call_count, 1)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first["Content-Type"], "image/webp")
+        self.assertIn("immutable", first["Cache-Control"])
+        self.assertEqual(first["ETag"], second["ETag"])
+        with Image.open(BytesIO(b"".join(first.streaming_content))) as img:
+            self.assertEqual(img.size, (128, 96))
+
+        not_modified = self.client.get(
+            self.url, {"w": "100"}, HTTP_ACCEPT="image/webp,*/*", HTTP_IF_NONE_MATCH=first["ETag"]
+        )
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_if_none_match_parses_entity_tag_list(self):
+        etag = self.client.get(self.url, {"w": "100"}, HTTP_ACCEPT="image/webp,*/*")["ETag"]
+        for header, status in (
+            (f'"other", W/{etag}', 304),
+            ("*", 304),
+            (etag[1:-1], 200),  # 未加引号的不是合法实体标签
+            (f'"x{etag[1:]}', 200),  # 仅包含目标子串不算匹配
+        ):
+            with self.subTest(header=header):
+                response = self.client.get(
+                    self.url, {"w": "100"}, HTTP_ACCEPT="image/webp,*/*", HTTP_IF_NONE_MATCH=header
+                )
+                self.assertEqual(response.status_code, status)
+                self.assertEqual(response["ETag"], etag)
+
+    def test_serves_render_evicted_after_open(self):
+        self.client.get(self.url, {"w": "100"}, HTTP_ACCEPT="image/webp,*/*")
+        real_utime = os.utime
+
+        def evict_then_touch(target, *args, **kwargs):
+            if os.path.exists(target):
+                os.unlink(target)
+            return real_utime(target, *args, **kwargs)
+
+        with patch("gallery.services.blob_cache.os.utime", side_effect=evict_then_touch), \
+                patch("gallery.services.render.open_reduced", side_effect=AssertionError("不应重新渲染")):
+            response = self.client.get(self.url, {"w": "100"}, HTTP_ACCEPT="image/webp,*/*")
+        self.assertEqual(response.status_code, 200)
+        with Image.open(BytesIO(b"".join(response.streaming_content))) as img:
+            self.assertEqual(img.size, (128, 96))
+
+    def test_bad_params_and_other_users(self):
+        self.assertEqual(self.client.get(self.url, {"fmt": "webp"}).status_code, 400)
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username="other", password="pass"))
+        self.assertEqual(other.get(self.url, {"w": "128"}).status_code, 404)
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import shutil
+import tempfile
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from ..models import Album, Photo, PhotoRendition
+from ..services.renditions import render_renditions
+from ..tasks import generate_thumbnail
+from .test_clip_batching import _jpeg_bytes
+
+
+@override_settings(GALLERY_RENDITION_SIZES="64,256,1024", GALLERY_RENDITION_FORMATS="webp,jpeg")
+class RenditionTests(TestCase):
+    def setUp(self) -> None:
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_user(username="renditions", password="pass")
+        self.album = Album.objects.create(name="R", description="", owner=self.user)
+
+    def test_render_skips_upscaling(self):
+        rendered = render_renditions(Image.new("RGB", (400, 300)))
+        self.assertEqual(
+            sorted((item.size, item.format, item.width, item.height) for item in rendered),
+            [(64, "jpeg", 64, 48), (64, "webp", 64, 48), (256, "jpeg", 256, 192), (256, "webp", 256, 192)],
+        )
+
+    def test_task_stores_renditions_and_serializer_lists_srcset(self):
+        photo = Photo.objects.create(
+            owner=self.user,
+            album=self.album,
+            image=SimpleUploadedFile("big.jpg", _jpeg_bytes(size=(640, 480)), content_type="image/jpeg"),
+        )
+        self.assertEqual(generate_thumbnail(photo.id), "ok")
+        self.assertEqual(PhotoRendition.objects.filter(photo=photo).count(), 4)
+        webp = PhotoRendition.objects.get(photo=photo, size=256, format="webp")
+        self.assertEqual((webp.width, webp.height), (256, 192))
+        with webp.file.open("rb") as fh, Image.open(fh) as img:
+            self.assertEqual(img.format, "WEBP")
+
+        # 已有缩略图与派生图时跳过
+        self.assertEqual(generate_thumbnail(photo.id), "skip:has_thumbnail")
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(f"/api/gallery/photos/?album={self.album.id}")
+        self.assertEqual(response.status_code, 200)
+        payload = response.json()
+        items = payload["results"] if isinstance(payload, dict) else payload
+        srcset = items[0]["renditions"]
+        self.assertEqual(set(srcset), {"webp", "jpeg"})
+        self.assertRegex(srcset["webp"], r"_64\.webp 64w, .*_256\.webp 256w$")
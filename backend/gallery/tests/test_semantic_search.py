@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from ..models import Album, Photo, PhotoEmbedding
+from ..services.ai import ClipEmbeddingService, get_clip_embedding_service
+from ..services.vector_index import EmbeddingIndexRegistry
+
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class SemanticSearchViewTests(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="searcher", password="pass")
+        self.album = Album.objects.create(name="Trip", description="", owner=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.photos = []
+        for i, vec in enumerate(np.eye(3, dtype="float32")):
+            photo = Photo.objects.create(
+                owner=self.user,
+                album=self.album,
+                title=f"p{i}",
+                image=f"photos/{i}.jpg",
+                thumbnail=f"photos/{i}_thumb.jpg",
+            )
+            PhotoEmbedding.objects.create(
+                photo=photo,
+                owner=self.user,
+                model_name=get_clip_embedding_service().model_key,
+                vector=ClipEmbeddingService.vector_to_bytes(vec),
+            )
+            self.photos.append(photo)
+
+    def _search(self, query_vector, **params):
+        clip = MagicMock()
+        clip.encode_query.return_value = np.asarray(query_vector, dtype="float32")
+        with patch("gallery.views.search.get_clip_embedding_service", return_value=clip), \
+                patch("gallery.views.search.get_embedding_index_registry", return_value=EmbeddingIndexRegistry()):
+            return self.client.get("/api/gallery/semantic_search/", params)
+
+    def test_results_are_ranked_by_similarity(self):
+        response = self._search([0.1, 0.9, 0.3], q="sunset at the beach", k=2)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item["title"] for item in response.json()], ["p1", "p2"])
+
+    def test_listing_query_skips_unrendered_columns(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self._search([1, 0, 0], q="beach", k=1)
+        self.assertEqual(response.json()[0]["title"], "p0")
+        photo_sql = [q["sql"] for q in ctx.captured_queries if 'FROM "gallery_photo" ' in q["sql"]]
+        self.assertEqual(len(photo_sql), 1)
+        self.assertNotIn("face_group_ids", photo_sql[0])
+
+    def test_missing_query_is_rejected(self):
+        response = self._search([1, 0, 0], q="  ")
+        self.assertEqual(response.status_code, 400)
+
+    def test_k_is_clamped_and_validated(self):
+        self.assertEqual(self._search([1, 0, 0], q="beach", k="abc").status_code, 400)
+        for k in ("0", "-5"):
+            with self.subTest(k=k):
+                response = self._search([1, 0, 0], q="beach", k=k)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual([item["title"] for item in response.json()], ["p0"])
+
+    def test_similar_photos_rejects_bad_nprobe(self):
+        with patch("gallery.views.recommend.get_embedding_index_registry", return_value=EmbeddingIndexRegistry()):
+            bad = self.client.get(f"/api/gallery/photos/{self.photos[0].id}/similar/", {"nprobe": "all"})
+            ok = self.client.get(f"/api/gallery/photos/{self.photos[0].id}/similar/", {"nprobe": "-3", "k": "1"})
+        self.assertEqual(bad.status_code, 400)
+        self.assertEqual(ok.status_code, 200)
+        self.assertEqual(len(ok.json()), 1)
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from ..ai_presets import get_labels
+from ..services.ai import ClipEmbeddingService, LRUCache, TextEmbeddingStore
+
+
+def _fake_encode(texts):
+    return np.arange(len(texts) * 4, dtype="float32").reshape(len(texts), 4)
+
+
+class LRUCacheTests(SimpleTestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+        self.assertEqual(len(cache), 2)
+
+
+class TextEmbeddingStoreTests(SimpleTestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.store = TextEmbeddingStore(Path(tmp.name))
+
+    def _service(self, **kwargs):
+        return ClipEmbeddingService(text_store=self.store, **kwargs)
+
+    def test_presets_are_persisted_across_processes(self):
+        labels = get_labels("zh")
+        first = self._service()
+        with patch.object(first, "_encode_texts_uncached", side_effect=_fake_encode) as encode:
+            first.encode_texts(labels, persist=True)
+        self.assertEqual(encode.call_count, 1)
+
+        # 模拟新进程：无内存缓存，只从磁盘预热，不触发编码
+        fresh = self._service()
+        with patch.object(fresh, "_encode_texts_uncached", side_effect=_fake_encode) as encode:
+            self.assertEqual(fresh.warm_label_presets(), 1)
+            vectors = fresh.encode_texts(labels)
+        encode.assert_not_called()
+        np.testing.assert_array_equal(vectors, _fake_encode(labels))
+
+    def test_failed_save_leaves_no_temp_file(self):
+        service = self._service()
+        for error in (OSError("disk full"), ValueError("bad array")):
+            with self.subTest(error=error), patch("gallery.services.ai._np.save", side_effect=error), \
+                    self.assertLogs("gallery.services.ai", level="WARNING"):
+                self.store.save(service, ["猫"], _fake_encode(["猫"]))
+            self.assertEqual(list(self.store.directory.iterdir()), [])
+
+    def test_store_is_keyed_by_model_and_label_set(self):
+        labels = ["猫", "狗"]
+        base = self.store.path_for(self._service(), labels)
+        self.assertNotEqual(base, self.store.path_for(self._service(pretrained="laion2b"), labels))
+        self.assertNotEqual(base, self.store.path_for(self._service(), labels + ["鸟"]))
+
+    def test_ad_hoc_queries_stay_bounded(self):
+        service = self._service()
+        service._query_cache = LRUCache(8)
+        with patch.object(service, "_encode_texts_uncached", side_effect=_fake_encode):
+            for i in range(100):
+                service.encode_query(f"query {i}")
+        self.assertEqual(len(service._query_cache), 8)
+        self.assertFalse(any(self.store.directory.glob("*.npy")))
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import shutil
+import struct
+import tempfile
+from io import BytesIO
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from ..models import Album, Photo
+from ..services.metadata import read_jpeg_header
+from ..services.uploads import create_photos_from_form_upload
+from ..tasks import generate_thumbnail
+from .test_clip_batching import _jpeg_bytes
+from .test_metadata_service import _jpeg_with_exif
+
+
+def _jpeg_with_embedded_thumbnail(size=(640, 480), orientation=6) -> bytes:
+    """手工构造带 IFD1 缩略图的 EXIF（Pillow 写 EXIF 时不会生成 IFD1）。"""
+
+    thumb_buffer = BytesIO()
+    Image.new("RGB", (40, 30), (255, 0, 0)).save(thumb_buffer, format="JPEG")
+    thumb = thumb_buffer.getvalue()
+    tiff = b"II*\x00" + struct.pack("<I", 8)
+    tiff += struct.pack("<H", 1) + struct.pack("<HHII", 0x0112, 3, 1, orientation) + struct.pack("<I", 26)
+    tiff += struct.pack("<H", 2)
+    tiff += struct.pack("<HHII", 0x0201, 4, 1, 56) + struct.pack("<HHII", 0x0202, 4, 1, len(thumb))
+    tiff += struct.pack("<I", 0) + thumb
+
+    buffer = BytesIO()
+    Image.new("RGB", size, (0, 0, 255)).save(buffer, format="JPEG", exif=b"Exif\x00\x00" + tiff)
+    return buffer.getvalue()
+
+
+class EmbeddedThumbnailTests(TestCase):
+    def setUp(self) -> None:
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_user(username="preview", password="pass")
+        self.album = Album.objects.create(name="Preview", description="", owner=self.user)
+
+    def test_header_exposes_oriented_preview(self):
+        data = _jpeg_with_embedded_thumbnail()
+        header = read_jpeg_header(lambda offset, size: data[offset : offset + size])
+        self.assertEqual(header.size, (640, 480))
+        # Orientation=6：预览需顺时针旋转 90°
+        self.assertEqual(header.preview_image().size, (30, 40))
+
+    def test_upload_shows_preview_until_full_thumbnail(self):
+        upload = SimpleUploadedFile("cam.jpg", _jpeg_with_embedded_thumbnail(), content_type="image/jpeg")
+        with patch("gallery.services.uploads.task_dispatch_upload_batch"):
+            (photo,) = create_photos_from_form_upload(self.user, self.album, [upload])
+
+        photo = Photo.objects.get(id=photo.id)
+        self.assertEqual(photo.thumbnail_state, Photo.ThumbnailState.PREVIEW)
+        preview_name = photo.thumbnail.name
+        self.assertTrue(preview_name.endswith("_preview.jpg"))
+
+        self.assertEqual(generate_thumbnail(photo.id), "ok")
+        photo.refresh_from_db()
+        self.assertEqual(photo.thumbnail_state, Photo.ThumbnailState.READY)
+        self.assertFalse(photo.thumbnail.storage.exists(preview_name))
+        with photo.thumbnail.open("rb") as fh, Image.open(fh) as thumb:
+            self.assertEqual(thumb.size, (225, 300))
+
+    def test_upload_never_decodes_original_in_request(self):
+        upload = SimpleUploadedFile("plain.jpg", _jpeg_bytes(size=(640, 480)), content_type="image/jpeg")
+        with patch("gallery.services.uploads.task_dispatch_upload_batch") as batch_task, \
+                patch("PIL.Image.Image.load", side_effect=AssertionError("上传请求内不应解码原图")):
+            (photo,) = create_photos_from_form_upload(self.user, self.album, [upload])
+
+        photo = Photo.objects.get(id=photo.id)
+        self.assertEqual(photo.thumbnail_state, Photo.ThumbnailState.PENDING)
+        self.assertFalse(photo.thumbnail)
+        self.assertEqual((photo.width, photo.height), (640, 480))
+        batch_task.delay.assert_called_once_with([photo.id], [photo.id])
+
+    def test_rest_create_dispatches_pipeline(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        upload = SimpleUploadedFile("api.jpg", _jpeg_with_exif(size=(96, 64)), content_type="image/jpeg")
+        with patch("gallery.services.uploads.task_dispatch_upload_batch") as batch_task:
+            response = client.post("/api/gallery/photos/", {"image": upload, "album": self.album.id, "title": "t"})
+
+        self.assertEqual(response.status_code, 201)
+        photo = Photo.objects.get(id=response.data["id"])
+        self.assertEqual(
+            (photo.owner_id, photo.album_id, photo.title, photo.camera_make), (self.user.id, self.album.id, "t", "TestCam")
+        )
+        self.assertTrue(photo.content_hash)
+        batch_task.delay.assert_called_once_with([photo.id], [photo.id])
+
+        other = Album.objects.create(name="Other", description="", owner=User.objects.create_user(username="o"))
+        upload = SimpleUploadedFile("x.jpg", _jpeg_bytes(), content_type="image/jpeg")
+        with patch("gallery.services.uploads.task_dispatch_upload_batch") as batch_task:
+            response = client.post("/api/gallery/photos/", {"image": upload, "album": other.id})
+        self.assertEqual(response.status_code, 403)
+        batch_task.delay.assert_not_called()
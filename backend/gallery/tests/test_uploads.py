@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import shutil
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+
+import hashlib
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from ..models import Album, Photo
+from ..services.upload_handlers import GalleryUploadHandler, HashedUploadedFile, sniff_image_type
+from ..services.uploads import create_photos_from_form_upload, fan_out_upload_batch
+from .test_clip_batching import _jpeg_bytes
+from .test_metadata_service import _jpeg_with_exif
+
+
+class UploadHandlerTests(SimpleTestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        override = override_settings(GALLERY_UPLOAD_TEMP_DIR=self.tmp)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def _receive(self, name, data, content_type="application/octet-stream", chunk=1024):
+        handler = GalleryUploadHandler()
+        handler.new_file("images", name, content_type, len(data))
+        for start in range(0, len(data), chunk):
+            self.assertIsNone(handler.receive_data_chunk(data[start : start + chunk], start))
+        uploaded = handler.file_complete(len(data))
+        self.addCleanup(uploaded.close)
+        return uploaded
+
+    def test_hash_type_and_header_while_receiving(self):
+        data = _jpeg_with_exif(size=(320, 240), icc_bytes=5000)
+        uploaded = self._receive("cam.bin", data)
+
+        self.assertIsInstance(uploaded, HashedUploadedFile)
+        self.assertEqual(uploaded.sha256, hashlib.sha256(data).hexdigest())
+        self.assertEqual(uploaded.content_type, "image/jpeg")
+        self.assertEqual(uploaded.header.size, (320, 240))
+        self.assertEqual(uploaded.header.tags[0x010F], "TestCam")
+        self.assertEqual(Path(uploaded.temporary_file_path()).parent, Path(self.tmp))
+        self.assertEqual(uploaded.read(), data)
+
+    def test_non_jpeg_and_tiny_files(self):
+        png = self._receive("a.png", b"\x89PNG\r\n\x1a\n" + bytes(100))
+        self.assertEqual((png.sniffed_type, png.header), ("image/png", None))
+        tiny = self._receive("t.jpg", b"xyz", content_type="image/jpeg")
+        self.assertEqual((tiny.sniffed_type, tiny.content_type, tiny.size), (None, "image/jpeg", 3))
+        self.assertEqual(sniff_image_type(b"\x00\x00\x00\x18ftypheic"), "image/heic")
+
+
+class BulkFormUploadTests(TestCase):
+    def setUp(self) -> None:
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root, GALLERY_UPLOAD_TEMP_DIR=self.media_root + "/.uploads")
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_user(username="bulk", password="pass")
+        self.album = Album.objects.create(name="Bulk", description="", owner=self.user)
+
+    def test_single_insert_and_single_dispatch(self):
+        files = [
+            SimpleUploadedFile(f"{index}.jpg", _jpeg_bytes(size=(32 + index, 24)), content_type="image/jpeg")
+            for index in range(5)
+        ]
+        files.append(SimpleUploadedFile("x.png", b"not an image", content_type="image/png"))
+
+        with patch("gallery.services.uploads.task_dispatch_upload_batch") as batch_task, \
+                CaptureQueriesContext(connection) as queries:
+            photos = create_photos_from_form_upload(self.user, self.album, files)
+
+        inserts = [q["sql"] for q in queries.captured_queries if q["sql"].startswith('INSERT INTO "gallery_photo"')]
+        self.assertEqual(len(inserts), 1)
+        ids = [photo.id for photo in photos]
+        batch_task.delay.assert_called_once_with(ids, ids[:5])
+        self.assertEqual(
+            list(Photo.objects.filter(id__in=ids).order_by("id").values_list("width", flat=True)),
+            [32, 33, 34, 35, 36, None],
+        )
+        for photo in photos:
+            self.assertTrue(photo.image.storage.exists(photo.image.name))
+
+    def test_failed_insert_removes_written_files(self):
+        files = [SimpleUploadedFile("a.jpg", _jpeg_bytes(), content_type="image/jpeg")]
+        with patch("gallery.services.uploads.task_dispatch_upload_batch") as batch_task, \
+                patch.object(Photo.objects, "bulk_create", side_effect=RuntimeError("db down")), \
+                self.assertRaises(RuntimeError):
+            create_photos_from_form_upload(self.user, self.album, files)
+
+        batch_task.delay.assert_not_called()
+        self.assertFalse(Photo.objects.exists())
+        self.assertEqual([path for path in Path(self.media_root).rglob("*") if path.is_file()], [])
+
+    @override_settings(GALLERY_CLIP_BATCH_SIZE=2)
+    def test_fan_out_in_worker(self):
+        with patch("gallery.services.uploads.generate_thumbnail") as thumbnail_task, \
+                patch("gallery.services.uploads.extract_exif_task") as exif_task, \
+                patch("gallery.services.uploads.task_face_embeddings_and_group") as face_task, \
+                patch("gallery.services.uploads.task_clip_vector_and_labels_batch") as clip_task:
+            fan_out_upload_batch([1, 2, 3], [2])
+
+        self.assertEqual(thumbnail_task.delay.call_count, 3)
+        self.assertEqual([c.args for c in exif_task.delay.call_args_list], [(1,), (3,)])
+        self.assertEqual(face_task.delay.call_count, 3)
+        self.assertEqual([c.args for c in clip_task.delay.call_args_list], [([1, 2],), ([3],)])
+
+    def test_endpoint_streams_through_gallery_handler(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        upload = SimpleUploadedFile("exif.jpg", _jpeg_with_exif(size=(96, 64)), content_type="image/jpeg")
+        with patch("gallery.services.uploads.task_dispatch_upload_batch") as batch_task, \
+                patch("gallery.services.uploads.read_photo_header") as header_read:
+            response = client.post(f"/api/gallery/albums/{self.album.id}/upload/", {"images": [upload]})
+
+        self.assertEqual(response.status_code, 201)
+        header_read.assert_not_called()
+        photo = Photo.objects.get(id=response.data[0]["id"])
+        self.assertEqual((photo.width, photo.height, photo.camera_make), (96, 64, "TestCam"))
+        batch_task.delay.assert_called_once_with([photo.id], [photo.id])
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import shutil
+import tempfile
+from io import StringIO
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from ..models import Album, Photo, PhotoEmbedding
+from ..services.faces import FACE_MODEL_KEY, encodings_to_bytes
+from ..services.vector_codec import (
+    FORMAT_FLOAT16,
+    FORMAT_FLOAT32,
+    FORMAT_INT8,
+    FORMAT_PQ,
+    ProductQuantizer,
+    VectorCodec,
+    detect_format,
+    is_legacy_blob,
+    reset_vector_codec,
+)
+from ..services.vector_index import UserEmbeddingIndex
+
+
+def _unit_vectors(n, dim, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(n, dim)).astype("float32")
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class VectorCodecTests(SimpleTestCase):
+    def setUp(self) -> None:
+        self.vec = _unit_vectors(1, 512)[0]
+
+    def test_legacy_float32_blob_is_decoded(self):
+        blob = self.vec.tobytes()
+        self.assertTrue(is_legacy_blob(blob))
+        np.testing.assert_array_equal(VectorCodec(FORMAT_INT8).decode(blob), self.vec)
+
+    def test_round_trip_sizes_and_error(self):
+        cases = [(FORMAT_FLOAT32, 2052, 1e-7), (FORMAT_FLOAT16, 1028, 1e-3), (FORMAT_INT8, 520, 1e-2)]
+        for fmt, size, tol in cases:
+            with self.subTest(fmt=fmt):
+                blob = VectorCodec(fmt).encode(self.vec)
+                self.assertEqual(len(blob), size)
+                self.assertEqual(detect_format(blob), fmt)
+                decoded = VectorCodec().decode(blob)
+                self.assertLess(float(np.abs(decoded - self.vec).max()), tol)
+
+    def test_pq_codes_and_adc_scores(self):
+        matrix = _unit_vectors(600, 32, seed=1)
+        pq = ProductQuantizer.fit(matrix, m=8, iters=5)
+        codec = VectorCodec(FORMAT_PQ, pq=pq)
+        blob = codec.encode(matrix[0])
+        self.assertEqual(len(blob), 4 + 4 + 8)
+        self.assertEqual(detect_format(blob), FORMAT_PQ)
+
+        codes = pq.encode(matrix)
+        table = pq.distance_table(matrix[0])
+        np.testing.assert_allclose(pq.score_codes(codes, table), pq.decode(codes) @ matrix[0], rtol=1e-4, atol=1e-5)
+        self.assertEqual(int(np.argmax(pq.score_codes(codes, table))), 0)
+
+    def test_pq_blob_requires_matching_codebook(self):
+        matrix = _unit_vectors(300, 16, seed=2)
+        blob = VectorCodec(FORMAT_PQ, pq=ProductQuantizer.fit(matrix, m=4, iters=2)).encode(matrix[0])
+        other = ProductQuantizer.fit(matrix, m=4, iters=2, seed=5)
+        with self.assertRaises(ValueError):
+            VectorCodec(FORMAT_PQ, pq=other).decode(blob)
+
+
+class QuantizedIndexTests(SimpleTestCase):
+    def test_low_precision_storage_keeps_ranking(self):
+        matrix = _unit_vectors(400, 64, seed=3)
+        ids = list(range(400))
+        exact = UserEmbeddingIndex()
+        exact.build(ids, matrix)
+        expected = [pid for pid, _ in exact.search(matrix[10], 10)]
+        for storage in ("float16", "int8"):
+            with self.subTest(storage=storage):
+                index = UserEmbeddingIndex(storage=storage)
+                index.build(ids, matrix)
+                self.assertEqual(index.matrix.dtype, np.dtype(storage))
+                got = [pid for pid, _ in index.search(matrix[10], 10)]
+                self.assertEqual(got[0], 10)
+                self.assertGreaterEqual(len(set(got) & set(expected)), 9)
+
+    def test_pq_storage_scores_codes_with_adc(self):
+        matrix = _unit_vectors(400, 64, seed=3)
+        pq = ProductQuantizer.fit(matrix, m=16)
+        index = UserEmbeddingIndex(storage="pq", pq=pq)
+        index.build(range(400), matrix)
+        self.assertEqual((index.matrix.dtype, index.matrix.shape), (np.dtype("uint8"), (400, 16)))
+
+        with patch.object(pq, "decode", side_effect=AssertionError("打分不应解码")):
+            got = index.search(matrix[10], 5, exclude=[3])
+        self.assertEqual(got[0][0], 10)
+        self.assertNotIn(3, [pid for pid, _ in got])
+        table = pq.distance_table(matrix[10])
+        self.assertAlmostEqual(got[0][1], float(pq.score_codes(pq.encode(matrix[10]), table)[0]), places=5)
+        self.assertEqual(index.get_vector(10).shape, (64,))
+
+
+class ReencodeCommandTests(TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        self.addCleanup(reset_vector_codec)
+        user = User.objects.create_user(username="codec", password="pass")
+        album = Album.objects.create(name="C", description="", owner=user)
+        vectors = _unit_vectors(4, 512)
+        self.clip_ids = []
+        for i, vec in enumerate(vectors):
+            photo = Photo.objects.create(owner=user, album=album, image=f"photos/{i}.jpg")
+            embedding = PhotoEmbedding.objects.create(
+                photo=photo, owner=user, model_name="fake/test", vector=VectorCodec().encode(vec)
+            )
+            self.clip_ids.append(embedding.id)
+        self.face_blob = encodings_to_bytes(_unit_vectors(3, 128, seed=1))
+        self.face = PhotoEmbedding.objects.create(
+            photo=photo, owner=user, model_name=FACE_MODEL_KEY, vector=self.face_blob
+        )
+
+    def test_only_clip_rows_are_trained_and_reencoded(self):
+        codebook = Path(self.tmp) / "pq.npz"
+        with override_settings(GALLERY_VECTOR_CODEC=FORMAT_PQ, GALLERY_VECTOR_PQ_CODEBOOK=str(codebook)), \
+                patch(
+                    "gallery.management.commands.reencode_clip_vectors.get_clip_embedding_service",
+                    return_value=SimpleNamespace(model_key="fake/test"),
+                ), \
+                patch("gallery.management.commands.reencode_clip_vectors.notify_vectors_changed") as notify:
+            reset_vector_codec()
+            call_command("reencode_clip_vectors", "--train-pq", "--pq-subspaces", "8", stdout=StringIO())
+
+        blobs = dict(PhotoEmbedding.objects.values_list("id", "vector"))
+        self.assertEqual({detect_format(bytes(blobs[i])) for i in self.clip_ids}, {FORMAT_PQ})
+        self.assertEqual(bytes(blobs[self.face.id]), self.face_blob)
+        photo_ids = list(PhotoEmbedding.objects.filter(id__in=self.clip_ids).order_by("id").values_list("photo_id", flat=True))
+        notify.assert_called_once_with(self.face.owner_id, photo_ids)
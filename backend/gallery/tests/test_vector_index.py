@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import numpy as np
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from ..services.vector_index import EmbeddingIndexRegistry, UserEmbeddingIndex, notify_vectors_changed
+
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+class UserEmbeddingIndexTests(SimpleTestCase):
+    def setUp(self) -> None:
+        rng = np.random.default_rng(0)
+        self.vectors = rng.normal(size=(50, 16)).astype("float32")
+        self.ids = list(range(100, 150))
+        self.index = UserEmbeddingIndex()
+        self.index.build(self.ids, self.vectors)
+
+    def _brute_force(self, query, k, exclude=()):
+        normed = self.vectors / np.linalg.norm(self.vectors, axis=1, keepdims=True)
+        scores = normed @ (query / np.linalg.norm(query))
+        ranked = [(pid, s) for pid, s in zip(self.ids, scores) if pid not in exclude]
+        ranked.sort(key=lambda item: item[1], reverse=True)
+        return [pid for pid, _ in ranked[:k]]
+
+    def test_search_matches_brute_force(self):
+        query = self.vectors[7]
+        result = [pid for pid, _ in self.index.search(query, 5, exclude=[107])]
+        self.assertEqual(result, self._brute_force(query, 5, exclude=[107]))
+
+    def test_remove_keeps_remaining_rows_addressable(self):
+        self.assertTrue(self.index.remove(100))
+        self.assertFalse(self.index.remove(100))
+        self.assertEqual(len(self.index), 49)
+        # 末行被回填到被删除的位置，仍能按 id 命中
+        hits = self.index.search(self.vectors[49], 1)
+        self.assertEqual(hits[0][0], 149)
+        self.assertNotIn(100, [pid for pid, _ in self.index.search(self.vectors[0], 50)])
+
+    def test_upsert_replaces_existing_vector(self):
+        self.index.upsert(120, self.vectors[3])
+        self.assertEqual(len(self.index), 50)
+        np.testing.assert_allclose(self.index.get_vector(120), self.index.get_vector(103), rtol=1e-6)
+
+    def test_top_queries_matches_per_row_ranking(self):
+        queries = self.vectors[[3, 8, 21, 40]]
+        ids, indices = self.index.top_queries(queries, 2)
+        self.assertEqual(ids.tolist(), self.ids)
+        self.assertEqual(indices.shape, (50, 2))
+        # 每个查询向量对应的行，自身应排在第一位
+        self.assertEqual(indices[[3, 8, 21, 40], 0].tolist(), [0, 1, 2, 3])
+
+    def test_k_larger_than_index(self):
+        self.assertEqual(len(self.index.search(self.vectors[0], 500, exclude=[100])), 49)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class EmbeddingIndexRegistryTests(SimpleTestCase):
+    def setUp(self) -> None:
+        self.store = {1: np.ones(4, dtype="float32"), 2: np.array([1, 0, 0, 0], dtype="float32")}
+        self.load_calls = []
+
+        def loader(user_id, photo_ids=None):
+            self.load_calls.append(photo_ids)
+            for pid, vec in self.store.items():
+                if photo_ids is None or pid in photo_ids:
+                    yield pid, vec
+
+        self.registry = EmbeddingIndexRegistry(loader=loader, id_loader=lambda user_id: list(self.store))
+
+    def test_remote_changes_are_synced_incrementally(self):
+        index = self.registry.get(7)
+        self.assertEqual(len(index), 2)
+
+        # 模拟另一个进程写入新向量并删除旧向量
+        self.store[3] = np.array([0, 1, 0, 0], dtype="float32")
+        del self.store[1]
+        other = EmbeddingIndexRegistry()
+        other.upsert(7, 3, self.store[3])
+
+        index = self.registry.get(7)
+        self.assertEqual(sorted(int(pid) for pid in index.ids), [2, 3])
+        self.assertEqual(self.load_calls[-1], [3])
+
+    def test_rewritten_vector_is_reloaded_in_other_process(self):
+        index = self.registry.get(7)
+        worker = EmbeddingIndexRegistry(loader=self.registry._loader, id_loader=self.registry._id_loader)
+        worker.get(7)
+
+        # 另一个进程为已在索引中的照片重新计算了向量
+        self.store[2] = np.array([0, 0, 0, 1], dtype="float32")
+        worker.upsert(7, 2, self.store[2])
+
+        index = self.registry.get(7)
+        self.assertEqual(self.load_calls[-1], [2])
+        np.testing.assert_allclose(index.get_vector(2), self.store[2], atol=1e-6)
+        self.assertEqual(index.search(self.store[2], 1)[0][0], 2)
+
+    def test_missing_change_records_fall_back_to_full_reload(self):
+        index = self.registry.get(7)
+        self.store[1] = np.array([0, 0, 1, 0], dtype="float32")
+        notify_vectors_changed(7, [1])
+        cache.delete_many([f"embedding_index_changes_7_{v}" for v in range(1, 10)])
+
+        index = self.registry.get(7)
+        self.assertEqual(sorted(self.load_calls[-1]), [1, 2])
+        np.testing.assert_allclose(index.get_vector(1), self.store[1], atol=1e-6)
+
+    def test_local_upsert_does_not_trigger_sync(self):
+        self.registry.get(8)
+        self.registry.upsert(8, 5, np.array([0, 0, 1, 0], dtype="float32"))
+        calls = len(self.load_calls)
+        index = self.registry.get(8)
+        self.assertIn(5, index)
+        self.assertEqual(len(self.load_calls), calls)
@@ -12,6 +12,7 @@ from .views import (
     memories_today,
     public_share_view,
     search_photos,
+    semantic_search,
     similar_photos,
     timeline_photos,
 )
@@ -24,6 +25,7 @@ router.register("tags", TagViewSet, basename="tag")
 urlpatterns = router.urls + [
     path("share/<str:token>/", public_share_view),
     path("search/", search_photos),
+    path("semantic_search/", semantic_search),
     path("timeline/", timeline_photos),
     path("map_points/", map_points),
     path("map_clusters/", map_clusters),
@@ -3,7 +3,7 @@
 from .auto import auto_by_face, auto_by_label
 from .base import AlbumViewSet, PhotoViewSet, TagViewSet, public_share_view
 from .recommend import memories_today, similar_photos
-from .search import map_clusters, map_points, search_photos, timeline_photos
+from .search import map_clusters, map_points, search_photos, semantic_search, timeline_photos
 
 __all__ = [
     "AlbumViewSet",
@@ -13,6 +13,7 @@ __all__ = [
     "auto_by_label",
     "auto_by_face",
     "search_photos",
+    "semantic_search",
     "timeline_photos",
     "map_points",
     "map_clusters",
@@ -3,7 +3,7 @@ from django.db.models import Q
 from rest_framework import status, permissions
 from rest_framework.response import Response
 
-from ..models import Photo
+from ..models import Photo, PhotoFace
 from ..serializers import PhotoSerializer
 
 @api_view(["GET"])
@@ -23,7 +23,7 @@ def auto_by_label(request):
     if label_id:
         qs = qs.filter(ai_label_ids__id=label_id)
 
-    return Response(PhotoSerializer(qs.distinct(), many=True).data)
+    return Response(PhotoSerializer(qs.distinct().for_listing(), many=True).data)
 
 @api_view(["GET"])
 @permission_classes([permissions.IsAuthenticated])
@@ -34,6 +34,12 @@ def auto_by_face(request):
     face = request.query_params.get("face")
     if not face:
         return Response({"message": "缺少 face 参数"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        face_group_id = int(face)
+    except ValueError:
+        return Response({"message": "face 参数必须为整数"}, status=status.HTTP_400_BAD_REQUEST)
 
-    qs = Photo.objects.filter(owner=request.user, face_group_ids__contains=[face])
+    # 走 PhotoFace 的 (face_group, photo) 索引取照片 id，避免扫描整张照片表
+    photo_ids = PhotoFace.objects.filter(face_group_id=face_group_id).values("photo_id")
+    qs = Photo.objects.filter(owner=request.user, id__in=photo_ids).for_listing()
     return Response(PhotoSerializer(qs, many=True).data)
@@ -1,17 +1,45 @@
 from rest_framework import viewsets, status, permissions, filters
 from rest_framework.decorators import action, api_view
 from rest_framework.exceptions import ValidationError as DRFValidationError
+from rest_framework.negotiation import BaseContentNegotiation
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
 from drf_spectacular.utils import extend_schema
 from django.core.cache import cache
 from django.core.exceptions import ValidationError
+from django.http import FileResponse
+from django.utils.cache import get_conditional_response
 from core.settings import CACHE_TTL
 
 from ..models import Photo, Tag, AlbumShare
 from ..serializers import AlbumSerializer, PhotoSerializer, TagSerializer
 from ..domain import AlbumUseCase
+from ..domain.albums import MAX_PART_NUMBER
 from ..services import StorageBackendNotConfigured
+from ..services.dedup import delete_unused_files, photo_files
+from ..services.near_duplicates import near_duplicate_clusters
+from ..services.upload_handlers import GalleryUploadHandler
+from ..services.render import parse_render_spec, render_etag, render_key, render_photo
+
+
+class IgnoreAcceptNegotiation(BaseContentNegotiation):
+    """图片接口的 Accept 用于选择图片格式，不参与渲染器协商（错误响应仍为 JSON）。"""
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class GalleryMultiPartParser(MultiPartParser):
+    """multipart 解析时改用 ``GalleryUploadHandler``：边接收边计算哈希、识别类型并解析文件头。"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context["request"]
+        request._request.upload_handlers = [GalleryUploadHandler(request._request)]
+        return super().parse(stream, media_type, parser_context)
+
 
 class AlbumViewSet(viewsets.ModelViewSet):
     """相册管理"""
@@ -36,7 +64,7 @@ class AlbumViewSet(viewsets.ModelViewSet):
         self.get_use_case().create_album(serializer)
 
     @extend_schema(summary="上传图片", request=AlbumSerializer)
-    @action(detail=True, methods=["post"], parser_classes=[MultiPartParser, FormParser])
+    @action(detail=True, methods=["post"], parser_classes=[GalleryMultiPartParser, FormParser])
     def upload(self, request, pk=None):
         """上传图片"""
         album = self.get_use_case().get_album(int(pk))
@@ -76,9 +104,29 @@ class AlbumViewSet(viewsets.ModelViewSet):
         filename = request.data.get("filename") or "image.jpg"
         content_type = request.data.get("content_type") or "image/jpeg"
         size = int(request.data.get("size", 0))
+        sha256 = request.data.get("sha256") or ""
+        use_case = self.get_use_case()
+        try:
+            envelope = use_case.presign_upload(album_id, filename, content_type, size, sha256)
+        except StorageBackendNotConfigured as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        except ValidationError as exc:
+            raise DRFValidationError(exc.messages)
+        return Response(envelope.to_dict())
+
+    @action(methods=['post'], detail=False, url_path='presign_upload_batch')
+    def presign_upload_batch(self, request):
+        """
+        批量预签名直传
+        body: {album_id, files: [{filename, content_type, size, sha256?}]}
+        """
+        album_id = int(request.data.get("album_id", 0))
+        files = request.data.get("files")
+        if not isinstance(files, list):
+            raise DRFValidationError(["files 必须是数组"])
         use_case = self.get_use_case()
         try:
-            envelope = use_case.presign_upload(album_id, filename, content_type, size)
+            envelope = use_case.presign_uploads(album_id, files)
         except StorageBackendNotConfigured as exc:
             return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
         except ValidationError as exc:
@@ -89,11 +137,12 @@ class AlbumViewSet(viewsets.ModelViewSet):
     def finalize_upload(self, request):
         """
         客户端直传完成后回调
-        body: {album_id, object_key, title?, tag_ids?[]}
+        body: {album_id, object_key, title?, tag_ids?[], sha256?}
         """
         album_id = int(request.data.get("album_id", 0))
         object_key = request.data.get("object_key")
         title = request.data.get("title", "")
+        sha256 = request.data.get("sha256") or ""
         try:
             tag_ids = self._parse_tag_ids(request.data.get("tag_ids", []))
         except ValueError:
@@ -101,7 +150,7 @@ class AlbumViewSet(viewsets.ModelViewSet):
 
         use_case = self.get_use_case()
         try:
-            photo = use_case.finalize_upload(album_id, object_key, title, tag_ids)
+            photo = use_case.finalize_upload(album_id, object_key, title, tag_ids, sha256)
         except ValidationError as exc:
             raise DRFValidationError(exc.messages)
         except StorageBackendNotConfigured as exc:
@@ -151,6 +200,36 @@ class AlbumViewSet(viewsets.ModelViewSet):
 
         return Response(envelope.to_dict())
 
+    @action(methods=['post'], detail=False, url_path='multipart_sign_parts')
+    def multipart_sign_parts(self, request):
+        """
+        批量分片签名
+        body: {object_key, upload_id, part_numbers: [int]} 或 {object_key, upload_id, start, end}（含两端）
+        """
+        object_key = request.data.get("object_key")
+        upload_id = request.data.get("upload_id")
+        try:
+            if "part_numbers" in request.data:
+                part_numbers = [int(number) for number in request.data.get("part_numbers") or []]
+            else:
+                start = int(request.data.get("start", 1))
+                end = int(request.data.get("end", 0))
+                if end - start >= MAX_PART_NUMBER:
+                    raise ValueError
+                part_numbers = range(start, end + 1)
+        except (TypeError, ValueError):
+            raise DRFValidationError(["part_numbers 非法"])
+
+        use_case = self.get_use_case()
+        try:
+            envelope = use_case.sign_multipart_parts(object_key, upload_id, part_numbers)
+        except StorageBackendNotConfigured as exc:
+            return Response({"detail": str(exc)}, status=400)
+        except ValidationError as exc:
+            raise DRFValidationError(exc.messages)
+
+        return Response(envelope.to_dict())
+
     @action(methods=['post'], detail=False, url_path='multipart_complete')
     def multipart_complete(self, request):
         """
@@ -183,20 +262,87 @@ class PhotoViewSet(viewsets.ModelViewSet):
     """图片管理"""
     serializer_class = PhotoSerializer
     permission_classes = [permissions.IsAuthenticated]
-    parser_classes = [MultiPartParser, FormParser]
+    parser_classes = [GalleryMultiPartParser, FormParser]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ["title", "tags__name"]
     ordering_fields = ["uploaded_at", "title"]
 
     def get_queryset(self):
-        return Photo.objects.filter(owner=self.request.user).order_by("-uploaded_at")
+        qs = Photo.objects.filter(owner=self.request.user).order_by("-uploaded_at")
+        if self.action == "list":
+            qs = qs.for_listing()
+        return qs
+
+    def perform_create(self, serializer):
+        """单张上传：与相册上传一致，接收时计算哈希并去重，请求内只读取文件头，其余交给异步流水线"""
+        try:
+            album_id = int(self.request.data.get("album", 0))
+        except (TypeError, ValueError):
+            raise DRFValidationError(["album 非法"])
+        use_case = AlbumUseCase(self.request.user)
+        album = use_case.get_album(album_id)
+        data = serializer.validated_data
+        serializer.instance = use_case.upload_photo(
+            album, data["image"], data.get("title", ""), [tag.id for tag in data.get("tag_ids", [])]
+        )
+
+    @action(
+        methods=["get"],
+        detail=True,
+        url_path="render",
+        content_negotiation_class=IgnoreAcceptNegotiation,
+    )
+    def render_image(self, request, pk=None):
+        """按需渲染：``?w=&h=&fmt=``，尺寸向上取整到允许的档位，结果走磁盘缓存。"""
+        photo = self.get_object()
+        try:
+            spec = parse_render_spec(request.query_params, request.headers.get("Accept", ""))
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        etag = render_etag(render_key(photo, spec))
+        # If-None-Match 按 RFC 9110 解析实体标签列表（支持 ``*`` 与 ``W/`` 弱比较）
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = FileResponse(render_photo(photo, spec), content_type=spec.content_type)
+        response["ETag"] = etag
+        # 内容由 key 唯一确定，不会变化；照片非公开，只允许浏览器私有缓存
+        response["Cache-Control"] = "private, max-age=31536000, immutable"
+        if not request.query_params.get("fmt"):
+            response["Vary"] = "Accept"
+        return response
+
+    @action(methods=["get"], detail=False, url_path="near_duplicates")
+    def near_duplicates(self, request):
+        """近重复分组（连拍、轻微编辑）：``?limit=&min_size=``，按组内张数降序"""
+        try:
+            limit = min(max(int(request.query_params.get("limit", 50)), 1), 200)
+            min_size = int(request.query_params.get("min_size", 2))
+        except ValueError:
+            return Response({"error": "limit 与 min_size 必须是整数"}, status=status.HTTP_400_BAD_REQUEST)
+
+        clusters = near_duplicate_clusters(request.user.id, limit=limit, min_size=min_size)
+        members = {}
+        photos = (
+            Photo.objects.filter(owner=request.user, near_group__in=[group for group, _ in clusters])
+            .for_listing()
+            .order_by("id")
+        )
+        for photo in photos:
+            members.setdefault(photo.near_group, []).append(photo)
+        return Response(
+            [
+                {"group": group, "count": size, "photos": PhotoSerializer(members.get(group, []), many=True).data}
+                for group, size in clusters
+            ]
+        )
 
     def perform_destroy(self, instance):
-        """删除时同时删除文件"""
-        instance.image.delete(save=False)
-        if instance.thumbnail:
-            instance.thumbnail.delete(save=False)
+        """删除时同时删除文件（引用行等仍在使用的文件保留）"""
+        files = photo_files(instance)
+        owner_id = instance.owner_id
         instance.delete()
+        delete_unused_files(owner_id, files)
 
 
 class TagViewSet(viewsets.ModelViewSet):
@@ -217,7 +363,7 @@ def public_share_view(request, token):
         share = AlbumShare.objects.select_related("album").get(token=token)
         if not share.is_valid():
             return Response({"error": "分享已过期"}, status=status.HTTP_410_GONE)
-        photos = share.album.photos.all().order_by("-uploaded_at")
+        photos = share.album.photos.for_listing().order_by("-uploaded_at")
         serializer = PhotoSerializer(photos, many=True)
         return Response({
             "album": share.album.name,
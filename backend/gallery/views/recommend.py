@@ -1,42 +1,50 @@
 from datetime import datetime
 
-import numpy as np
 from django.db.models.functions import ExtractDay, ExtractMonth
-from rest_framework import permissions
+from rest_framework import permissions, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 
-from ..models import Photo
+from ..models import Photo, PhotoEmbedding
 from ..serializers import PhotoSerializer
+from ..services import ClipEmbeddingService, get_clip_embedding_service, get_embedding_index_registry
 
+SIMILAR_MAX_K = 200
+# 探测簇数上限；超过簇总数时 IVF 自身会截断为全量探测
+SIMILAR_MAX_NPROBE = 256
 
-def _bytes_to_np(buffer):
-    return np.frombuffer(buffer, dtype="float32")
 
 @api_view(["GET"])
 @permission_classes([permissions.IsAuthenticated])
 def similar_photos(request, photo_id: int):
     """
-    找相似图片：余弦相似度 Top-K
+    找相似图片：余弦相似度 Top-K（基于用户向量矩阵索引）
     """
-    k = int(request.query_params.get("k", 12))
-    cur = Photo.objects.filter(id=photo_id, owner=request.user, clip_vector__isnull=False).first()
-    if not cur:
-        return Response({"detail": "未找到向量"}, status=404)
-    vec = _bytes_to_np(cur.clip_vector)
-    vec /= (np.linalg.norm(vec) + 1e-9)
-
-    # 候选集（同用户）
-    candidates = Photo.objects.filter(owner=request.user, clip_vector__isnull=False).exclude(id=photo_id)
-    scores = []
-    for p in candidates:
-        v = _bytes_to_np(p.clip_vector)
-        v /= (np.linalg.norm(v) + 1e-9)
-        s = float(np.dot(vec, v))
-        scores.append((s, p.id))
-    scores.sort(reverse=True)
-    top_ids = [pid for _, pid in scores[:k]]
-    items = Photo.objects.filter(id__in=top_ids)
+    try:
+        k = min(max(int(request.query_params.get("k", 12)), 1), SIMILAR_MAX_K)
+    except ValueError:
+        return Response({"message": "k 非法"}, status=status.HTTP_400_BAD_REQUEST)
+    nprobe = request.query_params.get("nprobe")
+    if nprobe:
+        try:
+            nprobe = min(max(int(nprobe), 1), SIMILAR_MAX_NPROBE)
+        except ValueError:
+            return Response({"message": "nprobe 非法"}, status=status.HTTP_400_BAD_REQUEST)
+    index = get_embedding_index_registry().get(request.user.id)
+    vec = index.get_vector(photo_id)
+    if vec is None:
+        blob = (PhotoEmbedding.objects
+                .filter(photo_id=photo_id, owner=request.user,
+                        model_name=get_clip_embedding_service().model_key)
+                .values_list("vector", flat=True)
+                .first())
+        if not blob:
+            return Response({"detail": "未找到向量"}, status=404)
+        vec = ClipEmbeddingService.bytes_to_vector(bytes(blob))
+
+    hits = index.search(vec, k, exclude=[photo_id], nprobe=nprobe or None)
+    top_ids = [pid for pid, _ in hits]
+    items = Photo.objects.filter(id__in=top_ids, owner=request.user).for_listing()
     # 保持排序
     id_idx = {pid: i for i, pid in enumerate(top_ids)}
     items = sorted(items, key=lambda x: id_idx[x.id])
@@ -50,6 +58,7 @@ def memories_today(request):
     today = datetime.utcnow()
     qs = (Photo.objects
           .filter(owner=request.user, taken_at__isnull=False)
+          .for_listing()
           .annotate(m=ExtractMonth("taken_at"), d=ExtractDay("taken_at"))
           .filter(m=today.month, d=today.day)
           .order_by("-taken_at")[:200])
@@ -2,12 +2,15 @@ from math import radians, cos, sin, asin, sqrt
 
 from django.db.models import Count, Max, Q
 from django.db.models.functions import TruncMonth
-from rest_framework import permissions
+from rest_framework import permissions, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 
 from ..models import Photo
 from ..serializers import PhotoSerializer
+from ..services import get_clip_embedding_service, get_embedding_index_registry
+
+SEMANTIC_SEARCH_MAX_K = 200
 
 def haversine(lat1, lon1, lat2, lon2):
     # 返回两点距离（km）
@@ -61,15 +64,44 @@ def search_photos(request):
         lng = float(lng)
         radius = float(radius)
         nearby_ids = []
-        for p in qs.filter(gps_lat__isnull=False, gps_lng__isnull=False):
-            if haversine(lat, lng, p.gps_lat, p.gps_lng) <= radius:
-                nearby_ids.append(p.id)
+        coords = qs.filter(gps_lat__isnull=False, gps_lng__isnull=False).values_list("id", "gps_lat", "gps_lng")
+        for pid, p_lat, p_lng in coords:
+            if haversine(lat, lng, p_lat, p_lng) <= radius:
+                nearby_ids.append(pid)
         qs = qs.filter(id__in=nearby_ids)
 
-    qs = qs.order_by("-taken_at", "-uploaded_at")[:500]
+    qs = qs.for_listing().order_by("-taken_at", "-uploaded_at")[:500]
     return Response(PhotoSerializer(qs, many=True).data)
 
 
+@api_view(["GET"])
+@permission_classes([permissions.IsAuthenticated])
+def semantic_search(request):
+    """语义搜索：CLIP 文本向量与用户照片向量批量打分，返回 Top-K"""
+    q = (request.query_params.get("q") or "").strip()
+    if not q:
+        return Response({"message": "缺少 q 参数"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        k = min(max(int(request.query_params.get("k", 24)), 1), SEMANTIC_SEARCH_MAX_K)
+    except ValueError:
+        return Response({"message": "k 非法"}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        vec = get_clip_embedding_service().encode_query(q)
+    except RuntimeError as exc:  # 依赖可选库
+        return Response({"detail": str(exc)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    hits = get_embedding_index_registry().get(request.user.id).search(vec, k)
+    top_ids = [pid for pid, _ in hits]
+    # 保持排序
+    id_idx = {pid: i for i, pid in enumerate(top_ids)}
+    items = sorted(
+        Photo.objects.filter(id__in=top_ids, owner=request.user).for_listing(),
+        key=lambda x: id_idx[x.id],
+    )
+    return Response(PhotoSerializer(items, many=True).data)
+
+
 @api_view(["GET"])
 @permission_classes([permissions.IsAuthenticated])
 def timeline_photos(request):
@@ -90,7 +122,9 @@ def timeline_photos(request):
 def map_points(request):
     """返回带坐标的聚合点"""
     user = request.user
-    qs = Photo.objects.filter(owner=user, gps_lat__isnull=False, gps_lng__isnull=False)
+    qs = (Photo.objects
+          .filter(owner=user, gps_lat__isnull=False, gps_lng__isnull=False)
+          .only("id", "gps_lat", "gps_lng", "thumbnail", "title"))
     points = []
     for p in qs:
         points.append({
@@ -109,17 +143,19 @@ def map_clusters(request):
     zoom = int(request.query_params.get("zoom", 8))
     cell_size = 360 / (2 ** zoom)  # 近似每格经度宽度
     user = request.user
-    qs = Photo.objects.filter(owner=user, gps_lat__isnull=False, gps_lng__isnull=False)
+    qs = (Photo.objects
+          .filter(owner=user, gps_lat__isnull=False, gps_lng__isnull=False)
+          .values_list("gps_lat", "gps_lng"))
 
     clusters = {}
-    for p in qs:
-        lat_idx = int(p.gps_lat / cell_size)
-        lng_idx = int(p.gps_lng / cell_size)
+    for p_lat, p_lng in qs:
+        lat_idx = int(p_lat / cell_size)
+        lng_idx = int(p_lng / cell_size)
         key = (lat_idx, lng_idx)
         clusters.setdefault(key, {"count": 0, "lat_sum": 0, "lng_sum": 0})
         clusters[key]["count"] += 1
-        clusters[key]["lat_sum"] += p.gps_lat
-        clusters[key]["lng_sum"] += p.gps_lng
+        clusters[key]["lat_sum"] += p_lat
+        clusters[key]["lng_sum"] += p_lng
 
     result = []
     for (k, v) in clusters.items():